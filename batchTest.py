@@ -9,6 +9,12 @@ import sys
 import os
 import csv
 import re
+import json
+import struct
+import numpy as np
+import sqlite3
+import itertools
+import multiprocessing
 
 
 # copy all records from payload table to test table in proper format
@@ -21,16 +27,183 @@ def populate_test_table():
     i = int(row1[0])
 
     while True:
-      row_p = pop_row(handle, DB_PAYLOAD_TABLE, False, i, False)
+      row_p = pop_row(handle, DB_PAYLOAD_TABLE, False, i, False, PAYLOAD_COLS)
       if row_p is None:
         break
       row_t_dict = {'url': row_p[1], 'parent_stats': row_p[2], 'html': row_p[3], 'tc': -1}
+      if row_feature_record(row_p) is not None:
+        row_t_dict['features'] = row_feature_record(row_p)
       insert_row_dict(handle, DB_BATCH_TEST_TABLE, row_t_dict)
       i += 1
 
 
-# runs through test batch, outputs paramter evolution as csv file
-def batch_test(filepath_out):
+# html-only feature records (pageAnalyze.feature_record) of the batch test pages are cached on
+# disk by html content hash & extractor version, so re-running a test only parses pages it
+# has not seen, & those are parsed by a process pool- only the learning pass is order dependent
+FEATURE_CACHE_VERSION = '%s:%s:%s' % (FEATURE_RECORD_VERSION, PARSE_MAX_BYTES, PARSE_MAX_TAGS)
+
+# batch test rows w/ the html replaced by its hash, computed by the db so that the html of
+# cached pages is never transferred
+HASHED_COLS = 'id, url, parent_stats, SHA1(html), tc, features'
+
+class featureCache:
+  def __init__(self, fpath=FEATURE_CACHE_FILE):
+    self.db = sqlite3.connect(fpath)
+    self.db.execute('CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, record TEXT)')
+
+
+  # --> { key: record } of the keys found
+  def get_many(self, keys):
+    found = {}
+    keys = list(set(keys))
+    for i in range(0, len(keys), 500):
+      q = 'SELECT key, record FROM records WHERE key IN (' + ', '.join(['?' for k in keys[i:i+500]]) + ')'
+      found.update(self.db.execute(q, keys[i:i+500]).fetchall())
+    return found
+
+
+  def put_many(self, items):
+    self.db.executemany('INSERT OR REPLACE INTO records (key, record) VALUES (?, ?)', items)
+    self.db.commit()
+
+
+  def close(self):
+    self.db.close()
+
+
+# pool entry point: html --> feature record, parsed in bounded mode as on the crawl node
+def _page_record(html):
+  return scan_page(html, None, PARSE_MAX_BYTES, PARSE_MAX_TAGS).feature_record()
+
+
+# iterate over a batch test table in id order --> (row, feature record), where
+# row = (id, url, parent_stats, html sha1, true_class, features); a row's own crawl-time
+# record is used if current, else the cached one, else the page is parsed & cached
+def featurized_rows(table_name=DB_BATCH_TEST_TABLE, workers=FEATURE_WORKERS, cache_fpath=FEATURE_CACHE_FILE):
+
+  # NOTE: the pool is forked before any db connections (incl. the cache's) are opened
+  pool = multiprocessing.Pool(workers) if workers > 0 else None
+  cache = featureCache(cache_fpath)
+  try:
+    with DB_connection(DB_VARS) as handle:
+      with DB_connection(DB_VARS) as html_handle:
+        rows = stream_rows(handle, table_name, BATCH_FETCH_SIZE, HASHED_COLS)
+        while True:
+          batch = list(itertools.islice(rows, BATCH_FETCH_SIZE))
+          if len(batch) == 0:
+            break
+          records = [row_feature_record(row) if read_feature_record(row_feature_record(row)) is not None else None for row in batch]
+          keys = ['%s:%s' % (FEATURE_CACHE_VERSION, row[3]) for row in batch]
+          cached = cache.get_many([k for k, r in zip(keys, records) if r is None])
+
+          # parse the rest in parallel, fetching their html on the second connection
+          missing = [i for i, r in enumerate(records) if r is None and not cached.has_key(keys[i])]
+          if len(missing) > 0:
+            html = dict(select_rows(html_handle, table_name, [batch[i][0] for i in missing], 'id, html'))
+            pages = [html[batch[i][0]] for i in missing]
+            parsed = pool.map(_page_record, pages) if pool is not None else map(_page_record, pages)
+            new = zip([keys[i] for i in missing], parsed)
+            cache.put_many(new)
+            cached.update(new)
+
+          for row, key, record in zip(batch, keys, records):
+            yield row, (record if record is not None else cached[key])
+  finally:
+    if pool is not None:
+      pool.terminate()
+    cache.close()
+
+
+# weight evolution log (.wlog) of a batch test: the weights each feedback changed, as chunks
+# of columns, then the readable names of all weights seen- so its size grows w/ the changes
+# made rather than rows x vocabulary, & it is written as the test runs
+#
+#   'RLWLOG'
+#   chunks:  'C' | u32 n | n x <i8 db_id | n x <i8 weight key | n x <f8 new value
+#   names:   'N' | u32 len | json { weight key: name }
+WLOG_MAGIC = 'RLWLOG'
+
+class weightLog:
+  def __init__(self, fpath, chunk_size=WEIGHT_LOG_CHUNK):
+    self.f = open(fpath, 'wb')
+    self.f.write(WLOG_MAGIC)
+    self.chunk_size = chunk_size
+    self.keys_seen = set()
+    self._reset()
+
+
+  def _reset(self):
+    self.ids = []
+    self.keys = []
+    self.vals = []
+    self.n = 0
+
+
+  def add(self, db_id, keys, vals):
+    self.ids.append(np.repeat(np.int64(db_id), len(keys)))
+    self.keys.append(np.asarray(keys, '<i8'))
+    self.vals.append(np.asarray(vals, '<f8'))
+    self.keys_seen.update(self.keys[-1].tolist())
+    self.n += len(keys)
+    if self.n >= self.chunk_size:
+      self._flush()
+
+
+  def _flush(self):
+    if self.n > 0:
+      self.f.write('C' + struct.pack('<I', self.n))
+      for col, dtype in [(self.ids, '<i8'), (self.keys, '<i8'), (self.vals, '<f8')]:
+        self.f.write(np.concatenate(col).astype(dtype).tostring())
+    self._reset()
+
+
+  def close(self, c):
+    self._flush()
+    keys = sorted(self.keys_seen)
+    names = json.dumps(dict(zip([str(k) for k in keys], c.weight_names(keys))))
+    self.f.write('N' + struct.pack('<I', len(names)) + names)
+    self.f.close()
+
+
+# --> ({ weight key: value } as of the row w/ db_id (default: the end), { weight key: name })
+def read_weight_log(fpath, db_id=None):
+  weights = {}
+  names = {}
+  with open(fpath, 'rb') as f:
+    if f.read(len(WLOG_MAGIC)) != WLOG_MAGIC:
+      raise ValueError('%s is not a weight log' % (fpath,))
+    while True:
+      tag = f.read(1)
+      if tag == '':
+        break
+      n = struct.unpack('<I', f.read(4))[0]
+      if tag == 'N':
+        names = dict([(int(k), v) for k, v in json.loads(f.read(n)).iteritems()])
+        continue
+      ids = np.fromstring(f.read(8*n), '<i8')
+      keys = np.fromstring(f.read(8*n), '<i8')
+      vals = np.fromstring(f.read(8*n), '<f8')
+      if db_id is not None:
+        m = ids <= int(db_id)
+        keys, vals = keys[m], vals[m]
+      weights.update(zip(keys.tolist(), vals.tolist()))
+  return weights, names
+
+
+# one step of the online feedback policy: score the doc, then request its label & update,
+# unless feedback_thresh & the score is past the skip margin --> (x, score, loss, labelled)
+def replay_step(c, features, tc, feedback_thresh=FEEDBACK_THRESH, skip_margin=FEEDBACK_SKIP_MARGIN):
+  x = c.features_in(features)
+  score = c.score_x(x)
+  if feedback_thresh and abs(score) > skip_margin:
+    return x, score, max(0.0, 1 - tc*score), False
+  return x, score, c.update(x, tc), True
+
+
+# runs through test batch (features from the feature cache / pool), outputs per-row results
+# as a csv file & weight evolution as a .wlog next to it as it goes, & the final classifier
+# as a snapshot (.clf); optionally warm started from a classifier snapshot
+def batch_test(filepath_out, snapshot_in=None):
   
   # get proper absolute filepath
   if re.search(r'(/|^)[A-Za-z0-9_]+\.csv', filepath_out) is None:
@@ -39,71 +212,143 @@ def batch_test(filepath_out):
   
   with Timer() as t:
     # perceptron (or other algorithm) object
-    c = classifier.OLClassifier()
+    if snapshot_in is not None:
+      c = classifier.load_classifier(snapshot_in)
+    else:
+      c = classifier.make_classifier()
 
-    # loop serially through all the rows of the batch test table, writing results to csv
+    # stream through all the rows of the batch test table, writing results as we go
+    wlog = weightLog(re.sub(r'\.csv$', '.wlog', fpath))
     with open(fpath, 'wb') as out_file:
       out = csv.writer(out_file)
-      data = []
-      with DB_connection(DB_VARS) as handle:
-        
-        # get starting index
-        row1 = pop_row(handle, DB_BATCH_TEST_TABLE, False, None, False)
-        r = int(row1[0])
-        n_pages = 0
-
-        # loop through all rows
-        while True:
+      out.writerow(["db_id", "url", "score", "tc", "LOSS"])
+      n_pages = 0
+      for row, record in featurized_rows():
 
-          # get row- rows should be of form (id, url, parent_stats, html, true_class)
-          row = pop_row(handle, DB_BATCH_TEST_TABLE, False, r, False)
-          if row is None:
-            break
-
-          # extract features and calculate prediction, then updated parameters given true class
-          features = extract_features(row[3], string_to_flist(row[2]))
-          score = c.classify(features)
-          
-          # decide whether or not to skip user feedback input
-          tc = int(row[4])
-          if FEEDBACK_THRESH:
-            if abs(score) > 0.5:
-
-              # skip submitting feedback
-              c.skip_feedback()
-              loss = max(0.0, 1 - tc*score)
-            else:
-              loss = c.feedback(tc)
-          else:
-            loss = c.feedback(tc)
-          data.append([int(row[0]), row[1], score, tc, loss, c.W])
-
-          r += 1
-          n_pages += 1
-
-      # assemple header row and write to file
-      header = ["db_id", "url", "score", "tc", "LOSS"]
-      for i in range(len(features)):
-        if c.token_maps.has_key(i):
-          header += [k for v,k in sorted([(v,k) for k,v in c.token_maps[i].iteritems()])]
-        else:
-          header.append("NUM")
-      out.writerow(header)
-
-      # extend all input features to full vector length and insert as rows
-      for d in data:
-        row = [d[0], d[1], d[2], d[3], d[4]]
-        W = d[5]
-        for i in range(len(W)):
-          if c.token_maps.has_key(i):
-            row += W[i] + [0 for j in range(len(c.token_maps[i]) - len(W[i]))]
-          else:
-            row.append(W[i])
-        out.writerow(row)
+        # get features from the record and calculate prediction, then updated parameters given
+        # true class unless feedback is skipped
+        features = extract_features(None, string_to_flist(row[2]), None, record)
+        tc = int(row[4])
+        x, score, loss, labelled = replay_step(c, features, tc)
+        if labelled:
+          wlog.add(int(row[0]), *c.weight_delta(x))
+        out.writerow([int(row[0]), row[1], score, tc, loss])
+        n_pages += 1
+    wlog.close(c)
   
+  classifier.save_classifier(c, re.sub(r'\.csv$', '.clf', fpath))
   print 'Classified %s pages in %s seconds' % (n_pages, t.duration)
 
 
+# print the n largest |weight|s of a batch test's weight log, as of the row w/ db_id
+def print_weights(fpath, db_id=None, n=50):
+  weights, names = read_weight_log(fpath, db_id)
+  for k, w in sorted(weights.iteritems(), key=lambda kw: -abs(kw[1]))[:int(n)]:
+    print '%+.6f  %s' % (w, names.get(k, k))
+
+
+# HYPERPARAMETER SWEEP: replay the labelled batch test stream under a grid of classifier
+# configurations, one process per configuration, sharing the cached features
+#
+# config keys (values default to node_globals):
+#   C       AGGRESSIVE_PARAM
+#   thresh  FEEDBACK_THRESH (0 / 1)
+#   margin  FEEDBACK_SKIP_MARGIN
+#   sparse  CLF_SPARSE (0 / 1)
+SWEEP_KEYS = ['C', 'thresh', 'margin', 'sparse']
+
+# labelled stream [(db_id, features, true_class)], set before the sweep pool is forked
+_sweep_stream = []
+
+
+# --> (curve [(threshold, precision, recall)] at n_points score ranks, average precision) of
+# progressive (score before update) predictions
+def pr_curve(scores, tcs, n_points=SWEEP_PR_POINTS):
+  order = np.argsort(-np.asarray(scores), kind='mergesort')
+  s = np.asarray(scores)[order]
+  pos = (np.asarray(tcs)[order] == 1)
+  n_pos = pos.sum()
+  if len(s) == 0 or n_pos == 0:
+    return [], 0.0
+  tp = np.cumsum(pos)
+  precision = tp / np.arange(1.0, len(s) + 1)
+  recall = tp / float(n_pos)
+  ranks = np.unique(np.linspace(0, len(s) - 1, n_points).astype(np.int64))
+  curve = [(s[k], precision[k], recall[k]) for k in ranks]
+  return curve, precision[pos].mean()
+
+
+# pool entry point: replay the stream under one config --> summary dict w/ its pr curve
+def _sweep_config(config):
+  c = classifier.SparseOLClassifier() if config['sparse'] else classifier.OLClassifier()
+  c.aggressive = config['C']
+  cum_loss = 0.0
+  n_labels = 0
+  mistakes = 0
+  scores = np.zeros(len(_sweep_stream))
+  tcs = np.zeros(len(_sweep_stream), np.int64)
+  for i, (db_id, features, tc) in enumerate(_sweep_stream):
+    x, score, loss, labelled = replay_step(c, features, tc, config['thresh'], config['margin'])
+    cum_loss += loss
+    n_labels += labelled
+    mistakes += (tc*score <= 0)
+    scores[i] = score
+    tcs[i] = tc
+  curve, ap = pr_curve(scores, tcs)
+  return dict(config, rows=len(_sweep_stream), labels=n_labels, cum_loss=cum_loss, mistakes=mistakes, avg_precision=ap, curve=curve)
+
+
+# grid args ['C=0.1,1,10', 'margin=0.25,0.5', ...] --> list of config dicts
+def sweep_configs(args):
+  grid = {'C': [AGGRESSIVE_PARAM], 'thresh': [int(FEEDBACK_THRESH)], 'margin': [FEEDBACK_SKIP_MARGIN], 'sparse': [int(CLF_SPARSE)]}
+  for arg in args:
+    k, vals = arg.split('=', 1)
+    if k not in SWEEP_KEYS:
+      sys.exit("Unknown sweep key %s (keys: %s)" % (k, ', '.join(SWEEP_KEYS)))
+    grid[k] = [float(v) if k in ('C', 'margin') else int(v) for v in vals.split(',')]
+  return [dict(zip(SWEEP_KEYS, vals)) for vals in itertools.product(*[grid[k] for k in SWEEP_KEYS])]
+
+
+# run a sweep, writing a summary row per config to the csv & the configs' pr curves to
+# <name>_pr.csv next to it
+def sweep(filepath_out, grid_args, workers=SWEEP_WORKERS):
+  global _sweep_stream
+
+  # get proper absolute filepath
+  if re.search(r'(/|^)[A-Za-z0-9_]+\.csv', filepath_out) is None:
+    sys.exit("Improper csv file path")
+  fpath = os.path.join(os.path.dirname(__file__), filepath_out)
+  configs = sweep_configs(grid_args)
+
+  with Timer() as t:
+    _sweep_stream = [(int(row[0]), extract_features(None, string_to_flist(row[2]), None, record), int(row[4])) for row, record in featurized_rows()]
+    with Timer() as t_replay:
+      if workers > 0 and len(configs) > 1:
+        pool = multiprocessing.Pool(min(workers, len(configs)))
+        try:
+          results = pool.map(_sweep_config, configs, 1)
+        finally:
+          pool.terminate()
+      else:
+        results = map(_sweep_config, configs)
+
+  with open(fpath, 'wb') as out_file:
+    out = csv.writer(out_file)
+    out.writerow(['config_id'] + SWEEP_KEYS + ['rows', 'labels', 'cum_loss', 'mistakes', 'avg_precision'])
+    for i, r in enumerate(results):
+      out.writerow([i] + [r[k] for k in SWEEP_KEYS] + [r['rows'], r['labels'], r['cum_loss'], r['mistakes'], r['avg_precision']])
+  with open(re.sub(r'\.csv$', '_pr.csv', fpath), 'wb') as out_file:
+    out = csv.writer(out_file)
+    out.writerow(['config_id', 'threshold', 'precision', 'recall'])
+    for i, r in enumerate(results):
+      for point in r['curve']:
+        out.writerow([i] + list(point))
+
+  print 'Replayed %s pages under %s configs in %s seconds (%s replaying)' % (len(_sweep_stream), len(configs), t.duration, t_replay.duration)
+  for i, r in sorted(enumerate(results), key=lambda ir: ir[1]['cum_loss'])[:10]:
+    print '  %3d  %s  labels %s  cum_loss %.2f  avg_precision %.3f' % (i, ' '.join(['%s=%s' % (k, r[k]) for k in SWEEP_KEYS]), r['labels'], r['cum_loss'], r['avg_precision'])
+
+
 def test_html_calcs(filepath_out):
 
   # get proper absolute filepath
@@ -113,59 +358,46 @@ def test_html_calcs(filepath_out):
   
   with Timer() as t:
 
-    # loop serially through all the rows of the batch test table, writing results to csv
+    # stream through all the rows of the batch test table, writing results to csv
     with open(fpath, 'wb') as out_file:
       out = csv.writer(out_file)
       out.writerow(('url', 'ptl', 'rptl', 'rptl_norm', 'nl', 'rnl', 'rnl_norm', 'lts', 'lts_norm'))
-      with DB_connection(DB_VARS) as handle:
-        
-        # get starting index
-        row1 = pop_row(handle, DB_BATCH_TEST_TABLE, False, None, False)
-        r = int(row1[0])
-        n_pages = 0
-
-        # loop through all rows
-        while True:
-
-          # get row- rows should be of form (id, url, parent_stats, html, true_class)
-          row = pop_row(handle, DB_BATCH_TEST_TABLE, False, r, False)
-          if row is None:
-            break
+      for row, record in featurized_rows():
 
-          # extract all html-parsing features, also in absolute (non-norm.) form, + url & html
-          pt = get_page_text(row[3])
-          ptl = float(len(pt))
-          nl = float(len(re.findall(r'<a\s.*?>', row[3])))
-          lts = calc_LTS(row[3])
-          lts_norm = sl_normalize(lts/1000.0)
-          parent_page_stats = string_to_flist(row[2])
-          if parent_page_stats is not None:
-            p_ptl, p_nl, p_tt, p_ltt = parent_page_stats
-            rptl = ptl / p_ptl
-            rptl_norm = sl_normalize(rptl)
-            rnl = nl / p_nl
-            rnl_norm = sl_normalize(rnl)
-          else:
-            rptl = 0.0
-            rptl_norm = 0.0
-            rnl = 0.0
-            rnl_norm = 0.0
-          out.writerow((row[1], ptl, rptl, rptl_norm, nl, rnl, rnl_norm, lts, lts_norm))
-
-          r += 1
-          n_pages += 1
+        # html-parsing features, also in absolute (non-norm.) form, from the page's record
+        ptl, nl, lts, tt, mft = read_feature_record(record)
+        lts_norm = sl_normalize(lts/1000.0)
+        parent_page_stats = string_to_flist(row[2])
+        if parent_page_stats is not None:
+          p_ptl, p_nl, p_tt, p_ltt = parent_page_stats
+          rptl = ptl / p_ptl
+          rptl_norm = sl_normalize(rptl)
+          rnl = nl / p_nl
+          rnl_norm = sl_normalize(rnl)
+        else:
+          rptl = 0.0
+          rptl_norm = 0.0
+          rnl = 0.0
+          rnl_norm = 0.0
+        out.writerow((row[1], ptl, rptl, rptl_norm, nl, rnl, rnl_norm, lts, lts_norm))
 
 
 # command line functionality
 if __name__ == '__main__':
   if len(sys.argv) == 2 and sys.argv[1] == 'populate':
     populate_test_table()
-  elif len(sys.argv) == 3 and sys.argv[1] == 'run':
-    batch_test(sys.argv[2])
+  elif len(sys.argv) in (3, 4) and sys.argv[1] == 'run':
+    batch_test(*sys.argv[2:4])
   elif len(sys.argv) == 3 and sys.argv[1] == 'test_html_calcs':
     test_html_calcs(sys.argv[2])
+  elif len(sys.argv) in (3, 4, 5) and sys.argv[1] == 'weights':
+    print_weights(*sys.argv[2:5])
+  elif len(sys.argv) >= 3 and sys.argv[1] == 'sweep':
+    sweep(sys.argv[2], sys.argv[3:])
   else:
     print 'USAGE: python batchTest.py ...'
-    print '  (1) run <rel_filepath_output>'
+    print '  (1) run <rel_filepath_output> [classifier_snapshot]'
     print '  (2) populate'
     print '  (3) test_html_calcs <rel_filepath_output>'
+    print '  (4) weights <rel_filepath_wlog> [db_id] [n]'
+    print '  (5) sweep <rel_filepath_output> [key=v1,v2,...] ... (keys: %s)' % (', '.join(SWEEP_KEYS),)
@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import Queue
+import random
+import threading
+import multiprocessing
+import os
+import glob
+from pageAnalyze import *
+from parseStage import parseStage, parse_page
+import classifier
+import heapq
+from frontierRecord import urlRecord, parentInfo
+
+
+# benchmarks & correctness checks for crawl-side hot paths
+#
+# python benchmark.py resolve [corpus]
+# python benchmark.py pool [n_pages] [max_workers]
+# python benchmark.py corpus [scale]
+# python benchmark.py parse [timeout_secs] [page_glob]
+# python benchmark.py score [n_docs]
+# python benchmark.py records [n_pages] [links_per_page]
+#
+# corpora live in bench_corpus/
+
+
+def _timeit(fn, reps):
+  t0 = time.time()
+  for i in range(reps):
+    fn()
+  return (time.time() - t0)/reps
+
+
+#
+# --> link resolution: linkResolver vs resolve_extracted_link
+#
+RESOLVE_CORPUS = 'bench_corpus/resolve.tsv'
+
+def load_resolve_corpus(fpath=RESOLVE_CORPUS):
+  rows = []
+  with open(fpath, 'r') as f:
+    for line in f:
+      if line.startswith('#'):
+        continue
+      page_url, base_href, href, expected = line.rstrip('\n').split('\t')
+      rows.append((page_url, None if base_href == '-' else base_href, href, expected or None))
+  return rows
+
+
+# old resolver as used by extract_link_data, incl. its fragment stripping
+def _old_resolve(href, page_url, base_href, Q_logs):
+  try:
+    url = resolve_extracted_link(href, page_url, Q_logs, base_href)
+  except Exception as e:
+    return 'ERROR: %s' % (e,)
+  return re.sub(r'#.*$', '', url) if url is not None else None
+
+
+def bench_resolve(fpath=RESOLVE_CORPUS, reps=200):
+  rows = load_resolve_corpus(fpath)
+  Q_logs = Queue.Queue()
+
+  # correctness
+  old_bad = []
+  new_bad = []
+  for page_url, base_href, href, expected in rows:
+    new = linkResolver(page_url, base_href, Q_logs).resolve(href)
+    old = _old_resolve(href, page_url, base_href, Q_logs)
+    if new != expected:
+      new_bad.append((page_url, base_href, href, expected, new))
+    if old != expected:
+      old_bad.append((page_url, base_href, href, expected, old))
+  print '--> CORRECTNESS (%s cases)' % (len(rows),)
+  print 'linkResolver:           %s wrong' % (len(new_bad),)
+  print 'resolve_extracted_link: %s wrong' % (len(old_bad),)
+  for name, bad in (('linkResolver', new_bad), ('resolve_extracted_link', old_bad)):
+    for page_url, base_href, href, expected, got in bad:
+      print '  %s: %r on %s (base %s): expected %r, got %r' % (name, href, page_url, base_href, expected, got)
+
+  # speed, over a page's worth of links (hrefs repeating as nav links do)
+  page_url = 'http://www.example.com/contracts/2013/msa.html'
+  hrefs = [r[2] for r in rows if r[0] == page_url] + ['/section/%d.html' % (i,) for i in range(100)]
+  hrefs = hrefs*3
+  def run_old():
+    for h in hrefs:
+      _old_resolve(h, page_url, None, Q_logs)
+  def run_new():
+    r = linkResolver(page_url, None, Q_logs)
+    for h in hrefs:
+      r.resolve(h)
+  t_old = _timeit(run_old, reps)
+  t_new = _timeit(run_new, reps)
+  print '--> SPEED (%s links / page)' % (len(hrefs),)
+  print 'resolve_extracted_link: %8.2f us/link' % (1e6*t_old/len(hrefs),)
+  print 'linkResolver:           %8.2f us/link  (%.1fx)' % (1e6*t_new/len(hrefs), t_old/t_new)
+  return len(new_bad) == 0
+
+
+#
+# --> parse stage throughput as parse processes are added
+#
+
+# a contract-ish page of n_sections paragraphs, lists & links
+def synthetic_page(n_sections=400, seed=0):
+  rnd = random.Random(seed)
+  words = ['agreement', 'party', 'parties', 'services', 'term', 'termination', 'schedule', 'notice', 'governing', 'law', 'indemnify', 'liability', 'payment', 'the', 'of', 'and', 'shall', 'be']
+  parts = ['<html><head><title>Master Services Agreement %s</title><script type="text/javascript">var x = 1<2;</script><style>p{color:red}</style></head><body>\n' % (seed,)]
+  for i in range(n_sections):
+    txt = ' '.join([rnd.choice(words) for j in range(rnd.randint(10, 60))])
+    parts.append('<div class="s"><p>%s. %s &quot;<a href="/terms/%s.html" class="l">%s</a>&quot; <b>%s</b>.</p>\n<ul><li><a href="http://other%s.com/p%s">%s</a></li><li><img src="x.png"></li></ul></div>\n' % (i, txt, rnd.randint(0, 50), rnd.choice(words), rnd.choice(words), i % 7, i, rnd.choice(words)))
+  parts.append('</body></html>')
+  return ''.join(parts)
+
+
+# pages / sec through parse + a no-op admission, fed by n_threads fetch-like threads
+def _run_stage(stage, pages, n_pages, n_threads):
+  url = 'http://www.example.com/contracts/msa.html'
+  done = threading.Event()
+  lock = threading.Lock()
+  count = [0]
+
+  def admit():
+    while True:
+      r = stage.get_result()
+      if r is None:
+        return
+      stage.task_done(r[2][0])
+      with lock:
+        count[0] += 1
+        if count[0] == n_pages:
+          done.set()
+
+  def fetch(k):
+    for i in range(k, n_pages, n_threads):
+      stage.submit(pages[i % len(pages)], url, i)
+
+  admitters = [threading.Thread(target=admit) for i in range(PARSE_ADMIT_THREADS)]
+  fetchers = [threading.Thread(target=fetch, args=(k,)) for k in range(n_threads)]
+  t0 = time.time()
+  for th in admitters + fetchers:
+    th.setDaemon(True)
+    th.start()
+  done.wait()
+  secs = time.time() - t0
+  for th in admitters:
+    stage.Q_results.put(None)
+  return n_pages/secs
+
+
+# same, parsing on the fetch threads themselves (PARSE_WORKERS = 0)
+def _run_inline(pages, n_pages, n_threads):
+  url = 'http://www.example.com/contracts/msa.html'
+  def fetch(k):
+    for i in range(k, n_pages, n_threads):
+      parse_page(pages[i % len(pages)].translate(None, HIGH_BYTES), url)
+  fetchers = [threading.Thread(target=fetch, args=(k,)) for k in range(n_threads)]
+  t0 = time.time()
+  for th in fetchers:
+    th.start()
+  for th in fetchers:
+    th.join()
+  return n_pages/(time.time() - t0)
+
+
+def bench_pool(n_pages=400, max_workers=multiprocessing.cpu_count(), n_threads=8):
+  pages = [synthetic_page(100 + 100*(i % 5), i) for i in range(10)]
+  print '--> PARSE STAGE THROUGHPUT (%s pages, avg %.0f KB, %s fetch threads, %s cores)' % (n_pages, sum([len(p) for p in pages])/10.0/1024, n_threads, multiprocessing.cpu_count())
+  base = _run_inline(pages, n_pages, n_threads)
+  print '%-22s %8.1f pages/sec' % ('inline (GIL-bound)', base)
+  w = 1
+  while w <= max_workers:
+    stage = parseStage(w, PARSE_QUEUE_MAX)
+    rate = _run_stage(stage, pages, n_pages, n_threads)
+    stage.close()
+    print '%-22s %8.1f pages/sec  (%.2fx)' % ('%s parse workers' % (w,), rate, rate/base)
+    w *= 2
+
+
+#
+# --> pageAnalyze timings over a corpus of real-world & adversarial pages
+#
+PAGES_DIR = 'bench_corpus/pages'
+ADVERSARIAL_SCALE = 5000
+
+# synthetic pages of n repeated units that are slow for some of the pageAnalyze regexes:
+# mostly unclosed tags, which the lazy .*? patterns rescan to the end of the line (or, for
+# the DOTALL script/style/a pattern in get_page_text, of the page) from every repetition
+def adversarial_pages(n=ADVERSARIAL_SCALE):
+  return {
+    'adv_unclosed_a': '<html><body><p>' + ''.join(['<a href="/doc/%s.html">exhibit %s ' % (i, i) for i in range(n)]) + '</p></body></html>',
+    'adv_unclosed_script': '<html><head>' + '<script>var a = b;'*n + '</head><body><p>text</p></body></html>',
+    'adv_lt_flood': '<html><body><p>' + 'if a<b then '*n + '</p></body></html>',
+    'adv_open_tag': '<html><body>' + '<a  '*n + '</body></html>',
+    'adv_base_flood': '<html><head>' + '<base target=x '*n + '</head><body></body></html>',
+    'adv_title_unclosed': '<html><head>' + '<title>agreement '*n + '</head><body></body></html>',
+    'adv_deep_nest': '<html><body>' + '<div><p><b>clause '*n + '</b></p></div>'*n + '</body></html>',
+    'adv_close_flood': '<html><body>' + '</div></td></tr>'*n + '<p>text</p></body></html>' }
+
+
+# pages over the bounded parse limits; generated rather than checked in, for size
+def capped_pages():
+  pages = {}
+  if PARSE_MAX_BYTES is not None:
+    pages['cap_bytes'] = '<html><body><p>' + 'the parties agree as follows '*(1 + int(1.25*PARSE_MAX_BYTES)/29) + '</p></body></html>'
+  if PARSE_MAX_TAGS is not None:
+    pages['cap_tags'] = '<html><body><p>' + '<b>x</b>'*(PARSE_MAX_TAGS) + '</p></body></html>'
+  return pages
+
+
+def write_adversarial_corpus(scale=ADVERSARIAL_SCALE, pages_dir=PAGES_DIR):
+  for name, html in sorted(adversarial_pages(scale).items()):
+    with open(os.path.join(pages_dir, name + '.html'), 'wb') as f:
+      f.write(html)
+    print '%-22s %8s bytes' % (name, len(html))
+
+
+def load_pages(pattern='*'):
+  pages = {}
+  for fpath in glob.glob(os.path.join(PAGES_DIR, pattern + '.html')):
+    with open(fpath, 'rb') as f:
+      pages[os.path.basename(fpath)[:-5]] = f.read()
+  return pages
+
+
+PAGE_URL = 'http://www.example.com/contracts/2013/index.html'
+
+# (column, fn(raw_html, html, text)) for each pageAnalyze function; text = page text via scan_page
+PA_FUNCS = [
+  ('clean', lambda raw, html, text: basic_html_clean(raw)),
+  ('page_text', lambda raw, html, text: get_page_text(html)),
+  ('tokens', lambda raw, html, text: tokens(text)),
+  ('mf_words', lambda raw, html, text: mf_words(text, MF_TOKENS_N)),
+  ('links', lambda raw, html, text: extract_link_data(html, PAGE_URL)),
+  ('calc_LTS', lambda raw, html, text: calc_LTS(html)),
+  ('passed', lambda raw, html, text: extract_passed_stats(html)),
+  ('scan', lambda raw, html, text: scan_page(raw)),
+  ('scan_lim', lambda raw, html, text: scan_page(raw, None, PARSE_MAX_BYTES, PARSE_MAX_TAGS)),
+  ('parse_pg', lambda raw, html, text: parse_page(html, PAGE_URL)),
+  ('features', lambda raw, html, text: extract_features(html, None)) ]
+
+
+# child process: mean secs / call over >= min_secs (at least one call), or the exception
+def _time_fn(fn, args, conn, min_secs=0.2):
+  try:
+    n = 0
+    t0 = time.time()
+    while n == 0 or time.time() - t0 < min_secs:
+      fn(*args)
+      n += 1
+    conn.send((time.time() - t0)/n)
+  except Exception as e:
+    conn.send('%s: %s' % (type(e).__name__, e))
+
+
+# each fn is run in its own process, killed after timeout secs, so one blowup can't hang the run
+def bench_parse(timeout=10.0, pattern='*'):
+  pages = load_pages(pattern)
+  if pattern == '*':
+    pages.update(capped_pages())
+  print '--> PAGEANALYZE TIMINGS (ms / call; - = over %ss)' % (timeout,)
+  print '%-22s %8s %5s ' % ('page', 'KB', 'cap') + ' '.join(['%9s' % (c,) for c, fn in PA_FUNCS])
+  for name in sorted(pages):
+    raw = pages[name]
+    html = basic_html_clean(raw)
+    scan = scan_page(raw, None, PARSE_MAX_BYTES, PARSE_MAX_TAGS)
+    text = scan_page(raw).text
+    cells = []
+    for col, fn in PA_FUNCS:
+      recv, send = multiprocessing.Pipe(False)
+      proc = multiprocessing.Process(target=_time_fn, args=(fn, (raw, html, text), send))
+      proc.start()
+      if recv.poll(timeout):
+        r = recv.recv()
+        cells.append('%9.2f' % (1000*r,) if isinstance(r, float) else '%9s' % ('ERR',))
+      else:
+        cells.append('%9s' % ('-',))
+      if proc.is_alive():
+        proc.terminate()
+      proc.join()
+    print '%-22s %8.0f %5s ' % (name, len(raw)/1024.0, scan.capped or '') + ' '.join(cells)
+    sys.stdout.flush()
+
+
+#
+# --> classifier scoring: score_batch vs classify per doc
+#
+
+# extract_features-like tuples over a zipf-ish vocabulary
+def synthetic_features(n_docs, seed=0, vocab_size=20000):
+  rnd = random.Random(seed)
+  vocab = ['tok%s' % (i,) for i in range(vocab_size)]
+  def toks(k, top):
+    return [vocab[min(int(rnd.paretovariate(1.0)) - 1, top - 1)] for j in range(k)]
+  return [(rnd.uniform(-1, 1), rnd.uniform(-1, 1), rnd.uniform(-1, 1), toks(MF_TOKENS_N, vocab_size), toks(5, vocab_size), toks(4, vocab_size), toks(5, vocab_size)) for i in range(n_docs)]
+
+
+def bench_score(n_docs=5000, n_train=2000):
+  train = synthetic_features(n_train, 1)
+  docs = synthetic_features(n_docs, 2)
+  print '--> SCORING (%s docs, classifier trained on %s)' % (n_docs, n_train)
+  for name, c in (('OLClassifier', classifier.OLClassifier()), ('SparseOLClassifier', classifier.SparseOLClassifier())):
+    for i, f in enumerate(train):
+      c.classify(f)
+      c.feedback(1 if i % 3 == 0 else -1)
+
+    # score_batch must leave the learning state as it was
+    before = c.score_batch(docs[:200])
+    t0 = time.time()
+    batch = c.score_batch(docs)
+    t_batch = time.time() - t0
+    after = c.score_batch(docs[:200])
+    t0 = time.time()
+    single = []
+    for f in docs:
+      single.append(c.classify(f))
+      c.skip_feedback()
+    t_single = time.time() - t0
+    print '%s:' % (name,)
+    print '  classify x %s:  %10.0f docs/sec' % (n_docs, n_docs/t_single)
+    print '  score_batch:     %10.0f docs/sec  (%.1fx)' % (n_docs/t_batch, t_single/t_batch)
+    print '  max |diff| vs classify %.2g, state unchanged: %s' % (np.max(np.abs(batch - np.array(single))), np.array_equal(before, after))
+
+
+#
+# --> frontier memory: compact records vs the former url tuples
+#
+
+# deep size in bytes, counting each object once (i.e. shared objects as shared)
+def deep_size(obj, seen=None):
+  if seen is None:
+    seen = set()
+  if id(obj) in seen:
+    return 0
+  seen.add(id(obj))
+  size = sys.getsizeof(obj)
+  if type(obj) in (tuple, list):
+    size += sum([deep_size(x, seen) for x in obj])
+  elif type(obj) == dict:
+    size += sum([deep_size(k, seen) + deep_size(v, seen) for k, v in obj.iteritems()])
+  elif hasattr(obj, '__slots__'):
+    size += sum([deep_size(getattr(obj, a), seen) for a in obj.__slots__])
+  return size
+
+
+# links extracted from synthetic pages, as admit_page gets them from the parser:
+# --> [(page_url, page_stats, [(url, link_stats)])]; strings are built fresh, as parsed ones are
+def synthetic_links(n_pages, links_per_page, n_hosts=50, seed=0):
+  rnd = random.Random(seed)
+  words = ['agreement', 'lease', 'contract', 'party', 'term', 'services', 'employment', 'form', 'shall', 'notice', 'confidential', 'license', 'payment', 'schedule', 'exhibit', 'amendment']
+  def word():
+    return ''.join(list(rnd.choice(words)))
+  def url():
+    return 'http://www.host%s.example.com/documents/%s/%s_%s.html' % (rnd.randrange(n_hosts), word(), word(), rnd.randrange(10**6))
+  pages = []
+  for i in range(n_pages):
+    page_stats = (float(rnd.randrange(500, 50000)), float(links_per_page), [word() for j in range(6)])
+    pages.append((url(), page_stats, [(url(), ([word() for j in range(3)],)) for k in range(links_per_page)]))
+  return pages
+
+
+def bench_records(n_pages=2000, links_per_page=50):
+  pages = synthetic_links(n_pages, links_per_page)
+  n = n_pages*links_per_page
+  print '--> FRONTIER RECORDS (%s queued urls, %s links / page)' % (n, links_per_page)
+  seq = iter(xrange(10**9))
+
+  # former hq entries: (-score, seq, (url, ref_page_stats, seed_dist, parent_url))
+  t0 = time.time()
+  old = []
+  for page_url, page_stats, links in pages:
+    for u, ls in links:
+      heapq.heappush(old, (0.0, next(seq), (u, tuple(page_stats) + tuple(ls), 1, page_url)))
+  t_old = time.time() - t0
+
+  # hq entries of compact records
+  t0 = time.time()
+  new = []
+  for page_url, page_stats, links in pages:
+    parent = parentInfo(page_stats[0], page_stats[1], page_stats[2], page_url)
+    for u, ls in links:
+      heapq.heappush(new, (0.0, next(seq), urlRecord(u, 1, parent, ls[0])))
+  t_new = time.time() - t0
+
+  # the pages themselves are garbage once admitted, so only what the queue holds is counted
+  del pages
+  b_old = deep_size(old)
+  b_new = deep_size(new)
+  flat = lambda t: (t[0], t[1][:2] + tuple([list(x) for x in t[1][2:]]), t[2], t[3])
+  same = all([flat(o[2]) == flat(r[2].wire()) for o, r in zip(old, new)])
+  print 'tuples:  %8.1f bytes / url  %6.2f us / url' % (float(b_old)/n, 1e6*t_old/n)
+  print 'records: %8.1f bytes / url  %6.2f us / url  (%.2fx smaller)' % (float(b_new)/n, 1e6*t_new/n, float(b_old)/b_new)
+  print 'url, stats, seed dist & parent url round trip: %s' % (same,)
+
+
+#
+# --> Command line functionality
+#
+if __name__ == '__main__':
+  if len(sys.argv) >= 2 and sys.argv[1] == 'resolve':
+    ok = bench_resolve(*sys.argv[2:3])
+    sys.exit(0 if ok else 1)
+  elif len(sys.argv) >= 2 and sys.argv[1] == 'pool':
+    bench_pool(*[int(a) for a in sys.argv[2:4]])
+  elif len(sys.argv) >= 2 and sys.argv[1] == 'corpus':
+    write_adversarial_corpus(*[int(a) for a in sys.argv[2:3]])
+  elif len(sys.argv) >= 2 and sys.argv[1] == 'parse':
+    bench_parse(*([float(a) for a in sys.argv[2:3]] + sys.argv[3:4]))
+  elif len(sys.argv) >= 2 and sys.argv[1] == 'score':
+    bench_score(*[int(a) for a in sys.argv[2:3]])
+  elif len(sys.argv) >= 2 and sys.argv[1] == 'records':
+    bench_records(*[int(a) for a in sys.argv[2:4]])
+  else:
+    print 'Usage: python benchmark.py ...'
+    print '(1) resolve [corpus_tsv]'
+    print '(2) pool [n_pages] [max_workers]'
+    print '(3) corpus [scale]  (re)writes the adversarial pages in %s' % (PAGES_DIR,)
+    print '(4) parse [timeout_secs] [page_glob]'
+    print '(5) score [n_docs]'
+    print '(6) records [n_pages] [links_per_page]'
@@ -3,6 +3,10 @@
 import numpy as np
 from Queue import Queue
 import time
+import zlib
+import os
+import json
+import struct
 from node_globals import *
 from node_locals import *
 
@@ -24,6 +28,7 @@ class OLClassifier:
   def __init__(self):
     self.W = []
     self.token_maps = {}
+    self.aggressive = AGGRESSIVE_PARAM
     self.in_count = 0
     self.true_count = 0
     self.last_x = []
@@ -105,6 +110,36 @@ class OLClassifier:
     return x_readable, w_relevant
 
 
+  # weight evolution for batchTest: --> (keys, values) of the weights an update(x) changes;
+  # a key is (field << 32) + position in field, so it is stable as the token maps grow
+  def weight_delta(self, x):
+    return (x[0] << 32) + x[1], self._flatten(self.W)[self._x_index(x)]
+
+
+  # --> readable names of weight_delta keys: namespace, or namespace:token
+  def weight_names(self, keys):
+    tokens = dict([(i, dict([(j, t) for t, j in tmap.iteritems()])) for i, tmap in self.token_maps.iteritems()])
+    names = []
+    for k in keys:
+      i, j = int(k) >> 32, int(k) & 0xffffffff
+      ns = FEATURE_NAMESPACES[i] if i < len(FEATURE_NAMESPACES) else 'f%s' % (i,)
+      names.append('%s:%s' % (ns, tokens[i][j]) if tokens.has_key(i) else ns)
+    return names
+
+
+  # --> (header, flat weights) for save_classifier
+  def snapshot(self):
+    fields = [len(w) if type(w) == list else -1 for w in self.W]
+    token_maps = dict([(str(i), tmap) for i, tmap in self.token_maps.iteritems()])
+    return {'kind': 'dense', 'fields': fields, 'token_maps': token_maps}, self._flatten(self.W)
+
+
+  def _load_snapshot(self, header, w):
+    proto = [[0.0]*n if n >= 0 else 0.0 for n in header['fields']]
+    self.W = [[float(x) for x in r] if type(r) == list else float(r) for r in self._unflatten(w, proto)]
+    self.token_maps = dict([(int(i), dict([(str(t), j) for t, j in tmap.iteritems()])) for i, tmap in header['token_maps'].iteritems()])
+
+
 # NOTE: TO-DO: !!! --> switch it to [0,1] unary rather than [-1,1], i.e. tally up based on
 # positives only, don't get flooded with any negative indicators
 
@@ -143,7 +178,7 @@ class OLClassifier:
     x = self.last_x
     w = self._flatten(self.W)
     loss = max(0.0, 1 - tc*np.dot(w, x))
-    w += min(AGGRESSIVE_PARAM, loss/sum(x**2))*tc*x
+    w += min(self.aggressive, loss/sum(x**2))*tc*x
     self.W = self._unflatten(w, self.W)
 
     # log that an input datum was completed with feedback returned
@@ -157,5 +192,361 @@ class OLClassifier:
     # log that an input datum was completed with feedback returned
     self.in_count -= 1
 
+
+  # --> doc vector for score_x / update, which (unlike last_x) can be held across other docs'
+  # updates: (field, position in field, value) arrays, so it stays valid as token maps grow
+  # NOTE: as in classify, new tokens are added to the token maps here
+  def features_in(self, mixed_features):
+    x = self._handle_features_in(mixed_features)
+    fields = []
+    pos = []
+    k = 0
+    for i, w in enumerate(self.W):
+      for j in range(len(w) if type(w) == list else 1):
+        if x[k] != 0:
+          fields.append(i)
+          pos.append(j)
+        k += 1
+    nz = x[x != 0]
+    return (np.array(fields, np.int64), np.array(pos, np.int64), nz)
+
+
+  def _x_index(self, x):
+    offsets = np.cumsum([0] + [len(w) if type(w) == list else 1 for w in self.W])
+    return offsets[x[0]] + x[1]
+
+
+  def score_x(self, x):
+    return np.dot(self._flatten(self.W)[self._x_index(x)], x[2])
+
+
+  # passive-aggressive-I update for a features_in vector --> loss
+  def update(self, x, true_class):
+    tc = int(true_class)
+    idx = self._x_index(x)
+    w = self._flatten(self.W)
+    loss = max(0.0, 1 - tc*np.dot(w[idx], x[2]))
+    sq = np.dot(x[2], x[2])
+    if sq > 0:
+      w[idx] += min(self.aggressive, loss/sq)*tc*x[2]
+    self.W = self._unflatten(w, self.W)
+    return loss
+
+
+  # token weights of the token fields, for the crawl-side linkScorer
+  # --> { namespace: { token: weight } }, at most n tokens per field, largest |weight| first
+  def link_model(self, n=None):
+    model = {}
+    for i, tmap in self.token_maps.iteritems():
+      if i < len(self.W) and type(self.W[i]) == list:
+        model[FEATURE_NAMESPACES[i] if i < len(FEATURE_NAMESPACES) else 'f%s' % (i,)] = top_weights([(t, self.W[i][j]) for t, j in tmap.iteritems() if j < len(self.W[i])], n)
+    return model
+
+
+  # score many docs at once w/o touching learning state (weights, token maps, in_count);
+  # tokens not yet in the token maps have zero weight but count towards the doc's norm
+  # --> np array of scores, one per doc, as classify would give
+  def score_batch(self, features_list):
+    offsets = []
+    o = 0
+    for w in self.W:
+      offsets.append(o)
+      o += len(w) if type(w) == list else 1
+    csr = csrRows()
+    for mixed_features in features_list:
+      idx = []
+      vals = []
+      extra_sq = 0.0
+      for i, f in enumerate(mixed_features):
+        if type(f) == float or type(f) == int or type(f) == np.float64:
+          if i < len(offsets):
+            idx.append(offsets[i])
+            vals.append(f)
+          else:
+            extra_sq += f*f
+        elif type(f) == list or type(f) == tuple:
+          tmap = self.token_maps.get(i, {})
+          for token in set(f):
+            if i < len(offsets) and tmap.has_key(token) and tmap[token] < len(self.W[i]):
+              idx.append(offsets[i] + tmap[token])
+              vals.append(1.0)
+            else:
+              extra_sq += 1.0
+      csr.add_row(idx, vals, extra_sq)
+    return csr.scores(self._flatten(self.W))
+
+
+# [(token, weight)] --> { token: weight } of the n non-zero weights largest in magnitude
+def top_weights(token_weights, n=None):
+  tw = sorted([(t, float(w)) for t, w in token_weights if w != 0], key=lambda x: -abs(x[1]))
+  return dict(tw[:n])
+
+
+# docs as rows of a CSR sparse matrix (indptr, indices, data), each row normalized to unit
+# length, for scoring a batch w/ one sparse matrix-vector product
+class csrRows:
+  def __init__(self):
+    self.indptr = [0]
+    self.indices = []
+    self.data = []
+    self.sq = []
+
+  # extra_sq: squared norm of features that count towards the row's norm but have no column
+  def add_row(self, idx, vals, extra_sq=0.0):
+    self.indices += idx
+    self.data += vals
+    self.indptr.append(len(self.indices))
+    self.sq.append(extra_sq)
+
+  # --> A.w, one score per row
+  def scores(self, w):
+    n = len(self.indptr) - 1
+    if n == 0:
+      return np.zeros(0)
+    indptr = np.array(self.indptr)
+    data = np.array(self.data, np.float64)
+    rows = np.repeat(np.arange(n), np.diff(indptr))
+    norms = np.sqrt(np.bincount(rows, data*data, n) + np.array(self.sq))
+    norms[norms == 0] = 1.0
+    return np.bincount(rows, w[np.array(self.indices, np.int64)]*data, n)/norms
+
+
+# names of the extract_features fields, used as hashing namespaces so that the same token
+# in e.g. the title & the body gets separate weights
+FEATURE_NAMESPACES = ['rel_text_len', 'rel_num_links', 'lts', 'body', 'title', 'parent_link', 'parent_title']
+
+
+# the same online passive-aggressive classifier over a fixed-size hashed feature space:
+#
+# - each token feature (namespace, token) is hashed (crc32) into a numpy weight array of
+#   2^CLF_HASH_BITS, & each numeric feature has a slot of its own namespace
+# - a doc is kept as (indices, values) of its non-zero features, so classify & feedback
+#   cost O(doc features), however large the vocabulary seen gets
+# - the first CLF_VOCAB_MAX tokens seen are kept exactly, for readable weights only
+#
+# without hash collisions, scores & updates are those of OLClassifier
+class SparseOLClassifier:
+
+  def __init__(self, hash_bits=CLF_HASH_BITS, vocab_max=CLF_VOCAB_MAX):
+    self.mask = (1 << hash_bits) - 1
+    self.W = np.zeros(1 << hash_bits)
+    self.vocab_max = vocab_max
+    self.vocab = {}  # { (namespace, token): index }
+    self.vocab_order = []
+    self.aggressive = AGGRESSIVE_PARAM
+    self.in_count = 0
+    self.true_count = 0
+    self.last_x = None
+
+  
+  def _ns(self, i):
+    return FEATURE_NAMESPACES[i] if i < len(FEATURE_NAMESPACES) else 'f%s' % (i,)
+
+
+  def _index(self, ns, token=None):
+    key = ns if token is None else ns + '\x00' + token
+    return zlib.crc32(key) & self.mask
+
+
+  # mixed features --> (indices, values) of the doc's non-zero features, normalized
+  def _handle_features_in(self, mixed_features):
+    idx, vals = self._hashed(mixed_features, True)
+    norm = np.linalg.norm(vals)
+    return idx, (vals/norm if norm > 0 else vals)
+
+
+  # --> { index: value } of the doc's (un-normalized) features, adding new tokens to the
+  # exact vocabulary if learn_vocab
+  def _hashed(self, mixed_features, learn_vocab=False):
+    x = {}
+    for i, f in enumerate(mixed_features):
+      ns = self._ns(i)
+      if type(f) == float or type(f) == int or type(f) == np.float64:
+        if f != 0:
+          j = self._index(ns)
+          x[j] = x.get(j, 0.0) + f
+      elif type(f) == list or type(f) == tuple:
+        for token in set(f):
+          j = self._index(ns, token)
+          x[j] = x.get(j, 0.0) + 1.0
+          if learn_vocab and len(self.vocab) < self.vocab_max and not self.vocab.has_key((ns, token)):
+            self.vocab[(ns, token)] = j
+            self.vocab_order.append((ns, token))
+    if not learn_vocab:
+      return x
+    return np.fromiter(x.iterkeys(), np.int64, len(x)), np.fromiter(x.itervalues(), np.float64, len(x))
+
+
+  # features in flat readable form, w/ the weight each one currently has
+  # NOTE: unlike OLClassifier, w lines up with x (one weight per feature of this doc)
+  def readable_weights(self, mixed_features):
+    x_readable = []
+    w_relevant = []
+    for i, f in enumerate(mixed_features):
+      ns = self._ns(i)
+      if type(f) == float or type(f) == int or type(f) == np.float64:
+        x_readable.append(f)
+        w_relevant.append(self.W[self._index(ns)])
+      elif type(f) == list or type(f) == tuple:
+        for token in sorted(set(f)):
+          x_readable.append(token)
+          w_relevant.append(self.W[self._index(ns, token)])
+    return x_readable, w_relevant
+
+
+  # weight evolution for batchTest: --> (keys, values) of the weights an update(x) changes;
+  # a key is the hashed index
+  def weight_delta(self, x):
+    return x[0], self.W[x[0]]
+
+
+  # --> readable names of weight_delta keys, over numeric features & the exact vocabulary;
+  # other tokens are named by index, e.g. #1234
+  def weight_names(self, keys):
+    named = dict([(self._index(self._ns(i)), self._ns(i)) for i in range(len(FEATURE_NAMESPACES))])
+    named.update([(j, '%s:%s' % k) for k, j in self.vocab.iteritems()])
+    return [named.get(int(k), '#%d' % (k,)) for k in keys]
+
+
+  # --> (header, weights) for save_classifier
+  def snapshot(self):
+    return {'kind': 'sparse', 'hash_bits': len(self.W).bit_length() - 1, 'vocab': self.vocab_order}, self.W
+
+
+  # NOTE: w may be a memmap, used as is
+  def _load_snapshot(self, header, w):
+    self.mask = (1 << header['hash_bits']) - 1
+    self.W = w
+    self.vocab_order = [(str(ns), str(t)) for ns, t in header['vocab']]
+    self.vocab = dict([(k, self._index(*k)) for k in self.vocab_order])
+
+
+  # primary routine for adding a datum and getting predicted classification back
+  def classify(self, mixed_features):
     
-    
+    # block until all params updated from last data point
+    while self.in_count != 0:
+      time.sleep(1)
+    self.in_count += 1
+
+    # score over the doc's non-zero features only
+    idx, vals = self._handle_features_in(mixed_features)
+    self.last_x = (idx, vals)
+    return np.dot(self.W[idx], vals)
+
+
+  def feedback(self, true_class):
+    loss = self.update(self.last_x, true_class)
+    self.in_count -= 1
+    return loss
+
+
+  def skip_feedback(self):
+    self.in_count -= 1
+
+
+  # --> doc vector for score_x / update, which (unlike last_x) can be held across other docs'
+  # updates; NOTE: as in classify, new tokens are added to the exact vocabulary here
+  def features_in(self, mixed_features):
+    return self._handle_features_in(mixed_features)
+
+
+  def score_x(self, x):
+    return np.dot(self.W[x[0]], x[1])
+
+
+  # passive-aggressive-I update, touching only the doc's non-zero features --> loss
+  def update(self, x, true_class):
+    tc = int(true_class)
+    idx, vals = x
+    loss = max(0.0, 1 - tc*np.dot(self.W[idx], vals))
+    sq = np.dot(vals, vals)
+    if sq > 0:
+      self.W[idx] += min(self.aggressive, loss/sq)*tc*vals
+    return loss
+
+
+  # token weights of the token fields, for the crawl-side linkScorer
+  # --> { namespace: { token: weight } }, at most n tokens per field, largest |weight| first
+  # NOTE: only tokens in the exact vocabulary (the first CLF_VOCAB_MAX seen) are exported
+  def link_model(self, n=None):
+    by_ns = {}
+    for ns, token in self.vocab_order:
+      by_ns.setdefault(ns, []).append((token, self.W[self.vocab[(ns, token)]]))
+    return dict([(ns, top_weights(tw, n)) for ns, tw in by_ns.iteritems()])
+
+
+  # score many docs at once w/o touching learning state (weights, vocabulary, in_count)
+  # --> np array of scores, one per doc, as classify would give
+  def score_batch(self, features_list):
+    csr = csrRows()
+    for mixed_features in features_list:
+      x = self._hashed(mixed_features)
+      csr.add_row(x.keys(), x.values())
+    return csr.scores(self.W)
+
+
+# classifier snapshot files, written atomically (tmp file + rename):
+#
+#   file = MAGIC, header_len:u32, header (json), zero padding to a 16 byte boundary, weights
+#
+# the header holds the format version, the kind of classifier & its token maps / vocabulary;
+# weights are a flat little-endian float64 array, so they can be memory-mapped straight from
+# the file rather than unpickled
+CLF_MAGIC = 'RLCLF'
+CLF_FORMAT = 1
+
+def save_classifier(c, fpath=CLF_SNAPSHOT_FILE):
+  header, w = c.snapshot()
+  header['format'] = CLF_FORMAT
+  header['saved'] = time.time()
+  header['n_weights'] = len(w)
+  h = json.dumps(header, separators=(',', ':'))
+  pre = CLF_MAGIC + struct.pack('<I', len(h)) + h
+  pre += '\x00'*(-len(pre) % 16)
+  tmp = fpath + '.tmp'
+  with open(tmp, 'wb') as f:
+    f.write(pre)
+    np.asarray(w, '<f8').tofile(f)
+    f.flush()
+    os.fsync(f.fileno())
+  os.rename(tmp, fpath)
+
+
+# --> (header, offset of weights)
+def read_snapshot_header(fpath):
+  with open(fpath, 'rb') as f:
+    if f.read(len(CLF_MAGIC)) != CLF_MAGIC:
+      raise ValueError('%s is not a classifier snapshot' % (fpath,))
+    n, = struct.unpack('<I', f.read(4))
+    header = json.loads(f.read(n))
+  if header.get('format') != CLF_FORMAT:
+    raise ValueError('%s has snapshot format %s, expected %s' % (fpath, header.get('format'), CLF_FORMAT))
+  offset = len(CLF_MAGIC) + 4 + n
+  return header, offset + (-offset % 16)
+
+
+# mmap_mode: None to read the weights into memory, else a np.memmap mode: 'r' for read only
+# use (e.g. scoring tools sharing one file), 'c' to update in memory w/o touching the file
+# NOTE: only the sparse classifier's weights are mapped; dense weights are read into lists
+def load_classifier(fpath=CLF_SNAPSHOT_FILE, mmap_mode=None):
+  header, offset = read_snapshot_header(fpath)
+  if mmap_mode is None:
+    with open(fpath, 'rb') as f:
+      f.seek(offset)
+      w = np.fromfile(f, '<f8', header['n_weights'])
+  else:
+    w = np.memmap(fpath, '<f8', mmap_mode, offset, (header['n_weights'],))
+  c = SparseOLClassifier(header['hash_bits']) if header['kind'] == 'sparse' else OLClassifier()
+  c._load_snapshot(header, w)
+  return c
+
+
+# the classifier the analysis node & batch tests use, warm started from a snapshot if given
+# & there is one
+def make_classifier(snapshot=None):
+  if snapshot is not None and os.path.exists(snapshot):
+    return load_classifier(snapshot)
+  if CLF_SPARSE:
+    return SparseOLClassifier()
+  return OLClassifier()
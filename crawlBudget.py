@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+import os
+import time
+import pickle
+import threading
+import urlparse
+from collections import Counter
+from node_globals import *
+from node_locals import *
+
+
+# admission budgets & spider trap detection for extracted urls
+#
+# Primary external routines:
+#
+# - For url admission (any thread):
+#   *  admit(url_parts, host_addr) --> True, or False if the url is over budget / in a trap
+#
+# - For restart / shutdown:
+#   *  save(), load(), write_report()
+#
+# Urls are turned away when:
+#
+# - their path is deeper than BUDGET_MAX_DEPTH segments, or repeats a segment more than
+#   BUDGET_MAX_SEGMENT_REPEATS times (e.g. /a/b/a/b/a/b/...)
+# - their host (politeness key) has had BUDGET_HOST_MAX_URLS urls admitted, or their path prefix
+#   (first BUDGET_PREFIX_DEPTH directories) BUDGET_PREFIX_MAX_URLS
+# - a query parameter of their path would take more than BUDGET_PARAM_MAX_VALUES distinct
+#   values (calendars, faceted search, session ids)
+#
+# Every rejection is counted by (host, reason, pattern), the pattern being on the url's
+# hostname (as hosts may be keyed by IP), logged as TRAP the first time & in
+# frontier_budget_rejections_total, & write_report lists them worst host first.
+
+
+class crawlBudget:
+  def __init__(self, Q_logs=None, metrics=None, fpath=BUDGET_STATS_FILE):
+    self.Q_logs = Q_logs
+    self.metrics = metrics
+    self.fpath = fpath
+    self.lock = threading.Lock()
+
+    # urls admitted
+    # { host_addr: n }, { (host_addr, prefix): n }
+    self.host_urls = {}
+    self.prefix_urls = {}
+
+    # hashes of the distinct values seen of each query parameter, up to the cap
+    # { (host_addr, path, name): set([hash(value)]) }
+    self.param_values = {}
+
+    # urls rejected
+    # { (host_addr, reason, pattern): n }
+    self.traps = {}
+
+    if metrics is not None:
+      metrics.counter('frontier_budget_rejections_total', 'Extracted urls turned away by crawl budgets / trap detection, by reason')
+      metrics.gauge('frontier_trap_patterns', 'Distinct (host, reason, pattern) rejections so far', lambda: len(self.traps))
+
+
+  # primary routine
+  def admit(self, url_parts, host_addr):
+    segs = [s for s in url_parts.path.split('/') if s != '']
+    prefix = '/' + '/'.join(segs[:min(BUDGET_PREFIX_DEPTH, max(len(segs) - 1, 0))])
+    netloc = url_parts.netloc
+
+    # structural traps
+    if len(segs) > BUDGET_MAX_DEPTH:
+      return self._reject(host_addr, 'depth', '%s%s/... (> %s segments)' % (netloc, prefix, BUDGET_MAX_DEPTH))
+    if len(segs) > BUDGET_MAX_SEGMENT_REPEATS:
+      seg, n = Counter(segs).most_common(1)[0]
+      if n > BUDGET_MAX_SEGMENT_REPEATS:
+        return self._reject(host_addr, 'repeated_segment', '%s%s/.../%s/.../%s/...' % (netloc, prefix, seg, seg))
+
+    # budgets
+    rejected = self._charge(url_parts.path, urlparse.parse_qsl(url_parts.query, True), host_addr, prefix)
+    if rejected is not None:
+      return self._reject(host_addr, rejected[0], netloc + rejected[1])
+    return True
+
+
+  # count the url against its budgets --> None, or (reason, pattern) if over one
+  def _charge(self, path, params, host_addr, prefix):
+    with self.lock:
+      if self.host_urls.get(host_addr, 0) >= BUDGET_HOST_MAX_URLS:
+        return 'host', '/*'
+      if self.prefix_urls.get((host_addr, prefix), 0) >= BUDGET_PREFIX_MAX_URLS:
+        return 'prefix', prefix + '/*'
+      new_values = []
+      for name, value in params:
+        values = self.param_values.setdefault((host_addr, path, name), set())
+        h = hash(value)
+        if h not in values:
+          if len(values) >= BUDGET_PARAM_MAX_VALUES:
+            return 'param', '%s?%s=*' % (path, name)
+          new_values.append((values, h))
+      for values, h in new_values:
+        values.add(h)
+      self.host_urls[host_addr] = self.host_urls.get(host_addr, 0) + 1
+      self.prefix_urls[(host_addr, prefix)] = self.prefix_urls.get((host_addr, prefix), 0) + 1
+    return None
+
+
+  def _reject(self, host_addr, reason, pattern):
+    key = (host_addr, reason, pattern)
+    with self.lock:
+      n = self.traps.get(key, 0)
+      self.traps[key] = n + 1
+    if n == 0 and self.Q_logs is not None:
+      self.Q_logs.put('TRAP: %s %s %s' % (host_addr, reason, pattern))
+    if self.metrics is not None:
+      self.metrics.inc('frontier_budget_rejections_total', reason=reason)
+    return False
+
+
+  # --> report lines: host totals, worst first, each followed by its patterns
+  def report(self):
+    with self.lock:
+      traps = self.traps.items()
+      host_urls = dict(self.host_urls)
+    by_host = {}
+    for (host_addr, reason, pattern), n in traps:
+      by_host.setdefault(host_addr, []).append((n, reason, pattern))
+    lines = ['# crawl budget / spider trap report at %s' % (time.strftime('%Y-%m-%d %H:%M:%S'),)]
+    lines.append('# host (urls rejected, urls admitted) --> rejected, reason, pattern')
+    for host_addr, ts in sorted(by_host.items(), key=lambda h: -sum([t[0] for t in h[1]])):
+      lines.append('%s (%s rejected, %s admitted)' % (host_addr, sum([t[0] for t in ts]), host_urls.get(host_addr, 0)))
+      for n, reason, pattern in sorted(ts, reverse=True):
+        lines.append('  %8d  %-16s  %s' % (n, reason, pattern))
+    return lines
+
+
+  def write_report(self, fpath=BUDGET_REPORT_FILE):
+    with open(fpath, 'w') as f:
+      f.write('\n'.join(self.report()) + '\n')
+
+
+  # persist budgets used & traps found, so that a restarted crawl does not refill them
+  def save(self):
+    with self.lock:
+      dump = (dict(self.host_urls), dict(self.prefix_urls), dict(self.param_values), dict(self.traps))
+    with open(self.fpath + '.tmp', 'wb') as f:
+      pickle.dump(dump, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(self.fpath + '.tmp', self.fpath)
+
+
+  def load(self):
+    try:
+      with open(self.fpath, 'rb') as f:
+        dump = pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError):
+      return False
+    with self.lock:
+      for d, d_in in zip((self.host_urls, self.prefix_urls, self.param_values, self.traps), dump):
+        d.update(d_in)
+    return True
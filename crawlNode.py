@@ -7,22 +7,131 @@ import datetime
 import time
 from util import *
 from urlFrontier import urlFrontier
+from nodeMetrics import start_metrics_server
+from crawlTrace import crawlTracer, WAIT
+from parseStage import parseStage, parse_page, FAILED_PARSE
+from crawlScaler import crawlScaler
+from seedLoader import seedLoader
+from frontierRecord import parentInfo
 import re
 import pycurl
 import cStringIO
 import threading
+import itertools
+import signal
 from pageAnalyze import *
 from node_globals import *
 from node_locals import *
 import numpy as np
 
 
+# pycurl header callback: collect 'name: value' header lines into a dict (lowercase names)
+# NOTE: with redirects followed, headers of the final response overwrite earlier ones
+def collect_header(headers, header_line):
+  if ':' in header_line:
+    name, value = header_line.split(':', 1)
+    headers[name.strip().lower()] = value.strip()
+
+
+# wall-clock phases of a completed pull from pycurl's cumulative timers, in secs
+# NOTE: hosts are pulled by IP so 'dns' should be ~0; it is kept to catch redirects
+def curl_phase_times(c):
+  namelookup = c.getinfo(c.NAMELOOKUP_TIME)
+  connect = c.getinfo(c.CONNECT_TIME)
+  appconnect = c.getinfo(c.APPCONNECT_TIME)
+  pretransfer = c.getinfo(c.PRETRANSFER_TIME)
+  starttransfer = c.getinfo(c.STARTTRANSFER_TIME)
+  total = c.getinfo(c.TOTAL_TIME)
+  return {
+    'dns': namelookup,
+    'connect': max(0.0, connect - namelookup),
+    'tls': max(0.0, appconnect - connect) if appconnect > 0 else 0.0,
+    'ttfb': max(0.0, starttransfer - pretransfer),
+    'transfer': max(0.0, total - starttransfer),
+    'fetch': total }
+
+
+# admit a parsed page: payload out to db, pull result & extracted links to the url frontier
+#
+# ctx = (url, host_addr, host_seed_dist, parent_page_stats, parent_url, fetch_secs, http_code,
+#        phase_times, trace, time_submitted or None)
+def admit_page(uf, Q_payload, Q_logs, ctx, html, parsed):
+  url, host_addr, host_seed_dist, parent_page_stats, parent_url, fetch_secs, http_code, phase_times, tr, t_submit = ctx
+  extracted_urls, link_stats, page_stats, record, parse_secs, logs, capped = parsed
+  for l in logs:
+    Q_logs.put(l)
+  if capped is not None:
+    uf.metrics.inc('parse_capped_total', limit=capped)
+
+  # harvest rate: is the page relevant by the crawl-side model (once there is one)?
+  rec = read_feature_record(record)
+  if rec is not None and uf.scorer.version > 0:
+    uf.metrics.inc('crawl_pages_scored_total')
+    if uf.scorer.page_score(rec[3], rec[4]) > LINK_MODEL_RELEVANT_THRESH:
+      uf.metrics.inc('crawl_pages_relevant_total')
+  phase_times['parse'] = parse_secs
+  if t_submit is not None:
+    phase_times['parse_queue'] = max(0.0, time.time() - t_submit - parse_secs)
+
+  # add page, url + features list to queue out (-> database / analysis nodes)
+  row_dict = {
+    'url': url,
+    'html': html,
+    'node': NODE_ID
+  }
+  if parent_page_stats is not None:
+    row_dict['parent_stats'] = flist_to_string(parent_page_stats)
+  if parent_url is not None:
+    row_dict['parent_url'] = parent_url
+  if record is not None:
+    row_dict['features'] = record
+  with Timer() as te:
+    if uf.active:
+      Q_payload.put(row_dict)
+  phase_times['enqueue'] = te.duration
+  if tr is not None:
+    tr.mark('enqueue')
+
+  # package all data that needs to be passed on with child links
+  # the data format of extracted link packages will be:
+  #
+  # url_pkg = ( url, parent, link_title_tokens )
+  #
+  # with parent a frontierRecord.parentInfo, shared by all the page's links, of:
+  #
+  #   #: page_text_len,
+  #   #: num_links,
+  #   [t]: title_tokens,
+  #   url (the links' parent url)
+  if len(extracted_urls) > 0:
+    parent = parentInfo(page_stats[0], page_stats[1], page_stats[2], url)
+    extracted_url_pkgs = [(u, parent, ls[0]) for u, ls in zip(extracted_urls, link_stats)]
+  else:
+    extracted_url_pkgs = []
+
+  # log page pull as successful & submit extracted urls + data to url frontier
+  with Timer() as ta:
+    if uf.active:
+      uf.log_and_add_extracted(host_addr,host_seed_dist, True, fetch_secs, extracted_url_pkgs, http_code)
+  phase_times['admission'] = ta.duration
+  uf.latency.record(host_addr, phase_times)
+  if tr is not None:
+    tr.mark('admission')
+    tr.finish()
+
+
 # basic routine for crawling a single page from url Frontier, extracting links, logging/adding
 # back to frontier
-def crawl_page(uf, Q_payload, Q_logs, thread_name='Thread-?'):
+# NOTE: if a tracer is passed, a sample of pages is traced stage by stage (see crawlTrace.py)
+# NOTE: if a parser (parseStage) is passed, pages are parsed & admitted off this thread
+def crawl_page(uf, Q_payload, Q_logs, thread_name='Thread-?', tracer=None, parser=None):
+  tr = tracer.start(thread_name) if tracer is not None else None
   
   # get page from urlFrontier
-  next_pull_time,host_addr,url,parent_page_stats,host_seed_dist,parent_url = uf.get_crawl_task()
+  next_pull_time,host_addr,rec = uf.get_crawl_task()
+  url, parent_page_stats, host_seed_dist, parent_url = rec.url, rec.stats, rec.seed_dist, rec.parent_url
+  if tr is not None:
+    tr.mark('get_task', WAIT)
 
   # report active url
   # NOTE: note that there are problems with this methodology, but that errors will only lead
@@ -32,10 +141,11 @@ def crawl_page(uf, Q_payload, Q_logs, thread_name='Thread-?'):
   if DEBUG_MODE:
     Q_logs.put('%s: got %s from queue' % (thread_name, url))
 
-  # construct full addr-based url
+  # construct full addr-based url (host_addr is the hq's politeness key, see urlFrontier)
   url_parts = list(urlparse.urlsplit(url))
   root_url = url_parts[1]
-  url_parts[1] = host_addr
+  addr = uf.connect_addr(root_url, host_addr)
+  url_parts[1] = addr
   url_addr = urlparse.urlunsplit(url_parts)
 
   # IF PAGE IS A DOC TYPE (e.g. pdf, doc, ...) DO NOT PULL HERE --> STRAIGHT TO DB W MARKER
@@ -54,20 +164,37 @@ def crawl_page(uf, Q_payload, Q_logs, thread_name='Thread-?'):
     
     # submit to db messenger
     if uf.active:
-      Q_payload.Q_out.put(row_dict)
+      Q_payload.put(row_dict)
+    uf.metrics.inc('crawl_fetches_total', result='skipped')
+    if tr is not None:
+      tr.mark('enqueue')
 
-    # log to url frontier(!!); log as failed pull (for now)
+    # log to url frontier(!!); log as failed pull (for now), but not as an actual pull
     if uf.active:
-      uf.log_and_add_extracted(host_addr,host_seed_dist, False)
+      uf.log_and_add_extracted(host_addr,host_seed_dist, False, fetched=False)
+    if tr is not None:
+      tr.mark('admission')
+      tr.finish()
 
     # clear active thread marker
     uf.thread_active[thread_name] = None
 
     # exit here
     return True
+
+  # if the url's host no longer resolves, fail the pull as curl would (couldn't resolve host)
+  if addr is None:
+    uf.metrics.inc('crawl_fetches_total', result='conn_error')
+    uf.log_and_add_extracted(host_addr, host_seed_dist, False, failed_task=rec, curl_errno=6)
+    if tr is not None:
+      tr.mark('admission')
+      tr.finish()
+    uf.thread_active[thread_name] = None
+    return False
   
   # pull page with pyCurl
   buf = cStringIO.StringIO()
+  headers = {}
   c = pycurl.Curl()
 
   # set pycurl opts
@@ -80,10 +207,15 @@ def crawl_page(uf, Q_payload, Q_logs, thread_name='Thread-?'):
   c.setopt(c.MAXREDIRS, 5)
   c.setopt(c.TIMEOUT, CURLOPT_TIMEOUT)
   c.setopt(c.WRITEFUNCTION, buf.write)
+  c.setopt(c.HEADERFUNCTION, lambda h: collect_header(headers, h))
   
   # delay until >= next_pull_time
   wait_time = next_pull_time - datetime.datetime.now()
+  uf.metrics.inc('crawl_workers_waiting')
   time.sleep(max(0, wait_time.total_seconds()))
+  uf.metrics.dec('crawl_workers_waiting')
+  if tr is not None:
+    tr.mark('wait', WAIT)
 
   # if uf went inactive since crawl task was pulled, stop now
   if not uf.active:
@@ -92,62 +224,61 @@ def crawl_page(uf, Q_payload, Q_logs, thread_name='Thread-?'):
   if DEBUG_MODE:
     Q_logs.put('%s: pulling page %s at %s' % (thread_name, url, datetime.datetime.now()))
 
-  # pull page from web and record pull time
-  with Timer() as t:
-    try:
-      c.perform()
-      pulled = True
-    except Exception as e:
-      Q_logs.put('%s: CONNECTION ERROR: %s from parent url %s at %s: %s' % (thread_name, url, parent_url, datetime.datetime.now(), e[1]))
-      uf.log_and_add_extracted(host_addr, host_seed_dist, False)
-      task = uf.Q_active_count.get()
-      uf.Q_active_count.task_done()
-      pulled = False
-      uf.thread_active[thread_name] = None
+  # take one of the IP's fetch slots for the pull (also counted as waiting); none is given
+  # once the frontier is shut down
+  uf.metrics.inc('crawl_workers_waiting')
+  got_slot = uf.acquire_ip(addr)
+  uf.metrics.dec('crawl_workers_waiting')
+  if not got_slot:
+    return False
+
+  # pull page from web and record pull time, releasing the slot whatever happens
+  try:
+    with Timer() as t:
+      try:
+        c.perform()
+        pulled = True
+        if tr is not None:
+          tr.mark('fetch')
+      except Exception as e:
+        if tr is not None:
+          tr.mark('fetch')
+        Q_logs.put('%s: CONNECTION ERROR: %s from parent url %s at %s: %s' % (thread_name, url, parent_url, datetime.datetime.now(), e[1]))
+        uf.metrics.inc('crawl_fetches_total', result='conn_error')
+        uf.log_and_add_extracted(host_addr, host_seed_dist, False, failed_task=rec, curl_errno=e[0])
+        if tr is not None:
+          tr.mark('admission')
+          tr.finish()
+        pulled = False
+        uf.thread_active[thread_name] = None
+  finally:
+    uf.release_ip(addr)
   
   if pulled:
 
+    # record fetch phase times
+    phase_times = curl_phase_times(c)
+
     # Check for page transfer success (not connection/transfer timeouts are handled by opts)
     if c.getinfo(c.HTTP_CODE) < 400:
-
-      # parse page for links & associated data
-      html = basic_html_clean(buf.getvalue())
-      extracted_urls, link_stats = extract_link_data(html, url, Q_logs)
-      
-      # parse page only for stats that need to be passed on with child links
-      page_stats = extract_passed_stats(html)
-
-      # add page, url + features list to queue out (-> database / analysis nodes)
-      row_dict = {
-        'url': url,
-        'html': html,
-        'node': NODE_ID
-      }
-      if parent_page_stats is not None:
-        row_dict['parent_stats'] = flist_to_string(parent_page_stats)
-      if parent_url is not None:
-        row_dict['parent_url'] = parent_url
-      if uf.active:
-        Q_payload.Q_out.put(row_dict)
-
-      # package all data that needs to be passed on with child links
-      # the data format of extracted link packages will be:
-      #
-      # url_pkg = ( url, parent_page_stats, parent_url )
-      #
-      # with:
-      #
-      # parent_page_stats = (
-      #                       #: page_text_len,
-      #                       #: num_links,
-      #                       [t]: title_tokens,
-      #                       [t]: link_title_tokens
-      #                     )
-      extracted_url_pkgs = zip(extracted_urls, [tuple(page_stats) + tuple(ls) for ls in link_stats], [url for x in extracted_urls])
-
-      # log page pull as successful & submit extracted urls + data to url frontier
-      if uf.active:
-        uf.log_and_add_extracted(host_addr,host_seed_dist, True, t.duration, extracted_url_pkgs)
+      uf.metrics.inc('crawl_fetches_total', result='success')
+      ctx = [url, host_addr, host_seed_dist, parent_page_stats, parent_url, t.duration, int(c.getinfo(c.HTTP_CODE)), phase_times, tr, None]
+
+      # hand off to the parse stage (the url is tracked there for restart dumps until admitted)
+      if parser is not None:
+        ctx[-1] = time.time()
+        uf.thread_active['parse:' + url] = url
+        parser.submit(buf.getvalue(), url, tuple(ctx))
+        if tr is not None:
+          tr.mark('parse_submit', WAIT)
+
+      # or parse & admit here
+      else:
+        html = buf.getvalue().translate(None, HIGH_BYTES)
+        parsed = parse_page(html, url)
+        if tr is not None:
+          tr.mark('parse')
+        admit_page(uf, Q_payload, Q_logs, tuple(ctx), html, parsed)
 
       # clear thread active here
       # NOTE: there still is a problem if node restart dump occurs AFTER this but before
@@ -156,28 +287,115 @@ def crawl_page(uf, Q_payload, Q_logs, thread_name='Thread-?'):
 
     else:
       Q_logs.put('%s: CONNECTION ERROR: HTTP code %s from %s, from parent url %s, at %s' % (thread_name, int(c.getinfo(c.HTTP_CODE)), url, parent_url, datetime.datetime.now()))
-      uf.log_and_add_extracted(host_addr, host_seed_dist, False)
-      task = uf.Q_active_count.get()
-      uf.Q_active_count.task_done()
+      uf.metrics.inc('crawl_fetches_total', result='http_error')
+      uf.log_and_add_extracted(host_addr, host_seed_dist, False, t.duration, [], int(c.getinfo(c.HTTP_CODE)), headers.get('retry-after'), failed_task=rec)
+      uf.latency.record(host_addr, phase_times)
+      if tr is not None:
+        tr.mark('admission')
+        tr.finish()
       uf.thread_active[thread_name] = None
 
 
-# crawl thread class
+# crawl thread class; a thread of a crawlerPool retires between pages when the pool shrinks
 class CrawlThread(threading.Thread):
-  def __init__(self, uf, Q_payload, Q_logs):
+  def __init__(self, uf, Q_payload, Q_logs, tracer=None, parser=None, pool=None):
     threading.Thread.__init__(self)
     self.uf = uf
     self.Q_payload = Q_payload
     self.Q_logs = Q_logs
+    self.tracer = tracer
+    self.parser = parser
+    self.pool = pool
 
   def run(self):
     try:
-      while True:
-        crawl_page(self.uf, self.Q_payload, self.Q_logs, self.getName())
+      while self.pool is None or not self.pool.retire():
+        crawl_page(self.uf, self.Q_payload, self.Q_logs, self.getName(), self.tracer, self.parser)
     except:
       handle_thread_exception(self.getName(), 'crawl-thread', self.uf, self.Q_logs)
 
 
+# resizable pool of daemon CrawlThread threads, sized by the crawl scaler
+class crawlerPool:
+  def __init__(self, uf, Q_payload, Q_logs, tracer=None, parser=None):
+    self.args = (uf, Q_payload, Q_logs, tracer, parser)
+    self.lock = threading.Lock()
+    self.threads = 0
+    self.to_retire = 0
+
+
+  # number of crawl threads, not counting those due to retire
+  def size(self):
+    return self.threads - self.to_retire
+
+
+  def resize(self, n):
+    with self.lock:
+      d = n - (self.threads - self.to_retire)
+
+      # shrink by retiring threads as they finish their current page; grow by first calling
+      # off pending retirements
+      if d < 0:
+        self.to_retire += -d
+        return
+      r = min(d, self.to_retire)
+      self.to_retire -= r
+      for i in range(d - r):
+        t = CrawlThread(*self.args, pool=self)
+        t.setDaemon(True)
+        t.start()
+        self.threads += 1
+
+
+  # called by a crawl thread between pages --> True if it should exit
+  def retire(self):
+    with self.lock:
+      if self.to_retire > 0:
+        self.to_retire -= 1
+        self.threads -= 1
+        return True
+    return False
+
+
+# crawl scaler thread class
+class ScaleThread(threading.Thread):
+  def __init__(self, scaler):
+    threading.Thread.__init__(self)
+    self.scaler = scaler
+
+  def run(self):
+    try:
+      self.scaler.loop()
+    except:
+      handle_thread_exception(self.getName(), 'scale-thread', self.scaler.uf, self.scaler.Q_logs)
+
+
+# parse stage admission thread class: admits pages coming back from the parse pool
+class ParseAdmitThread(threading.Thread):
+  def __init__(self, uf, parser, Q_payload, Q_logs):
+    threading.Thread.__init__(self)
+    self.uf = uf
+    self.parser = parser
+    self.Q_payload = Q_payload
+    self.Q_logs = Q_logs
+
+  def run(self):
+    try:
+      while True:
+        ctx, html, (ok, parsed) = self.parser.get_result()
+        tr = ctx[8]
+        if tr is not None:
+          tr.mark('parse', WAIT)
+        if not ok:
+          self.Q_logs.put('PARSE ERROR: %s:\n%s' % (ctx[0], parsed))
+          parsed = FAILED_PARSE
+        admit_page(self.uf, self.Q_payload, self.Q_logs, ctx, html, parsed)
+        self.uf.thread_active.pop('parse:' + ctx[0], None)
+        self.parser.task_done(ok)
+    except:
+      handle_thread_exception(self.getName(), 'parse-admit-thread', self.uf, self.Q_logs)
+
+
 # maintenance thread class
 class MaintenanceThread(threading.Thread):
   def __init__(self, uf, Q_logs):
@@ -192,8 +410,12 @@ class MaintenanceThread(threading.Thread):
       handle_thread_exception(self.getName(), 'maint-thread', self.uf, self.Q_logs)
 
 
-# main multi-thread crawl routine
-def multithread_crawl(node_n, initial_url_list, seen_persist=False):
+# main multi-thread crawl routine; seed files are streamed in after the initial url list, w/
+# shared_seeds if every node loads the same files (see seedLoader)
+def multithread_crawl(node_n, initial_url_list, seen_persist=False, seed_files=[], shared_seeds=False):
+
+  # start the parse process pool first, so that workers are forked before any threads exist
+  parser = parseStage() if PARSE_WORKERS > 0 else None
 
   # initialize activity monitor row- need to esp clear stop flags from previous run!
   with DB_connection(DB_VARS) as handle:
@@ -207,6 +429,12 @@ def multithread_crawl(node_n, initial_url_list, seen_persist=False):
   # instantiate one urlFontier object for all threads
   uf = urlFrontier(node_n, seen_persist, Q_logs)
 
+  # dump fetch latency histograms & the trap report on demand, i.e. on `kill -USR1 <pid>`
+  signal.signal(signal.SIGUSR1, lambda signum, frame: (uf.latency.dump(), uf.budget.write_report()))
+
+  # serve live node metrics at http://<node>:METRICS_PORT/metrics
+  start_metrics_server(uf.metrics, METRICS_PORT)
+
   # instantiate a queue-out-to-db handler
   Q_payload = Q_out_to_db(DB_VARS, DB_PAYLOAD_TABLE, uf, Q_logs)
 
@@ -220,13 +448,25 @@ def multithread_crawl(node_n, initial_url_list, seen_persist=False):
   time.sleep(NODE_START_DELAY)
 
   # initialize the urlFrontier
-  uf.initialize(initial_url_list)
-
-  # spawn a pool of daemon CrawlThread threads
-  for i in range(NUMBER_OF_CTHREADS):
-    t = CrawlThread(uf, Q_payload, Q_logs)
-    t.setDaemon(True)
-    t.start()
+  uf.initialize(itertools.chain(initial_url_list, seedLoader(uf, seed_files, shared_seeds, Q_logs).urls()))
+
+  # sampled stage tracing of page crawls (TRACE_SAMPLE_RATE of pages; 0 to turn off)
+  tracer = crawlTracer()
+
+  # spawn a pool of daemon CrawlThread threads, resized at runtime by the crawl scaler
+  pool = crawlerPool(uf, Q_payload, Q_logs, tracer, parser)
+  pool.resize(NUMBER_OF_CTHREADS)
+  uf.metrics.gauge('crawl_workers', 'Crawl threads', pool.size)
+
+  # spawn daemon ParseAdmitThread threads for the parse stage
+  if parser is not None:
+    uf.metrics.gauge('parse_stage_pages', 'Pages fetched & waiting on parse or admission', lambda: parser.pending)
+    uf.metrics.counter('parse_stage_parsed_total', 'Pages parsed by the parse pool', lambda: parser.parsed)
+    uf.metrics.counter('parse_stage_errors_total', 'Pages whose parse raised in the parse pool', lambda: parser.errors)
+    for i in range(PARSE_ADMIT_THREADS):
+      t = ParseAdmitThread(uf, parser, Q_payload, Q_logs)
+      t.setDaemon(True)
+      t.start()
 
   # spawn a pool of daemon MaintenanceThread threads
   for i in range(NUMBER_OF_MTHREADS):
@@ -234,6 +474,12 @@ def multithread_crawl(node_n, initial_url_list, seen_persist=False):
     t.setDaemon(True)
     t.start()
   
+  # resize crawl threads & active hqs to ready hosts, fetch latency & cpu use
+  if AUTO_SCALE:
+    t = ScaleThread(crawlScaler(uf, pool, Q_logs))
+    t.setDaemon(True)
+    t.start()
+
   # log crawl as started
   Q_logs.put('crawl started (NODE %s of %s, %s + %s threads); Ctrl-C to abort' % ((node_n+1), NUMBER_OF_NODES, NUMBER_OF_CTHREADS, NUMBER_OF_MTHREADS))
 
@@ -250,9 +496,13 @@ def multithread_crawl(node_n, initial_url_list, seen_persist=False):
           'scount': Q_ms.scount(),
           'init': 1 }
         insert_or_update(handle, DB_NODE_ACTIVITY_TABLE, (node_n + 1), row_dict)
+
+        # pick up any newer link scoring model exported by the analysis node
+        uf.scorer.refresh(handle)
         if DEBUG_MODE:
           Q_logs.put("Submitted node activity status (a: %s, s: %s, r: %s)" % (uf.Q_active_count.qsize(), Q_ms.scount(), Q_mr.rcount()))
-          Q_logs.put("uf status: (pd: %s, ct: %s, hqs: %s, ou: %s, hqc: %s)" % (uf.payloads_dropped, uf.Q_crawl_tasks.qsize(), sum([len(v) for k,v in uf.hqs.iteritems()]), uf.Q_overflow_urls.qsize(), uf.Q_hq_cleanup.qsize()))
+          Q_logs.put("uf status: (pd: %s, ct: %s, hqs: %s, ou: %s, hqc: %s)" % (uf.payloads_dropped, uf.Q_crawl_tasks.qsize(), uf.metrics.value('frontier_hq_urls'), uf.Q_overflow_urls.qsize(), uf.Q_hq_cleanup.qsize()))
+          Q_logs.put("uf failures: (rq: %s, rt: %s, gu: %s, ph: %s/%s)" % (uf.Q_retry.qsize(), uf.retries, uf.give_ups, len(uf.parked), uf.hosts_parked))
 
         time.sleep(ACTIVITY_CHECK_P/10.0)
 
@@ -263,6 +513,7 @@ def multithread_crawl(node_n, initial_url_list, seen_persist=False):
         # [A] Crawl completed if active counts all == 0 & sent == received & all have been init
         if nr_sums[2] == 0 and nr_sums[3] == nr_sums[4] and nr_sums[1] == NUMBER_OF_NODES:
           Q_logs.put("crawl completed at %s" % (datetime.datetime.now(),))
+          uf.budget.write_report()
           time.sleep(5)
           sys.exit(0)
 
@@ -294,10 +545,11 @@ if __name__ == '__main__':
   if sys.argv[1] == 'run' and len(sys.argv) == 2:
     multithread_crawl(NODE_ID, SEED_LIST)
   elif sys.argv[1] == 'restart' and len(sys.argv) == 2:
-    with open(RESTART_DUMP, 'r') as f:
-      restart_seeds = [re.sub(r'\n', '', l) for l in f.readlines()]
-    multithread_crawl(NODE_ID, restart_seeds, True)
+    multithread_crawl(NODE_ID, [], True, [RESTART_DUMP])
+  elif sys.argv[1] == 'seed' and len(sys.argv) >= 3:
+    multithread_crawl(NODE_ID, SEED_LIST, False, sys.argv[2:], True)
   else:
     print 'Usage: python crawlNode.py ...'
     print '(1) run'
     print '(2) restart'
+    print '(3) seed <seed_file> [seed_file ...]  # plain or gzip, one url per line; every node loads the same files'
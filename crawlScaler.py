@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import os
+import time
+import math
+from node_globals import *
+
+
+# auto-scaling of a crawl node's crawl threads & active host queues
+#
+# Primary external routines:
+#
+# - For the crawl node's ScaleThread:
+#   *  loop() --> every SCALE_CHECK_P secs, check()
+#
+# Every check resizes, within the SCALE_* bounds:
+#
+# - crawl threads to SCALE_HEADROOM x the threads needed right now, i.e. those busy (not
+#   waiting on a crawl task or a politeness delay) plus one per ready host (crawl task already
+#   due) left waiting; at most doubling / halving per check, & not growing while the crawl
+#   process' cpu use is over SCALE_MAX_CPU, as more threads then only contend for the GIL
+#
+# - active hqs to the number of hosts that keeps those threads busy, by Little's law: each
+#   host is pulled once per (politeness delay + fetch latency), each pull holds a thread for
+#   the fetch latency, so hosts = threads x (delay + latency) / latency
+#
+# Decisions are logged as SCALE & counted in crawl_scale_decisions_total.
+
+
+class crawlScaler:
+  def __init__(self, uf, pool, Q_logs=None):
+    self.uf = uf
+    self.pool = pool
+    self.Q_logs = Q_logs
+
+    # last measurements
+    self.cpu = 0.0
+    self.latency = None
+    self.delay = RATE_INITIAL_DELAY
+    self.last_time = time.time()
+    self.last_cpu = self._cpu_secs()
+    self.last_fetch = self._fetch_totals()
+
+    m = uf.metrics
+    m.gauge('crawl_ready_hosts', 'Hosts due to be pulled & waiting on a crawl thread', uf.ready_hosts)
+    m.gauge('crawl_process_cpu', 'Crawl process cpu use over the last scale check, in cores', lambda: self.cpu)
+    m.gauge('crawl_scale_fetch_latency_seconds', 'Mean fetch latency over the last scale check', lambda: self.latency or 0.0)
+    m.counter('crawl_scale_decisions_total', 'Resizes by the crawl scaler, by target (workers, hqs) & direction')
+
+
+  def _cpu_secs(self):
+    t = os.times()
+    return t[0] + t[1]
+
+
+  def _fetch_totals(self):
+    with self.uf.latency.lock:
+      h = self.uf.latency.phases['fetch']
+      return h.total, h.n
+
+
+  # update cpu use, mean fetch latency (since last check) & mean politeness delay of active hqs
+  def _measure(self):
+    now = time.time()
+    cpu = self._cpu_secs()
+    if now > self.last_time:
+      self.cpu = (cpu - self.last_cpu)/(now - self.last_time)
+    self.last_time, self.last_cpu = now, cpu
+
+    total, n = self._fetch_totals()
+    if n > self.last_fetch[1]:
+      self.latency = (total - self.last_fetch[0])/(n - self.last_fetch[1])
+    self.last_fetch = (total, n)
+
+    hosts = self.uf.hqs.keys()
+    if len(hosts) > 0:
+      self.delay = sum([max(self.uf.rates.current(h), self.uf.crawl_delays.get(h, 0)) for h in hosts])/float(len(hosts))
+
+
+  # --> (crawl threads, active hqs) for the given state
+  def decide(self, workers, busy, ready):
+    n = int(math.ceil(SCALE_HEADROOM*(busy + ready)))
+    n = min(max(n, workers//2), max(2*workers, 1))
+    if self.cpu > SCALE_MAX_CPU:
+      n = min(n, workers)
+    n = min(max(n, SCALE_MIN_CTHREADS), SCALE_MAX_CTHREADS)
+
+    # w/o latency data yet, keep the static ratio
+    if self.latency is None or self.latency <= 0:
+      hqs = HQ_TO_THREAD_RATIO*n
+    else:
+      hqs = int(math.ceil(SCALE_HEADROOM*n*(self.delay + self.latency)/self.latency))
+    hqs = min(max(hqs, SCALE_MIN_HQS), SCALE_MAX_HQS)
+    return n, hqs
+
+
+  def check(self):
+    self._measure()
+    workers = self.pool.size()
+    busy = max(0, self.pool.threads - self.uf.metrics.value('crawl_workers_waiting'))
+    ready = self.uf.ready_hosts()
+    n, hqs = self.decide(workers, busy, ready)
+
+    # apply & log changes
+    changed = False
+    for target, old, new in [('workers', workers, n), ('hqs', self.uf.hq_target, hqs)]:
+      if new != old:
+        self.uf.metrics.inc('crawl_scale_decisions_total', target=target, direction=('up' if new > old else 'down'))
+        changed = True
+    if not changed:
+      return False
+    if self.Q_logs is not None:
+      self.Q_logs.put('SCALE: workers %s -> %s, hq target %s -> %s (busy %s, ready %s, fetch %s, delay %.1fs, cpu %.2f)' % (workers, n, self.uf.hq_target, hqs, busy, ready, '%.2fs' % (self.latency,) if self.latency is not None else '-', self.delay, self.cpu))
+    self.pool.resize(n)
+    self.uf.set_hq_target(hqs)
+    return True
+
+
+  def loop(self):
+    while self.uf.active:
+      time.sleep(SCALE_CHECK_P)
+      self.check()
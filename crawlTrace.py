@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import random
+import struct
+import threading
+import Queue
+from collections import defaultdict
+from node_globals import *
+
+
+# sampled stage tracing of page crawls
+#
+# Primary external routines:
+#
+# - For crawl threads:
+#   *  tr = tracer.start(thread_name) --> pageTrace, or None if page not sampled
+#   *  tr.mark(stage, kind), tr.finish()
+#
+# - For analysis:
+#   *  python crawlTrace.py summarize <trace_file>
+#
+# A page is sampled with probability TRACE_SAMPLE_RATE; unsampled pages cost one random()
+# call plus an 'is not None' test per stage.  Each mark() closes a span timed from the
+# previous mark, so stages must be marked in the order they run.  Sampled traces are
+# packed & appended to a binary file by a writer thread:
+#
+#   file   = MAGIC, record*
+#   record = 'N' thread_no:u16 len:u8 name           (thread name, sent once per thread)
+#          | 'T' thread_no:u16 start:f64 n:u8 span*  (one sampled page)
+#   span   = stage:u8 kind:u8 secs:f32
+
+MAGIC = 'RLTR\x01'
+
+# stage names in id order; NOTE: append only, ids are stored in trace files
+STAGES = ['get_task', 'wait', 'fetch', 'clean', 'links', 'stats', 'admission', 'enqueue', 'scan', 'parse', 'parse_submit']
+STAGE_IDS = dict([(s, i) for i, s in enumerate(STAGES)])
+
+# span kinds: time doing work vs blocked on a queue / lock / politeness sleep
+WORK = 0
+WAIT = 1
+KINDS = ['work', 'wait']
+
+
+class pageTrace:
+  def __init__(self, tracer, thread_name):
+    self.tracer = tracer
+    self.thread_name = thread_name
+    self.start = self.last = time.time()
+    self.spans = []
+
+  def mark(self, stage, kind=WORK):
+    now = time.time()
+    self.spans.append((STAGE_IDS[stage], kind, now - self.last))
+    self.last = now
+
+  def finish(self):
+    self.tracer.Q_out.put(self)
+
+
+class crawlTracer:
+  def __init__(self, sample_rate=TRACE_SAMPLE_RATE, fpath=TRACE_FILE):
+    self.sample_rate = sample_rate
+    self.fpath = fpath
+    self.Q_out = Queue.Queue()
+    if sample_rate > 0:
+      t = TraceWriterThread(self.Q_out, fpath)
+      t.setDaemon(True)
+      t.start()
+
+  def start(self, thread_name):
+    if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+      return None
+    return pageTrace(self, thread_name)
+
+
+# writer thread packing finished traces onto the end of the trace file
+class TraceWriterThread(threading.Thread):
+  def __init__(self, Q_out, fpath):
+    threading.Thread.__init__(self)
+    self.Q_out = Q_out
+    self.fpath = fpath
+    self.thread_nos = {}
+
+  def run(self):
+    with open(self.fpath, 'ab') as f:
+      if f.tell() == 0:
+        f.write(MAGIC)
+      while True:
+        tr = self.Q_out.get()
+        n = self.thread_nos.get(tr.thread_name)
+        if n is None:
+          n = self.thread_nos[tr.thread_name] = len(self.thread_nos)
+          name = tr.thread_name[:255]
+          f.write(struct.pack('<cHB', 'N', n, len(name)) + name)
+        spans = tr.spans[:255]
+        f.write(struct.pack('<cHdB', 'T', n, tr.start, len(spans)))
+        f.write(''.join([struct.pack('<BBf', *s) for s in spans]))
+        f.flush()
+
+
+# read a trace file --> list of (thread_name, start, [(stage, kind, secs), ...])
+def read_traces(fpath):
+  traces = []
+  names = {}
+  with open(fpath, 'rb') as f:
+    data = f.read()
+  i = 0
+  while i < len(data):
+
+    # a new session appending to the file writes a fresh header & thread table
+    if data[i:i+len(MAGIC)] == MAGIC:
+      names = {}
+      i += len(MAGIC)
+      continue
+    rtype = data[i]
+    if rtype == 'N':
+      _, n, ln = struct.unpack_from('<cHB', data, i)
+      i += 4
+      names[n] = data[i:i+ln]
+      i += ln
+    elif rtype == 'T':
+      _, n, start, ns = struct.unpack_from('<cHdB', data, i)
+      i += 12
+      spans = []
+      for j in range(ns):
+        sid, kind, secs = struct.unpack_from('<BBf', data, i)
+        spans.append((STAGES[sid], kind, secs))
+        i += 6
+      traces.append((names.get(n, '?%s' % (n,)), start, spans))
+    else:
+      raise ValueError('corrupt trace file at byte %s' % (i,))
+  return traces
+
+
+# per-thread & overall table of time by stage, w/ wait time split out
+def summarize(traces):
+  stats = defaultdict(lambda: defaultdict(list))
+  for thread_name, start, spans in traces:
+    for stage, kind, secs in spans:
+      stats[thread_name][(stage, kind)].append(secs)
+      stats['ALL'][(stage, kind)].append(secs)
+  lines = ['%s sampled pages' % (len(traces),)]
+  for thread_name in sorted(stats, key=lambda t: (t != 'ALL', t)):
+    st = stats[thread_name]
+    total = sum([sum(v) for v in st.itervalues()])
+    wait = sum([sum(v) for (s, k), v in st.iteritems() if k == WAIT])
+    lines.append('')
+    lines.append('--> %s: %.3f secs traced, %.1f%% waiting' % (thread_name, total, 100*wait/total if total > 0 else 0))
+    lines.append('%-14s %-5s %7s %10s %10s %10s %7s' % ('stage', 'kind', 'n', 'total', 'mean', 'p90', '%time'))
+    for stage in STAGES:
+      for kind in (WORK, WAIT):
+        v = sorted(st.get((stage, kind), []))
+        if len(v) == 0:
+          continue
+        lines.append('%-14s %-5s %7s %10.4f %10.5f %10.5f %6.1f%%' % (stage, KINDS[kind], len(v), sum(v), sum(v)/len(v), v[int(0.9*(len(v)-1))], 100*sum(v)/total if total > 0 else 0))
+  return lines
+
+
+#
+# --> Command line functionality
+#
+if __name__ == '__main__':
+  if len(sys.argv) == 3 and sys.argv[1] == 'summarize':
+    print '\n'.join(summarize(read_traces(sys.argv[2])))
+  else:
+    print 'Usage: python crawlTrace.py ...'
+    print '(1) summarize <trace_file>'
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+import re
+import time
+import uuid
+import threading
+import Queue
+import classifier
+from linkScorer import export_link_model
+from pageAnalyze import *
+from util import *
+from node_globals import *
+from node_locals import *
+
+
+# session-aware feedback service for the analysis node, so that any number of reviewers can
+# work at once
+#
+# Primary external routines:
+#
+# - For request handlers:
+#   *  checkout() --> (ticket, row, body_html, score, x_readable, w_relevant); blocks until a
+#      payload row is available
+#   *  feedback(ticket, true_class) --> doc id, or None if the ticket is unknown / expired /
+#      already answered
+#   *  release(ticket); once the answered doc's row has been deleted from the payload table
+#
+# A buffer thread keeps up to REVIEW_BUFFER_SIZE payload rows featurized & scored ahead of
+# the reviewers, rescoring them whenever the model is updated, & checkout serves the buffered
+# doc nearest the decision boundary (lowest |score|) first.  Docs buffered or out for review
+# are passed over when fetching more rows.
+#
+# Feedback is queued & applied in order by one updater thread, so a request never waits on
+# other reviewers' documents; the lock is only held for the short vectorize / score / update
+# steps.  The updater also snapshots the classifier & exports the crawl nodes' link model.
+
+
+class feedbackService:
+  def __init__(self, c, Q_logs=None):
+    self.c = c
+    self.Q_logs = Q_logs
+
+    # guards the classifier (weights, token maps / vocabulary) & n_updates
+    self.lock = threading.Lock()
+
+    # outstanding tickets; x is None once answered
+    # { ticket: [doc_id, x, time_served] }
+    self.tickets = {}
+
+    # prefetched, scored payload rows
+    # { doc_id: [row, features, body_html, x, score, n_updates when scored] }
+    self.buffer = {}
+
+    # guards tickets & buffer; notified when either frees up room or the model changes
+    self.buffer_cv = threading.Condition()
+
+    # Queue ~ [ (x, true_class) ]
+    self.Q_updates = Queue.Queue()
+    self.n_updates = 0
+    for target in [self._update_loop, self._buffer_loop]:
+      t = threading.Thread(target=target)
+      t.setDaemon(True)
+      t.start()
+
+
+  def checkout(self):
+    ticket = uuid.uuid4().hex
+    with self.buffer_cv:
+      while len(self.buffer) == 0:
+        self.buffer_cv.wait(REVIEW_BUFFER_POLL)
+      e = min(self.buffer.itervalues(), key=lambda e: abs(e[4]))
+      doc_id = int(e[0][0])
+      del self.buffer[doc_id]
+      self.tickets[ticket] = [doc_id, e[3], time.time()]
+      self.buffer_cv.notify_all()
+    with self.lock:
+      score = self.c.score_x(e[3])
+      x_readable, w_relevant = self.c.readable_weights(e[1])
+    return ticket, e[0], e[2], score, x_readable, w_relevant
+
+
+  def feedback(self, ticket, true_class):
+    with self.buffer_cv:
+      t = self.tickets.get(ticket)
+      if t is None or t[1] is None:
+        return None
+      x = t[1]
+      t[1] = None
+    self.Q_updates.put((x, true_class))
+    return t[0]
+
+
+  # the doc stays reserved until released, so it is not re-fetched before its row is deleted
+  def release(self, ticket):
+    with self.buffer_cv:
+      if self.tickets.pop(ticket, None) is not None:
+        self.buffer_cv.notify_all()
+
+
+  # drop tickets not answered within FEEDBACK_TICKET_TTL, freeing their docs to be re-served
+  def _expire_tickets(self):
+    cutoff = time.time() - FEEDBACK_TICKET_TTL
+    for ticket in [k for k, t in self.tickets.iteritems() if t[2] < cutoff]:
+      del self.tickets[ticket]
+
+
+  def _log(self, msg):
+    if self.Q_logs is not None:
+      self.Q_logs.put(msg)
+    else:
+      print msg
+
+
+  def _update_loop(self):
+    while True:
+      x, tc = self.Q_updates.get()
+      try:
+        with self.lock:
+          self.c.update(x, tc)
+          self.n_updates += 1
+
+          # periodically snapshot the classifier for warm starts, & hand the updated token
+          # weights to the crawl nodes for link scoring
+          if self.n_updates % CLF_SNAPSHOT_EVERY == 0:
+            classifier.save_classifier(self.c, CLF_SNAPSHOT_FILE)
+          if self.n_updates % LINK_MODEL_EXPORT_EVERY == 0:
+            with DB_connection(DB_VARS) as handle:
+              export_link_model(handle, self.c)
+      except Exception as e:
+        self._log('FEEDBACK UPDATE ERROR: %s' % (e,))
+      self.Q_updates.task_done()
+
+      # buffered scores are now stale
+      with self.buffer_cv:
+        self.buffer_cv.notify_all()
+
+
+  def _buffer_loop(self):
+    while True:
+      try:
+        n = self._rescore_buffer() + self._fill_buffer()
+      except Exception as e:
+        self._log('REVIEW BUFFER ERROR: %s' % (e,))
+        n = 0
+
+      # wait for room in the buffer, a model update or new payload rows
+      if n == 0:
+        with self.buffer_cv:
+          self.buffer_cv.wait(REVIEW_BUFFER_POLL)
+
+
+  def _rescore_buffer(self):
+    with self.buffer_cv:
+      stale = [e for e in self.buffer.itervalues() if e[5] != self.n_updates]
+    if len(stale) == 0:
+      return 0
+    with self.lock:
+      n_updates = self.n_updates
+      scores = [self.c.score_x(e[3]) for e in stale]
+    with self.buffer_cv:
+      for e, score in zip(stale, scores):
+        e[4] = score
+        e[5] = n_updates
+    return len(stale)
+
+
+  def _fill_buffer(self):
+    with self.buffer_cv:
+      self._expire_tickets()
+      n = REVIEW_BUFFER_SIZE - len(self.buffer)
+      exclude = self.buffer.keys() + [t[0] for t in self.tickets.itervalues()]
+    if n <= 0:
+      return 0
+
+    # row = [id, url, parent_stats, html, parent_url, features]
+    with DB_connection(DB_VARS) as handle:
+      rows = fetch_rows(handle, DB_PAYLOAD_TABLE, n, exclude, PAYLOAD_COLS)
+    for row in rows:
+      features = extract_features(row[3], string_to_flist(row[2]), self.Q_logs, row_feature_record(row))
+      body_html = re.sub(r'^.*?<body[^>]*>|</body>.*?$', '', row[3], 0, re.DOTALL)
+      with self.lock:
+        x = self.c.features_in(features)
+        score = self.c.score_x(x)
+        n_updates = self.n_updates
+      with self.buffer_cv:
+        self.buffer[int(row[0])] = [row, features, body_html, x, score, n_updates]
+        self.buffer_cv.notify_all()
+    return len(rows)
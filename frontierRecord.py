@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# compact url records for the url frontier's queues (hqs, overflow, crawl tasks, retries,
+# parked hosts & messages to other nodes)
+#
+# - the stats & url of a page, common to all the links extracted from it, are held once in a
+#   parentInfo that the links' records reference; it is freed w/ the last of them
+# - a url is held as its scheme://netloc prefix, interned so that there is one copy per host
+#   (freed w/ the host's last record), + the rest
+# - tokens are interned & token lists held as tuples
+# - records have __slots__ (hence new-style classes)
+#
+# A record's ref_page_stats (page_text_len, num_links, title_tokens, link_title_tokens) &
+# parent_url are built on demand, for the link scorer, payload rows & inter-node messages.
+
+
+def _tokens(tokens):
+  return tuple([intern(t) if type(t) == str else t for t in tokens])
+
+
+# split a url into its (shared) scheme://netloc & the rest
+def _split_url(url):
+  i = url.find('://')
+  j = url.find('/', i + 3) if i > -1 else -1
+  if j == -1:
+    j = len(url)
+  prefix = url[:j]
+  return (intern(prefix) if type(prefix) == str else prefix), url[j:]
+
+
+class parentInfo(object):
+  __slots__ = ('ptl', 'nl', 'title', 'url')
+
+  # ptl, nl & title are None for a url w/ a parent url but no parent stats
+  def __init__(self, ptl, nl, title, url):
+    self.ptl = ptl
+    self.nl = nl
+    self.title = _tokens(title) if title is not None else None
+    self.url = url
+
+
+# ( url, parent_page_stats, parent_url ) --> (parentInfo or None, link_title_tokens)
+def parent_of(ref_page_stats, parent_url):
+  if ref_page_stats is None:
+    return (parentInfo(None, None, None, parent_url) if parent_url is not None else None), None
+  ptl, nl, tt, ltt = ref_page_stats
+  return parentInfo(ptl, nl, tt, parent_url), ltt
+
+
+class urlRecord(object):
+  __slots__ = ('prefix', 'rest', 'seed_dist', 'parent', 'link')
+
+  def __init__(self, url, seed_dist=0, parent=None, link=None):
+    self.prefix, self.rest = _split_url(url)
+    self.seed_dist = seed_dist
+    self.parent = parent
+    self.link = _tokens(link) if link is not None else None
+
+  @property
+  def url(self):
+    return self.prefix + self.rest
+
+  @property
+  def parent_url(self):
+    return self.parent.url if self.parent is not None else None
+
+  # ref_page_stats = (page_text_len, num_links, title_tokens, link_title_tokens), or None
+  @property
+  def stats(self):
+    p = self.parent
+    if p is None or p.ptl is None:
+      return None
+    return (p.ptl, p.nl, p.title, self.link if self.link is not None else ())
+
+  # --> (url, ref_page_stats, seed_dist, parent_url) as sent to other nodes
+  def wire(self):
+    return (self.url, self.stats, self.seed_dist, self.parent_url)
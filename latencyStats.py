@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import json
+import threading
+from node_globals import *
+
+
+# in-memory latency histograms of crawl fetch phases
+#
+# Primary external routines:
+#
+# - For crawl threads:
+#   *  latencyRecorder.record(host_addr, {phase: secs, ...})
+#
+# - For dumps (on demand / on restart dump):
+#   *  latencyRecorder.dump(fpath), load_dump(fpath), summary lines via summarize()
+#
+# Histograms are HDR-style: values are bucketed in microseconds with LATENCY_SIG_BITS of
+# linear sub-buckets per power of two, so relative error is constant (~1/2^(bits-1)) from
+# microseconds to hours.  Buckets are held sparsely and histograms with the same bits
+# merge by adding counts, so per-host, per-node and cross-node views all add up.
+
+# fetch phases from pycurl, then crawl-side processing phases ('parse_queue' = time a page
+# waited in the parse stage on top of its parse)
+PHASES = ['dns', 'connect', 'tls', 'ttfb', 'transfer', 'fetch', 'parse', 'admission', 'enqueue', 'parse_queue']
+
+
+class latencyHistogram:
+  def __init__(self, sig_bits=LATENCY_SIG_BITS):
+    self.sig_bits = sig_bits
+    self.counts = {}
+    self.n = 0
+    self.total = 0.0
+    self.max = 0.0
+
+
+  # bucket index of a value in microseconds
+  def _index(self, us):
+    s = self.sig_bits
+    if us < (1 << s):
+      return us
+    e = us.bit_length() - s
+    return (1 << s) + (e - 1)*(1 << (s - 1)) + ((us >> e) - (1 << (s - 1)))
+
+
+  # lowest value (us) of a bucket
+  def _lowest(self, idx):
+    s = self.sig_bits
+    if idx < (1 << s):
+      return idx
+    e = (idx - (1 << s)) // (1 << (s - 1)) + 1
+    m = (idx - (1 << s)) % (1 << (s - 1)) + (1 << (s - 1))
+    return m << e
+
+
+  def record(self, secs):
+    us = int(max(0.0, secs)*1e6)
+    idx = self._index(us)
+    self.counts[idx] = self.counts.get(idx, 0) + 1
+    self.n += 1
+    self.total += secs
+    self.max = max(self.max, secs)
+
+
+  def merge(self, other):
+    if other.sig_bits != self.sig_bits:
+      raise ValueError('cannot merge histograms of different precision')
+    for idx, n in other.counts.iteritems():
+      self.counts[idx] = self.counts.get(idx, 0) + n
+    self.n += other.n
+    self.total += other.total
+    self.max = max(self.max, other.max)
+    return self
+
+
+  # value at percentile p in [0,100], in secs (bucket midpoint)
+  def percentile(self, p):
+    if self.n == 0:
+      return 0.0
+    target = max(1, int(round(p/100.0*self.n)))
+    seen = 0
+    for idx in sorted(self.counts):
+      seen += self.counts[idx]
+      if seen >= target:
+        lo = self._lowest(idx)
+        hi = self._lowest(idx + 1)
+        return min(self.max, (lo + hi)/2.0/1e6)
+    return self.max
+
+
+  def mean(self):
+    return self.total/self.n if self.n > 0 else 0.0
+
+
+  def to_dict(self):
+    return {'sig_bits': self.sig_bits, 'n': self.n, 'total': self.total, 'max': self.max, 'counts': self.counts}
+
+
+def histogram_from_dict(d):
+  h = latencyHistogram(d['sig_bits'])
+  h.counts = dict([(int(k), v) for k, v in d['counts'].iteritems()])
+  h.n = d['n']
+  h.total = d['total']
+  h.max = d['max']
+  return h
+
+
+class latencyRecorder:
+  def __init__(self):
+    self.lock = threading.Lock()
+
+    # { phase: latencyHistogram }
+    self.phases = dict([(p, latencyHistogram()) for p in PHASES])
+
+    # { host_addr: { phase: latencyHistogram } }
+    self.hosts = {}
+
+
+  # record a dict of {phase: secs} for a single fetch of host_addr
+  def record(self, host_addr, phase_times):
+    with self.lock:
+      hh = self.hosts.get(host_addr)
+      if hh is None:
+        hh = self.hosts[host_addr] = {}
+      for phase, secs in phase_times.iteritems():
+        self.phases[phase].record(secs)
+        if phase not in hh:
+          hh[phase] = latencyHistogram()
+        hh[phase].record(secs)
+
+
+  def to_dict(self):
+    with self.lock:
+      return {
+        'phases': dict([(p, h.to_dict()) for p, h in self.phases.iteritems()]),
+        'hosts': dict([(str(a), dict([(p, h.to_dict()) for p, h in hh.iteritems()])) for a, hh in self.hosts.iteritems()])}
+
+
+  # dump mergeable histograms as json, plus a readable summary alongside
+  def dump(self, fpath=LATENCY_DUMP):
+    d = self.to_dict()
+    with open(fpath + '.tmp', 'w') as f:
+      json.dump(d, f)
+    os.rename(fpath + '.tmp', fpath)
+    with open(fpath + '.txt', 'w') as f:
+      f.write('\n'.join(summarize(d)) + '\n')
+
+
+def load_dump(fpath):
+  with open(fpath, 'r') as f:
+    d = json.load(f)
+  phases = dict([(p, histogram_from_dict(h)) for p, h in d['phases'].iteritems()])
+  hosts = dict([(a, dict([(p, histogram_from_dict(h)) for p, h in hh.iteritems()])) for a, hh in d['hosts'].iteritems()])
+  return phases, hosts
+
+
+# merge several dumps (e.g. from all nodes) into one (phases, hosts) pair
+def merge_dumps(fpaths):
+  phases = {}
+  hosts = {}
+  for fpath in fpaths:
+    p_in, h_in = load_dump(fpath)
+    for p, h in p_in.iteritems():
+      phases[p] = phases[p].merge(h) if p in phases else h
+    for a, hh in h_in.iteritems():
+      dest = hosts.setdefault(a, {})
+      for p, h in hh.iteritems():
+        dest[p] = dest[p].merge(h) if p in dest else h
+  return phases, hosts
+
+
+def _summary_line(name, h):
+  return '%-24s n=%-8s mean=%8.4f p50=%8.4f p90=%8.4f p99=%8.4f max=%8.4f' % (name, h.n, h.mean(), h.percentile(50), h.percentile(90), h.percentile(99), h.max)
+
+
+# readable summary lines: global phases, then the slowest hosts by mean fetch time
+def summarize(d, n_hosts=20):
+  if isinstance(d, dict):
+    phases = dict([(p, histogram_from_dict(h)) for p, h in d['phases'].iteritems()])
+    hosts = dict([(a, dict([(p, histogram_from_dict(h)) for p, h in hh.iteritems()])) for a, hh in d['hosts'].iteritems()])
+  else:
+    phases, hosts = d
+  lines = ['--> ALL HOSTS (secs)']
+  lines += [_summary_line(p, phases[p]) for p in PHASES if p in phases]
+  slow = sorted([(-hh['fetch'].mean(), a) for a, hh in hosts.iteritems() if 'fetch' in hh])[:n_hosts]
+  lines.append('--> SLOWEST %s HOSTS BY MEAN FETCH (secs)' % (len(slow),))
+  for m, a in slow:
+    lines += [_summary_line('%s %s' % (a, p), hosts[a][p]) for p in PHASES if p in hosts[a]]
+  return lines
+
+
+#
+# --> Command line functionality
+#
+if __name__ == '__main__':
+  if len(sys.argv) >= 3 and sys.argv[1] == 'summarize':
+    print '\n'.join(summarize(merge_dumps(sys.argv[2:])))
+  else:
+    print 'Usage: python latencyStats.py ...'
+    print '(1) summarize <dump_file> [<dump_file> ...]'
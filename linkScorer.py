@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+import json
+import time
+import numpy as np
+from util import *
+from node_globals import *
+from node_locals import *
+
+
+# crawl-side relevance model for focused crawling, i.e. the simpler, less frequently updated
+# crawl node layer of the 'dual layer perceptron' in todo.py
+#
+# Primary external routines:
+#
+# - For the analysis node (every LINK_MODEL_EXPORT_EVERY feedbacks):
+#   *  export_link_model(handle, classifier) --> version
+#
+# - For the crawl node main loop (every activity check):
+#   *  refresh(handle) --> True if a newer exported model was loaded
+#
+# - For the url frontier / crawl threads:
+#   *  score(ref_page_stats) --> priority of an extracted link
+#   *  page_score(title_tokens, body_tokens) --> estimated relevance of a fetched page
+#
+# The model is the analysis classifier's weights for the token fields, keyed by token:
+# { namespace: { token: weight } }.  A link is scored on the tokens it carries in its url_pkg
+# (its parent's title & its own link text), which the classifier later sees as the child
+# page's parent_title & parent_link fields; a fetched page on its title & body tokens.  Each
+# token counts 1/sqrt(n tokens), as in the classifier's unit-normalized doc vectors.  Until a
+# model is loaded every score is 0, so the frontier stays in FIFO order.
+
+
+class linkScorer:
+  def __init__(self, Q_logs=None):
+    self.Q_logs = Q_logs
+    self.version = 0
+    self.model = {}
+
+
+  def _score(self, fields):
+    n = 0
+    s = 0.0
+    for ns, toks in fields:
+      w = self.model.get(ns)
+      if toks is None:
+        continue
+      n += len(toks)
+      if w is not None:
+        for t in toks:
+          s += w.get(t, 0.0)
+    return s/np.sqrt(n) if n > 0 else 0.0
+
+
+  # ref_page_stats = (page_text_len, num_links, title_tokens, link_title_tokens), or None
+  def score(self, ref_page_stats):
+    if ref_page_stats is None or self.version == 0:
+      return 0.0
+    return self._score((('parent_title', ref_page_stats[2]), ('parent_link', ref_page_stats[3])))
+
+
+  def page_score(self, title_tokens, body_tokens):
+    if self.version == 0:
+      return 0.0
+    return self._score((('title', title_tokens), ('body', body_tokens)))
+
+
+  # load the exported model if newer than the one in use; the model is swapped in whole, so
+  # scoring threads need no lock
+  def refresh(self, handle):
+    row = pop_row(handle, DB_LINK_MODEL_TABLE, False, LINK_MODEL_ROW_ID, False)
+    if row is None or int(row[1]) <= self.version:
+      return False
+    try:
+      model = json.loads(row[2])
+    except ValueError:
+      if self.Q_logs is not None:
+        self.Q_logs.put('LINK MODEL v%s could not be read' % (row[1],))
+      return False
+    self.model = dict([(str(ns), dict([(str(t), w) for t, w in d.iteritems()])) for ns, d in model.iteritems()])
+    self.version = int(row[1])
+    if self.Q_logs is not None:
+      self.Q_logs.put('LINK MODEL v%s loaded (%s tokens)' % (self.version, sum([len(d) for d in self.model.itervalues()])))
+    return True
+
+
+# write the classifier's token weights to the link model table for the crawl nodes
+def export_link_model(handle, classifier):
+  version = int(time.time())
+  model = classifier.link_model(LINK_MODEL_MAX_TOKENS)
+  replace_row(handle, DB_LINK_MODEL_TABLE, LINK_MODEL_ROW_ID, {'version': version, 'model': json.dumps(model, separators=(',', ':'))})
+  return version
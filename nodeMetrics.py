@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+import threading
+import BaseHTTPServer
+from node_globals import *
+
+
+# live counters & gauges for a crawl node, served in Prometheus text format
+#
+# Primary external routines:
+#
+# - For any thread:
+#   *  inc(name, v, **labels), dec(...), set(name, v, **labels), value(name, **labels)
+#
+# - For node startup:
+#   *  counter(name, help, fn=None), gauge(name, help, fn=None), add_collector(fn)
+#   *  start_metrics_server(registry, port)
+#
+# All values are kept up to date incrementally by the code doing the work; metrics given
+# an fn (e.g. Queue.qsize) are read at scrape time, so fn must be O(1).
+
+
+class metricsRegistry:
+  def __init__(self):
+    self.lock = threading.Lock()
+
+    # { name: (type, help) }, in registration order
+    self.meta = {}
+    self.names = []
+
+    # { name: { labels_tuple: value } }
+    self.values = {}
+
+    # { name: fn } for gauges read at scrape time
+    self.fns = {}
+
+    # extra fns returning lists of ready-made exposition lines
+    self.collectors = []
+
+
+  def _register(self, name, mtype, help_text):
+    if name not in self.meta:
+      self.names.append(name)
+      self.values[name] = {}
+    self.meta[name] = (mtype, help_text)
+
+
+  def counter(self, name, help_text, fn=None):
+    self._register(name, 'counter', help_text)
+    if fn is not None:
+      self.fns[name] = fn
+
+
+  def gauge(self, name, help_text, fn=None):
+    self._register(name, 'gauge', help_text)
+    if fn is not None:
+      self.fns[name] = fn
+
+
+  def add_collector(self, fn):
+    self.collectors.append(fn)
+
+
+  def inc(self, name, v=1, **labels):
+    key = tuple(sorted(labels.items()))
+    with self.lock:
+      d = self.values[name]
+      d[key] = d.get(key, 0) + v
+
+
+  def dec(self, name, v=1, **labels):
+    self.inc(name, -v, **labels)
+
+
+  def set(self, name, v, **labels):
+    key = tuple(sorted(labels.items()))
+    with self.lock:
+      self.values[name][key] = v
+
+
+  def value(self, name, **labels):
+    if name in self.fns:
+      return self.fns[name]()
+    return self.values[name].get(tuple(sorted(labels.items())), 0)
+
+
+  # render all metrics in Prometheus text exposition format
+  def render(self):
+    lines = []
+    with self.lock:
+      values = dict([(n, dict(d)) for n, d in self.values.iteritems()])
+    for name in self.names:
+      mtype, help_text = self.meta[name]
+      lines.append('# HELP %s %s' % (name, help_text))
+      lines.append('# TYPE %s %s' % (name, mtype))
+      if name in self.fns:
+        lines.append('%s %s' % (name, self.fns[name]()))
+        continue
+      for key, v in sorted(values[name].iteritems()):
+        lines.append('%s%s %s' % (name, format_labels(key), v))
+    for fn in self.collectors:
+      lines += fn()
+    return '\n'.join(lines) + '\n'
+
+
+def format_labels(key):
+  if len(key) == 0:
+    return ''
+  return '{' + ','.join(['%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in key]) + '}'
+
+
+# http server thread serving GET /metrics
+class MetricsServer(threading.Thread):
+  def __init__(self, registry, port=METRICS_PORT):
+    threading.Thread.__init__(self)
+    self.registry = registry
+    self.port = port
+
+  def run(self):
+    registry = self.registry
+
+    class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+      def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+          self.send_response(404)
+          self.end_headers()
+          return
+        body = registry.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, *args):
+        pass
+
+    BaseHTTPServer.HTTPServer(('', self.port), MetricsHandler).serve_forever()
+
+
+def start_metrics_server(registry, port=METRICS_PORT):
+  t = MetricsServer(registry, port)
+  t.setDaemon(True)
+  t.start()
+  return t
@@ -14,6 +14,7 @@ RESTART_DUMP = 'restart_seed_list'
 SAFE_PATH_RGX = r'(\.((x|p|r|s)?htm?l?|php\d?|aspx?|cfml?|pdf|docx?|rtf|txt)|^/?[^\.]*)/?(;|\?|#|$)'
 DOC_PATH_RGX = r'\.(pdf|docx?|rtf|txt)/?$'
 BLOCK_URL_RGX = r'(law|print|www)\.onecle\.com'
+LINK_CACHE_SIZE = 256  # per-page LRU of resolved hrefs
 
 
 # CONNECTION / pycurl
@@ -21,7 +22,7 @@ CURLOPT_TIMEOUT = 60
 
 
 # THREADS / NODES
-NUMBER_OF_CTHREADS = 2
+NUMBER_OF_CTHREADS = 2  # initial number, see AUTO_SCALE
 NUMBER_OF_MTHREADS = 1
 NUMBER_OF_NODES = 5
 NODE_ADDRESSES = ['54.225.229.185', '54.225.201.124', '54.225.201.136', '50.16.244.90', '107.22.248.122']
@@ -46,6 +47,23 @@ ACTIVITY_CHECK_P = 60
 # PAYLOAD DB
 DB_PAYLOAD_TABLE = 'payload_table'
 DB_POSITIVES_TABLE = 'positives_table'
+# payload & batch test rows end with the crawl-time feature record (pageAnalyze.feature_record):
+#   ALTER TABLE payload_table ADD COLUMN features text;  (same for batch_test)
+# payload rows are read by column name (the table also has e.g. a node column), features last
+PAYLOAD_COLS = 'id, url, parent_stats, html, parent_url, features'
+
+
+# FOCUSED CRAWLING: crawl-side link scoring w/ token weights exported by the analysis node
+#   CREATE TABLE link_model (id INT PRIMARY KEY, version INT, model MEDIUMTEXT);
+DB_LINK_MODEL_TABLE = 'link_model'
+LINK_MODEL_ROW_ID = 1
+LINK_MODEL_EXPORT_EVERY = 20  # feedbacks between exports
+LINK_MODEL_MAX_TOKENS = 5000  # per field, largest |weight| first
+LINK_MODEL_RELEVANT_THRESH = 0.0  # fetched pages scoring above this count towards the harvest rate
+
+
+# NODE METRICS ENDPOINT (prometheus text format at http://<node>:METRICS_PORT/metrics)
+METRICS_PORT = 9108
 
 
 # LOGGING MODULE
@@ -53,12 +71,94 @@ LOG_REL_PATH = 'logs/log'
 DEBUG_MODE = False
 
 
+# FETCH PHASE LATENCY HISTOGRAMS
+LATENCY_SIG_BITS = 7  # sub-bucket bits per power of 2, i.e. ~1.6% relative error
+LATENCY_DUMP = 'latency_dump.json'  # also dumped on SIGUSR1
+
+
+# PARSE STAGE (process pool between crawl threads & frontier admission)
+PARSE_WORKERS = 2  # parse processes; 0 to parse on the crawl threads themselves
+PARSE_QUEUE_MAX = 64  # pages fetched but not yet admitted before crawl threads block
+PARSE_ADMIT_THREADS = 2
+PARSE_TIMEOUT = 120  # pages not back from the pool after this many secs (e.g. their worker died) are admitted as failed parses
+PARSE_MAX_TASKS_PER_CHILD = None  # parse workers are never recycled: replacements would be forked from the (by then threaded) crawl process
+
+# bounded parse mode: pages are cut to these before parsing (see pageAnalyze.scan_page) &
+# logged as PARSE CAPPED; None for no limit
+PARSE_MAX_BYTES = 4000000
+PARSE_MAX_TAGS = 100000
+
+
+# SAMPLED CRAWL STAGE TRACING (summarize w/ `python crawlTrace.py summarize <file>`)
+TRACE_SAMPLE_RATE = 0.01  # fraction of page crawls traced; 0 for off
+TRACE_FILE = 'logs/crawl.trace'
+
+
 # DNS CACHE
 DNS_REFRESH_TIME = 21600  # Refresh DNS every 6 hours
 
 
+# BULK SEED LOADING (seedLoader; `python crawlNode.py seed <file> ...` & restart)
+SEED_BATCH_SIZE = 10000  # seed lines canonicalized, deduped & resolved per batch
+SEED_DNS_WORKERS = 32  # parallel DNS lookups of a batch's new hosts
+SEED_BF_CAPACITY = 10000000
+SEED_BF_ERROR_RATE = 0.000001  # in-memory dedupe filter; this fraction of seeds may be dropped
+
+
 # POLITENESS
 BASE_PULL_DELAY = 60  # Base time constant to wait for pulling from domain = 60 secs
+POLITENESS_KEY = 'ip'  # what an hq (one pull at a time, on its own delay) is kept per: 'ip', 'host' or 'domain'
+IP_MAX_CONNECTIONS = 4  # concurrent fetches per IP address, across hqs (w/ POLITENESS_KEY 'host' / 'domain')
+PUBLIC_SUFFIX_FILE = 'public_suffix_list.dat'  # for 'domain'; `python publicSuffix.py fetch`
+PUBLIC_SUFFIX_URL = 'https://publicsuffix.org/list/public_suffix_list.dat'
+
+# ADAPTIVE (AIMD) PER-HOST RATE CONTROL
+RATE_INITIAL_DELAY = BASE_PULL_DELAY  # delay for a host with no stats yet
+RATE_MIN_DELAY = 2
+RATE_MAX_DELAY = 600
+RATE_HOST_BOUNDS = {}  # per-host overrides { host_addr: (min_delay, max_delay) }
+RATE_AI_STEP = 0.02  # additive increase of pull rate per clean pull, in pulls/sec
+RATE_MD_FACTOR = 0.5  # multiplicative decrease of pull rate on error / 429 / 503 / slow pull
+RATE_SLOW_FACTOR = 3.0  # latency > this x smoothed latency counts as a slow pull
+RATE_LATENCY_MULTI = 10  # delay is never less than this x smoothed latency
+RATE_EWMA_ALPHA = 0.2
+RATE_JITTER = 0.1  # +/- fraction of random jitter on each delay
+RATE_MAX_RETRY_AFTER = 3600
+RATE_STATS_FILE = 'host_rates.stats'
+
+
+# FAILED PULL RETRIES / DEAD HOST PARKING
+RETRY_CURL_ERRORS = (5, 6, 7, 16, 18, 28, 35, 52, 55, 56)  # transient curl errors (timeouts, refused, resets...)
+RETRY_HTTP_CODES = (408, 429, 500, 502, 503, 504)  # transient http codes
+RETRY_MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 120  # first retry after ~this many secs, doubling each further attempt
+RETRY_MAX_DELAY = 3600
+RETRY_CHECK_P = 5  # how often maintenance threads release due retries, in secs
+DEAD_HOST_FAILS = 5  # consecutive connection errors / 5xx before a host is parked
+PARK_PROBE_DELAY = 600  # first probe of a parked host after this many secs, doubling
+PARK_MAX_PROBE_DELAY = 21600
+
+
+# ROBOTS.TXT POLICY
+ROBOTS_AGENT_NAME = 'rlcrawler'  # robots.txt groups naming this agent override '*' groups
+ROBOTS_TTL = 86400  # re-fetch robots.txt once a day
+ROBOTS_ERROR_TTL = 3600  # hosts w/ 5xx / unreachable robots.txt are fully disallowed this long
+ROBOTS_TIMEOUT = 15
+ROBOTS_FETCH_THREADS = 16  # threads fetching robots.txt of new hosts, while their urls are held
+ROBOTS_MAX_BYTES = 500000
+ROBOTS_MAX_CRAWL_DELAY = 300  # cap on honoured Crawl-delay, in secs
+ROBOTS_CACHE_FILE = 'robots.cache'
+
+
+# CRAWL BUDGETS / SPIDER TRAPS (crawlBudget), on extracted urls admitted at a node
+BUDGET_HOST_MAX_URLS = 50000  # per hq (politeness) key
+BUDGET_PREFIX_DEPTH = 2  # directories making up a path prefix, e.g. /calendar/2013
+BUDGET_PREFIX_MAX_URLS = 5000  # per host & path prefix
+BUDGET_PARAM_MAX_VALUES = 500  # distinct values per host, path & query parameter
+BUDGET_MAX_DEPTH = 15  # path segments
+BUDGET_MAX_SEGMENT_REPEATS = 2  # occurrences of any one path segment
+BUDGET_STATS_FILE = 'crawl_budget.stats'
+BUDGET_REPORT_FILE = 'trap_report.txt'  # written on shutdown / restart dump, completion & SIGUSR1
 
 
 # SEEN (BLOOM) FILTER
@@ -71,6 +171,17 @@ BF_FILENAME = 'seen.bloom'
 HQ_TO_THREAD_RATIO = 3
 MAX_QUEUE_SIZE = 10000
 
+# CRAWL NODE AUTO-SCALING (crawlScaler): crawl threads & active hqs are resized from their
+# initial NUMBER_OF_CTHREADS & HQ_TO_THREAD_RATIO*NUMBER_OF_CTHREADS
+AUTO_SCALE = True
+SCALE_CHECK_P = 10  # secs between resize decisions
+SCALE_MIN_CTHREADS = 1
+SCALE_MAX_CTHREADS = 64
+SCALE_MIN_HQS = 6
+SCALE_MAX_HQS = 20000
+SCALE_HEADROOM = 1.25  # crawl threads kept per thread busy fetching or needed by a ready host
+SCALE_MAX_CPU = 0.9  # crawl process cpu use (in cores) above which threads are not added
+
 
 # CRAWL NODE Q FLOW
 OVERFLOW_TRY_MAX = 10
@@ -82,8 +193,23 @@ OVERFLOW_MULTI_TRY_L = 1
 # ANALYSIS NODE INTERFACE & BATCH TESTING SCRIPT
 DB_BATCH_TEST_TABLE = 'batch_test'
 FILL_BATCH_TEST = False
+BATCH_FETCH_SIZE = 500  # rows per server-side cursor fetch (util.stream_rows)
+WEIGHT_LOG_CHUNK = 65536  # weight changes buffered per chunk of a batch test's .wlog
+FEATURE_WORKERS = 4  # processes extracting batch test pages' feature records; 0 for serial
+FEATURE_CACHE_FILE = 'feature_cache.sqlite'  # batch test feature records by html hash & extractor version
+SWEEP_WORKERS = 4  # processes replaying configurations in a batchTest sweep
+SWEEP_PR_POINTS = 50  # points per precision / recall curve
+FEEDBACK_TICKET_TTL = 3600  # secs before an unanswered review ticket lapses & its doc is re-served
+REVIEW_BUFFER_SIZE = 32  # payload rows kept featurized & scored ahead of reviewers
+REVIEW_BUFFER_POLL = 1  # secs between payload table polls while no new rows
 
 
 # BINARY RELEVANCE CLASSIFIER
 AGGRESSIVE_PARAM = 1
 FEEDBACK_THRESH = True
+FEEDBACK_SKIP_MARGIN = 0.5  # w/ FEEDBACK_THRESH, no label is requested for docs w/ |score| above this
+CLF_SPARSE = True  # hashed sparse feature space (classifier.SparseOLClassifier) vs dense OLClassifier
+CLF_HASH_BITS = 20
+CLF_VOCAB_MAX = 50000  # tokens kept exactly, for readable weights only
+CLF_SNAPSHOT_FILE = 'classifier.clf'  # analysis node warm starts from & saves to this
+CLF_SNAPSHOT_EVERY = 20  # feedbacks between snapshots
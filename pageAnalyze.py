@@ -5,9 +5,10 @@ import re
 import MySQLdb as mdb
 import pycurl
 import cStringIO
-from collections import Counter
+from collections import Counter, OrderedDict
 from util import *
 import urlparse
+import json
 from node_globals import *
 from node_locals import *
 import numpy as np
@@ -31,12 +32,17 @@ def tokens(string):
 STOP_TOKENS = ["this", "that", "shall", "under", "with", "other", "within", "from", "such", "which", "means", "each", "have", "including", "upon", "after", "these", "been", "include", "otherwise", "against", "least", "through", "than", "unless", "does", "either", "whether", "without", "only", "between", "described", "percent", "their", "then", "those", "when", "except", "into", "during", "iii", "where", "would", "they", "itself", "last", "there", "also", "below", "here", "includes", "more", "neither", "being", "both", "cannot", "about", "above", "were", "first", "second", "third", "fourth", "fifth", "sixth", "seventh", "eigth", "ninth", "tenth", "three", "four", "five", "seven", "eight", "nine"]
 
 
-# return most frequent non-stop/small words as list
-def mf_words(pg_txt, n=None):
+# return most frequent non-stop/small words w/ counts as list of (word, count)
+def top_tokens(pg_txt, n=None):
   c = Counter([t.lower() for t in tokens(pg_txt) if len(t) > 3])
   for sw in STOP_TOKENS:
     del c[sw]
-  return [w[0] for w in c.most_common(n)]
+  return c.most_common(n)
+
+
+# return most frequent non-stop/small words as list
+def mf_words(pg_txt, n=None):
+  return [w[0] for w in top_tokens(pg_txt, n)]
 
 
 # basic cleaning fn for incoming html string
@@ -45,6 +51,7 @@ def basic_html_clean(html_string):
 
 
 # extracted link resolution
+# NOTE: superseded by linkResolver below; kept for comparison in benchmark.py
 def resolve_extracted_link(link, ref_url, Q_logs, base_url=None):
 
   # following RFC 1808 <scheme>://<net_loc>/<path>;<params>?<query>#<fragment>
@@ -119,6 +126,121 @@ def resolve_extracted_link(link, ref_url, Q_logs, base_url=None):
       Q_logs.put("LINK PARSE EXCEPTION: %s" % (link,))
 
 
+# RFC 3986 appendix B split, with a strict scheme so that e.g. 'a b:c' stays a relative path
+URI_RGX = re.compile(r'(?:([A-Za-z][A-Za-z0-9+.\-]*):)?(?://([^/?#]*))?([^?#]*)(?:\?([^#]*))?', re.DOTALL)
+CRAWL_SCHEMES = frozenset(['http', 'https'])
+
+
+# RFC 3986 5.2.4
+def remove_dot_segments(path):
+  if '.' not in path:
+    return path
+  absolute = path.startswith('/')
+  segs = path.split('/')
+  if absolute:
+    segs = segs[1:]
+  out = []
+  for s in segs:
+    if s == '..':
+      if len(out) > 0:
+        out.pop()
+    elif s != '.':
+      out.append(s)
+  if segs[-1] in ('.', '..'):
+    out.append('')
+  return ('/' if absolute else '') + '/'.join(out)
+
+
+# lower-case the host part of an authority, leaving any userinfo alone
+def _norm_authority(authority):
+  at = authority.rfind('@')
+  return authority[:at+1] + authority[at+1:].lower()
+
+
+# canonical form of a listed (e.g. seed) url, as linkResolver would give it; urls w/o a scheme
+# are taken as http --> url, or None if not http(s) or w/o a host
+def canonical_url(url):
+  url = url.strip()
+  if '://' not in url and re.match(r'[A-Za-z][A-Za-z0-9+.\-]*:[^\d]', url) is None:
+    url = 'http://' + url
+  scheme, authority, path, query = URI_RGX.match(url).groups()
+  if scheme is None or scheme.lower() not in CRAWL_SCHEMES or not authority:
+    return None
+  return scheme.lower() + '://' + _norm_authority(authority) + (remove_dot_segments(path) or '/') + ('?' + query if query is not None else '')
+
+
+# per-page link resolver
+#
+# Built once per page (ref_url & optional <base href>), then resolve(href) --> absolute url
+# without fragment, or None for non-http(s) schemes (mailto:, javascript:, ...) or when the
+# page url is not absolute.  Resolution follows RFC 3986 5.2 (non-strict: 'http:g' on an
+# http page is relative), and recent results are kept in a small per-page LRU since nav
+# links repeat a lot.
+class linkResolver:
+  def __init__(self, ref_url, base_url=None, Q_logs=None, cache_size=LINK_CACHE_SIZE):
+    self.cache = OrderedDict()
+    self.cache_size = cache_size
+    self.base = None
+    scheme, authority, path, query = URI_RGX.match(ref_url.strip()).groups()
+    if scheme is None or authority is None:
+      if Q_logs is not None:
+        Q_logs.put("LINK PARSE ERROR: INCOMPLETE ref url %s" % (ref_url,))
+      return
+    self.base = (scheme.lower(), _norm_authority(authority), remove_dot_segments(path) or '/', query)
+
+    # a <base href> may itself be relative to the page url
+    if base_url is not None:
+      base = self._resolve(base_url)
+      if base is not None:
+        self.base = base
+
+
+  # primary routine
+  def resolve(self, href):
+    cache = self.cache
+    if href in cache:
+      url = cache.pop(href)
+    else:
+      url = self._resolve(href)
+      if len(cache) >= self.cache_size:
+        cache.popitem(False)
+      if url is not None:
+        url = url[0] + '://' + url[1] + url[2] + ('?' + url[3] if url[3] is not None else '')
+    cache[href] = url
+    return url
+
+
+  # resolve href to (scheme, authority, path, query), or None
+  def _resolve(self, href):
+    if self.base is None:
+      return None
+    b_scheme, b_authority, b_path, b_query = self.base
+
+    # browsers drop surrounding whitespace & embedded tabs / newlines
+    href = href.strip()
+    if '\n' in href or '\t' in href or '\r' in href:
+      href = href.translate(None, '\t\n\r')
+    scheme, authority, path, query = URI_RGX.match(href).groups()
+
+    if scheme is not None:
+      scheme = scheme.lower()
+      if scheme not in CRAWL_SCHEMES:
+        return None
+      if scheme == b_scheme and authority is None:
+        scheme = None
+    if scheme is not None or authority is not None:
+      if authority is None:
+        return None
+      return (scheme or b_scheme, _norm_authority(authority), remove_dot_segments(path) or '/', query)
+
+    # same authority: empty path keeps base path (& query unless one given)
+    if path == '':
+      return (b_scheme, b_authority, b_path, query if query is not None else b_query)
+    if path[0] != '/':
+      path = b_path[:b_path.rfind('/')+1] + path
+    return (b_scheme, b_authority, remove_dot_segments(path), query)
+
+
 # link extractor subfunction
 def extract_link_data(html, ref_url, Q_logs=None):
   urls = []
@@ -132,17 +254,16 @@ def extract_link_data(html, ref_url, Q_logs=None):
     base_url = None
   
   # look for all a tags
+  resolver = linkResolver(ref_url, base_url, Q_logs)
   link_tags = re.findall(r'<a(?:\s[^>]+)?>.*?</a>', html)
   for link_tag in link_tags:
     link = re.search(r'<a [^>]*href="([^"]+)"[^>]*>(.*?)</a>', link_tag)
     if link is not None:
 
-      # try to resolve link
-      link_url = resolve_extracted_link(link.group(1), ref_url, Q_logs, base_url)
+      # try to resolve link (fragment ('#...') data discarded)
+      link_url = resolver.resolve(link.group(1))
       if link_url is not None:
-
-        # discard fragment ('#...') data here
-        urls.append(re.sub(r'#.*$', '', link_url))
+        urls.append(link_url)
 
         # url data: (link_text_tokens)
         url_data.append((mf_words(link.group(2)),))
@@ -222,7 +343,300 @@ def extract_passed_stats(html, Q_logs=None):
   ptl = float(len(pt))
   nl = float(len(re.findall(r'<a\s.*?>', html)))
   return (ptl, nl, tt)
-  
+
+
+# single-pass page scanner
+#
+# USED IN: CRAWL NODE
+#
+# scan_page walks the '<' positions of a page once, feeding each to emulations of the regexes
+# in basic_html_clean, extract_link_data, extract_passed_stats, get_page_text & calc_LTS, so
+# that its results are identical to theirs.  Forward searches (for '>', '\n', '</a>', ...)
+# are cached per needle, so the walk stays linear even on pages where the lazy regexes above
+# rescan to the end of the document from every tag.
+#
+# Bounded mode: given max_bytes / max_tags, a page is cut to its first max_bytes bytes and to
+# before its (max_tags+1)th '<' before scanning, so the work per page is capped; the results
+# are then those of the functions above on the cut page, and scan.capped names the limit hit.
+HIGH_BYTES = ''.join([chr(i) for i in range(0x7f, 0x100)])
+WS_CHARS = ' \t\n\r\f\v'
+WS_SET = frozenset(WS_CHARS)
+NON_TEXT_CHARS = WS_CHARS + '>'
+TEXT_TAGS_SET = frozenset(TEXT_TAGS)
+SKIP_TAGS_SET = frozenset(SKIP_TAGS)
+LINK_TAG_RGX = re.compile(r'<a [^>]*href="([^"]+)"[^>]*>(.*?)</a>')
+TAG_NAME_RGX = re.compile(r'<\W*(\w+)')
+ENTITY_RGX = re.compile(r'&\w{2,4};')
+BLANK_LINES_RGX = re.compile(r'\n(\s*\n)+')
+
+
+# results of scan_page
+class pageScan:
+  def __init__(self, html):
+    self.html = html
+    self.base_url = None
+    self.links = []  # [(href, anchor_text)]
+    self.title = None
+    self.text = ''
+    self.num_links = 0
+    self.lts = 0
+    self.capped = None  # 'bytes' / 'tags' if the page was cut in bounded mode
+
+  # --> same as extract_link_data(html, ref_url, Q_logs)
+  def link_data(self, ref_url, Q_logs=None):
+    urls = []
+    url_data = []
+    resolver = linkResolver(ref_url, self.base_url, Q_logs)
+    for href, anchor_text in self.links:
+      link_url = resolver.resolve(href)
+      if link_url is not None:
+        urls.append(link_url)
+        url_data.append((mf_words(anchor_text),))
+    return urls, url_data
+
+  # --> same as extract_passed_stats(html)
+  def passed_stats(self):
+    tt = mf_words(self.title) if self.title is not None else []
+    return (float(len(self.text)), float(self.num_links), tt)
+
+  # --> feature record for the payload, see feature_record()
+  def feature_record(self):
+    ptl, nl, tt = self.passed_stats()
+    return feature_record(ptl, nl, tt, top_tokens(self.text, MF_TOKENS_N), self.lts)
+
+
+# value of r'<base[^>]+href="(.*?)"' for a '<base' at p --> (value or None, tag end)
+# NOTE: if this fails, so does every later '<base' before the same tag end, as its candidate
+# 'href="'s are a subset of these; scan_page skips those, keeping runs of '<base's linear
+def _scan_base(html, p):
+  gt = html.find('>', p+5)
+  if gt == -1:
+    gt = len(html)
+
+  # [^>]+ is greedy, so try the last 'href="' before the tag end first
+  k = html.rfind('href="', p+6, gt)
+  while k != -1:
+    q = html.find('"', k+6)
+    if q != -1 and html.find('\n', k+6, q) == -1:
+      return html[k+6:q], gt
+    k = html.rfind('href="', p+6, k)
+  return None, gt
+
+
+# r'<.*?>' --> '' over the text left after removing a/script/style blocks
+def _strip_tags(r1):
+  pieces = []
+  i = 0
+  gt = nl = -2
+  p = r1.find('<')
+  while p != -1:
+    if gt < p:
+      gt = r1.find('>', p+1)
+      if gt == -1:
+        break
+    if nl < p:
+      nl = r1.find('\n', p)
+      if nl == -1:
+        nl = len(r1)
+    if gt < nl:
+      pieces.append(r1[i:p])
+      i = gt + 1
+      p = r1.find('<', i)
+    else:
+      p = r1.find('<', p+1)
+  pieces.append(r1[i:])
+  return ''.join(pieces)
+
+
+# position of the (n+1)th '<' in html, or None if there are no more than n
+def _tag_cut(html, n):
+  if html.count('<') <= n:
+    return None
+  p = -1
+  for i in range(n+1):
+    p = html.find('<', p+1)
+  return p
+
+
+def scan_page(html_string, Q_logs=None, max_bytes=None, max_tags=None):
+  html = html_string.translate(None, HIGH_BYTES)
+  capped = None
+  if max_bytes is not None and len(html) > max_bytes:
+    html = html[:max_bytes]
+    capped = 'bytes'
+  if max_tags is not None:
+    cut = _tag_cut(html, max_tags)
+    if cut is not None:
+      html = html[:cut]
+      capped = 'tags'
+  scan = pageScan(html)
+  scan.capped = capped
+  find = html.find
+  startswith = html.startswith
+
+  # forward search cache { needle: (searched_from, pos) }; a hit is valid for any start in
+  # [searched_from, pos], and pos == -1 means no match anywhere past searched_from
+  cache = {}
+  def find_from(needle, x):
+    c = cache.get(needle)
+    if c is not None and c[0] <= x and (c[1] >= x or c[1] == -1):
+      return c[1]
+    pos = find(needle, x)
+    cache[needle] = (x, pos)
+    return pos
+
+  # true if no newline in html[a:b]
+  def one_line(a, b):
+    nl = find_from('\n', a)
+    return nl == -1 or nl >= b
+
+  # every '>' search below starts inside the tag name, so all resolve to the first '>' after p
+  gt = -2
+
+  # resume points of each emulated findall / sub (a match consumes the '<'s inside it)
+  link_next = 0
+  nl_next = 0
+  s1_next = 0
+  lts_next = 0
+  kept = []
+  base_done = False
+  base_fail_gt = -1
+  title_done = False
+
+  # calc_LTS state; the regex version gives up (returning lts so far) on a stack underflow
+  lvl = ['top']
+  ts = 0
+  lts = 0
+  lts_on = True
+
+  p = find('<')
+  while p != -1:
+    c1 = html[p+1:p+2]
+    if gt < p and gt != -1:
+      gt = find('>', p+1)
+
+    if c1 == 'a':
+      c2 = html[p+2:p+3]
+
+      # r'<a(?:\s[^>]+)?>.*?</a>', then the per-tag link regex
+      if p >= link_next:
+        if gt != -1 and (gt == p+2 or (c2 in WS_SET and gt >= p+4)):
+          close = find_from('</a>', gt+1)
+          if close != -1 and one_line(gt+1, close):
+            m = LINK_TAG_RGX.search(html, p, close+4)
+            if m is not None:
+              scan.links.append((m.group(1), m.group(2)))
+            link_next = close + 4
+
+      # r'<a\s.*?>' link count
+      if p >= nl_next and c2 in WS_SET:
+        if gt != -1 and one_line(p+3, gt):
+          scan.num_links += 1
+          nl_next = gt + 1
+
+    elif c1 == 'b' and not base_done and p >= base_fail_gt and startswith('<base', p):
+      scan.base_url, base_fail_gt = _scan_base(html, p)
+      base_done = scan.base_url is not None
+
+    elif c1 == 't' and not title_done and startswith('<title', p):
+      if gt != -1:
+        close = find_from('</title>', gt+1)
+        if close != -1 and one_line(gt+1, close):
+          scan.title = html[gt+1:close]
+          title_done = True
+
+    # page text: r'<(a|script|style).*?>.*?</\1>' (DOTALL) blocks dropped
+    if p >= s1_next:
+      close_tag = None
+      if c1 == 'a':
+        close_tag = '</a>'
+      elif c1 == 's':
+        if startswith('<script', p):
+          close_tag = '</script>'
+        elif startswith('<style', p):
+          close_tag = '</style>'
+      if close_tag is not None and gt != -1:
+        close = find_from(close_tag, gt+1)
+        if close != -1:
+          kept.append(html[s1_next:p])
+          s1_next = close + len(close_tag)
+
+    # lts: tokens of r'<[^>]+>|[^><]+'
+    if lts_on and p >= lts_next:
+      if p > lts_next:
+        if len(lvl) == 0:
+          lts_on = html[lts_next:p].strip('>') == ''
+        elif lvl[-1] in TEXT_TAGS_SET:
+          ts += len(html[lts_next:p].translate(None, NON_TEXT_CHARS))
+          lts = max(lts, ts)
+      if gt == -1 or gt == p+1:
+        lts_next = p + 1
+      else:
+        lts_next = gt + 1
+        if lts_on and c1 == '/':
+          if len(lvl) > 0:
+            del lvl[-1]
+          else:
+            lts_on = False
+        elif lts_on:
+          m = TAG_NAME_RGX.match(html, p, gt+1)
+          if m is None:
+            if Q_logs is not None and DEBUG_MODE:
+              Q_logs.put('HTML PARSE EXCEPTION: Error extracting tag from ' + html[p:gt+1])
+          else:
+            tag = m.group(1)
+            if tag not in SKIP_TAGS_SET:
+              lvl.append(tag)
+              if tag not in TEXT_TAGS_SET:
+                ts = 0
+
+    p = find('<', p+1)
+
+  # trailing text token
+  if lts_on and len(lvl) > 0 and lvl[-1] in TEXT_TAGS_SET:
+    ts += len(html[lts_next:].translate(None, NON_TEXT_CHARS))
+    lts = max(lts, ts)
+  scan.lts = lts
+
+  # finish page text over what is left of the page
+  kept.append(html[s1_next:])
+  text = _strip_tags(''.join(kept))
+  scan.text = BLANK_LINES_RGX.sub('\n', ENTITY_RGX.sub('', text))
+  return scan
+
+
+# crawl-time feature record, stored w/ the payload so analysis need not re-parse the html
+#
+# a compact json list: [version, page_text_len, num_links, lts, title_tokens, [[token, count], ...]]
+#
+# NOTE: bump FEATURE_RECORD_VERSION whenever anything feeding the record changes (page text,
+# title / link regexes, tokens, calc_LTS), so that stale records are re-parsed
+FEATURE_RECORD_VERSION = 1
+MF_TOKENS_N = 20
+
+def feature_record(ptl, nl, tt, top, lts):
+  return json.dumps([FEATURE_RECORD_VERSION, ptl, nl, lts, tt, top], separators=(',', ':'))
+
+
+# --> (ptl, nl, lts, title_tokens, most_frequent_tokens), or None if missing / stale / corrupt
+def read_feature_record(record):
+  if record is None:
+    return None
+  try:
+    r = json.loads(record)
+    if r[0] != FEATURE_RECORD_VERSION:
+      return None
+    version, ptl, nl, lts, tt, top = r
+    return (float(ptl), float(nl), lts, [str(t) for t in tt], [str(w) for w, c in top])
+  except (ValueError, TypeError, IndexError):
+    return None
+
+
+# feature record of a payload / batch test row, if the row has one; rows are selected w/ the
+# features column last (PAYLOAD_COLS, batchTest.HASHED_COLS)
+def row_feature_record(row):
+  return row[-1]
+
 
 # function for extracting page features & appropriately normalizing numerical ones
 #
@@ -231,6 +645,8 @@ def extract_passed_stats(html, Q_logs=None):
 # takes: 
 #   - html
 #   - parent_page_stats = (page_text_len, num_links, title_tokens, link_title_tokens)
+#   - feature_record (optional) = crawl-time record; html is only parsed if it is missing or stale,
+#     and then in bounded mode (PARSE_MAX_BYTES / PARSE_MAX_TAGS) as on the crawl node
 #
 # outputs:
 #   - page_features = (
@@ -243,20 +659,19 @@ def extract_passed_stats(html, Q_logs=None):
 #                       [t]: parent_title_tokens 
 #                     )
 
-def extract_features(html, parent_page_stats, Q_logs=None):
-  pt = get_page_text(html)
+def extract_features(html, parent_page_stats, Q_logs=None, feature_record=None):
   
-  # first calculate stats/features that depend on html only
-  try:
-    tt = mf_words(re.search(r'<title[^>]*>(.*?)</title>', html).group(1))
-  except:
-    tt = []
-  ptl = float(len(pt))
-  nl = float(len(re.findall(r'<a\s.*?>', html)))
-  mft = mf_words(pt, 20)
+  # first calculate stats/features that depend on html only, from the record if possible
+  rec = read_feature_record(feature_record)
+  if rec is None:
+    scan = scan_page(html, Q_logs, PARSE_MAX_BYTES, PARSE_MAX_TAGS)
+    if scan.capped is not None and Q_logs is not None:
+      Q_logs.put('PARSE CAPPED (%s): page of %s bytes' % (scan.capped, len(html)))
+    rec = read_feature_record(scan.feature_record())
+  ptl, nl, lts_raw, tt, mft = rec
   
   # we normalize lts assuming a rough avg of 1000 chars / page in a contract...
-  lts = sl_normalize(calc_LTS(html, Q_logs)/1000.0)
+  lts = sl_normalize(lts_raw/1000.0)
 
   # next handle those dependent on parent page data (for relative measures)
   # NOTE: assume that if this var is none, dealing with seed pages at beginning of crawl
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+import time
+import signal
+import threading
+import itertools
+import traceback
+import multiprocessing
+import Queue
+from util import Timer
+from pageAnalyze import scan_page, HIGH_BYTES
+from node_globals import *
+
+
+# process pool parse stage between crawl (fetch) threads and frontier admission
+#
+# Primary external routines:
+#
+# - For crawl threads:
+#   *  submit(body, url, ctx) --> blocks while PARSE_QUEUE_MAX pages are already in the stage
+#
+# - For admission threads:
+#   *  get_result() --> (ctx, result), then task_done() once the page is admitted
+#
+# Pages are parsed by PARSE_WORKERS processes, so parsing no longer holds the crawl process'
+# GIL; ctx stays in this process and only (html, url) crosses to the workers.  The pool must
+# be created before the node starts any threads, as the workers are forked from it.
+#
+# Every page submitted comes out of get_result exactly once: w/ the pool's result, or as a
+# failed parse if the pool has not returned it within PARSE_TIMEOUT (a worker dying takes its
+# task w/ it, & the pool never calls back for it).
+
+
+# list standing in for Q_logs inside worker processes; entries are relayed by the caller
+class logList(list):
+  def put(self, item):
+    self.append(item)
+
+
+# parse a (cleaned) page in bounded mode (PARSE_MAX_BYTES / PARSE_MAX_TAGS)
+# --> (extracted_urls, link_stats, page_stats, feature_record, secs, logs, capped)
+def parse_page(html, url):
+  logs = logList()
+  with Timer() as t:
+    scan = scan_page(html, logs, PARSE_MAX_BYTES, PARSE_MAX_TAGS)
+    extracted_urls, link_stats = scan.link_data(url, logs)
+    page_stats = scan.passed_stats()
+    record = scan.feature_record()
+  if scan.capped is not None:
+    logs.put('PARSE CAPPED (%s): %s, page of %s bytes / %s tags' % (scan.capped, url, len(html), html.count('<')))
+  return (extracted_urls, link_stats, page_stats, record, t.duration, logs, scan.capped)
+
+
+# stand-in result for a page whose parse failed: admitted with no links or feature record
+FAILED_PARSE = ([], [], None, None, 0.0, [], None)
+
+
+# pool entry point; exceptions are returned rather than raised, as async results are not checked
+def _pool_parse(args):
+  try:
+    return (True, parse_page(*args))
+  except Exception:
+    return (False, traceback.format_exc())
+
+
+def _init_worker():
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class parseStage:
+  def __init__(self, workers=PARSE_WORKERS, max_pending=PARSE_QUEUE_MAX):
+    self.workers = workers
+    self.pool = multiprocessing.Pool(workers, _init_worker, (), PARSE_MAX_TASKS_PER_CHILD)
+    self.slots = threading.BoundedSemaphore(max_pending)
+    self.Q_results = Queue.Queue()
+    self.lock = threading.Lock()
+
+    # pages in the pool, until their result comes back or they time out
+    # { n: (ctx, html, time_submitted) }
+    self.in_pool = {}
+    self.ids = itertools.count()
+    self.pending = 0
+    self.parsed = 0
+    self.errors = 0
+
+
+  # hand a fetched body to the pool; blocks (backpressure on fetching) while the stage is full
+  def submit(self, body, url, ctx):
+    html = body.translate(None, HIGH_BYTES)
+    self.slots.acquire()
+    with self.lock:
+      self.pending += 1
+      n = next(self.ids)
+      self.in_pool[n] = (ctx, html, time.time())
+    self.pool.apply_async(_pool_parse, ((html, url),), callback=lambda r: self._finish(n, r))
+
+
+  # pass on a page's result, unless the page already timed out (or vice versa)
+  def _finish(self, n, r):
+    with self.lock:
+      entry = self.in_pool.pop(n, None)
+    if entry is not None:
+      self.Q_results.put((entry[0], entry[1], r))
+
+
+  # --> (ctx, html, (ok, parse_page result or traceback / error string)); blocks until a page
+  # is back from the pool or has timed out
+  def get_result(self):
+    while True:
+      self._expire()
+      try:
+        return self.Q_results.get(True, PARSE_TIMEOUT)
+      except Queue.Empty:
+        continue
+
+
+  # subroutine failing the pages the pool has held for PARSE_TIMEOUT or more
+  def _expire(self):
+    now = time.time()
+    with self.lock:
+      stale = [n for n, entry in self.in_pool.iteritems() if now - entry[2] >= PARSE_TIMEOUT]
+    for n in stale:
+      self._finish(n, (False, 'parse timed out after %s secs' % (PARSE_TIMEOUT,)))
+
+
+  # release a page's slot once it has left the stage
+  def task_done(self, ok=True):
+    with self.lock:
+      self.pending -= 1
+      if ok:
+        self.parsed += 1
+      else:
+        self.errors += 1
+    self.slots.release()
+
+
+  def close(self):
+    self.pool.terminate()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import sys
+import re
+import pycurl
+import cStringIO
+from node_globals import *
+from node_locals import *
+
+
+# registrable domains (e.g. 'example.co.uk' for 'www.example.co.uk') per the Public Suffix
+# List, http://publicsuffix.org/list/, for POLITENESS_KEY = 'domain'
+#
+# Primary external routines:
+#
+# - For url admission (any thread):
+#   *  publicSuffixList().registrable_domain(hostname) --> domain, or the hostname itself for IP
+#      addresses & public suffixes
+#
+# The list is read from PUBLIC_SUFFIX_FILE (`python publicSuffix.py fetch` to download it);
+# w/o it only the list's default rule '*' applies, i.e. every TLD is a public suffix &
+# 'a.example.co.uk' --> 'co.uk', so the file should be fetched before crawling by domain.
+
+
+# default fetch function: returns (http_code or None on connection error, body)
+def fetch_list(url=PUBLIC_SUFFIX_URL):
+  buf = cStringIO.StringIO()
+  c = pycurl.Curl()
+  c.setopt(c.USERAGENT, USER_AGENT)
+  c.setopt(c.URL, url)
+  c.setopt(c.FOLLOWLOCATION, 1)
+  c.setopt(c.TIMEOUT, CURLOPT_TIMEOUT)
+  c.setopt(c.WRITEFUNCTION, buf.write)
+  try:
+    c.perform()
+    code = int(c.getinfo(c.HTTP_CODE))
+  except pycurl.error:
+    code = None
+  c.close()
+  return code, buf.getvalue()
+
+
+class publicSuffixList:
+  def __init__(self, fpath=PUBLIC_SUFFIX_FILE, Q_logs=None):
+
+    # rules by type, w/o their '*.' / '!' markers
+    self.rules = set()
+    self.wildcards = set()
+    self.exceptions = set()
+    try:
+      with open(fpath, 'r') as f:
+        self.parse(f)
+    except IOError:
+      msg = 'PUBLIC SUFFIX LIST: %s not found, using the default rule only' % (fpath,)
+      if Q_logs is not None:
+        Q_logs.put(msg)
+      else:
+        print msg
+
+
+  # one rule per line, up to the first whitespace; '//' comments
+  def parse(self, lines):
+    for line in lines:
+      line = line.strip()
+      if len(line) == 0 or line.startswith('//'):
+        continue
+      rule = line.split()[0].lower()
+
+      # internationalized rules are matched in their ascii (punycode) form, as hostnames are
+      try:
+        rule = rule.decode('utf-8').encode('idna')
+      except UnicodeError:
+        continue
+      if rule.startswith('!'):
+        self.exceptions.add(rule[1:])
+      elif rule.startswith('*.'):
+        self.wildcards.add(rule[2:])
+      else:
+        self.rules.add(rule)
+
+
+  # the public suffix plus one label, matching the longest rule (exceptions first)
+  def registrable_domain(self, hostname):
+    hostname = hostname.lower().rstrip('.')
+    if ':' in hostname or re.match(r'^[\d\.]+$', hostname) is not None:
+      return hostname
+    labels = hostname.split('.')
+    n = len(labels)
+    n_suffix = 1
+    for i in range(n):
+      suffix = '.'.join(labels[i:])
+      if suffix in self.exceptions:
+        return suffix
+      if suffix in self.rules or (i < n - 1 and '.'.join(labels[i+1:]) in self.wildcards):
+        n_suffix = n - i
+        break
+    if n_suffix >= n:
+      return hostname
+    return '.'.join(labels[n-n_suffix-1:])
+
+
+# test against the cases of the list's own test data, on a list excerpt
+def full_test():
+  psl = publicSuffixList('/dev/null')
+  psl.parse(['// comment', 'com', 'uk', 'co.uk', 'jp', '*.kawasaki.jp', '!city.kawasaki.jp', 'github.io'])
+  for hostname, domain in [
+      ('com', 'com'),
+      ('example.com', 'example.com'),
+      ('www.Example.COM.', 'example.com'),
+      ('co.uk', 'co.uk'),
+      ('www.example.co.uk', 'example.co.uk'),
+      ('kawasaki.jp', 'kawasaki.jp'),
+      ('test.kawasaki.jp', 'test.kawasaki.jp'),
+      ('www.b.test.kawasaki.jp', 'b.test.kawasaki.jp'),
+      ('city.kawasaki.jp', 'city.kawasaki.jp'),
+      ('www.city.kawasaki.jp', 'city.kawasaki.jp'),
+      ('a.b.github.io', 'b.github.io'),
+      ('example.test', 'example.test'),
+      ('a.b.example.test', 'example.test'),
+      ('10.0.0.1', '10.0.0.1')]:
+    assert psl.registrable_domain(hostname) == domain, (hostname, psl.registrable_domain(hostname))
+  print 'publicSuffixList: all tests passed'
+
+
+#
+# --> Command line functionality
+#
+if __name__ == '__main__':
+  if len(sys.argv) == 2 and sys.argv[1] == 'test':
+    full_test()
+  elif len(sys.argv) == 2 and sys.argv[1] == 'fetch':
+    code, body = fetch_list()
+    if code != 200:
+      print 'fetch of %s failed (%s)' % (PUBLIC_SUFFIX_URL, code)
+      sys.exit(1)
+    with open(PUBLIC_SUFFIX_FILE, 'w') as f:
+      f.write(body)
+    print '%s rules saved to %s' % (len(publicSuffixList().rules), PUBLIC_SUFFIX_FILE)
+  else:
+    print 'Usage: python publicSuffix.py ...'
+    print '(1) test'
+    print '(2) fetch'
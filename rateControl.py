@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import os
+import time
+import random
+import pickle
+import threading
+import email.utils
+from node_globals import *
+from node_locals import *
+
+
+# adaptive per-host politeness delay controller
+#
+# Primary external routine:
+#
+# - For url frontier (on each completed pull):
+#   *  record(host_addr, success, latency, http_code, retry_after) --> delay in secs
+#
+# The pull rate of each host (1/delay) is adjusted AIMD-style: every clean, fast response
+# adds RATE_AI_STEP pulls/sec, while errors, 429/503 responses or a latency spike multiply
+# the rate by RATE_MD_FACTOR.  The delay is never below RATE_LATENCY_MULTI x the host's
+# smoothed latency, and is clamped to the host's [min, max] bounds.
+
+
+# per-host statistics record
+class hostStats:
+  def __init__(self):
+    self.delay = RATE_INITIAL_DELAY
+    self.latency = None  # EWMA of pull latency, secs
+    self.err_rate = 0.0  # EWMA of error indicator
+    self.fetches = 0
+    self.errors = 0
+    self.last_code = None
+
+
+# parse a Retry-After header value (delta-seconds or HTTP-date) to secs from now
+def parse_retry_after(value, now=None):
+  if value is None:
+    return None
+  value = value.strip()
+  if value.isdigit():
+    return float(value)
+  t = email.utils.parsedate_tz(value)
+  if t is None:
+    return None
+  now = time.time() if now is None else now
+  return max(0.0, email.utils.mktime_tz(t) - now)
+
+
+class rateController:
+
+  def __init__(self, fpath=RATE_STATS_FILE):
+    self.fpath = fpath
+    self.lock = threading.Lock()
+
+    # { host_addr: hostStats }
+    self.stats = {}
+
+
+  # host delay bounds, from RATE_HOST_BOUNDS overrides or else the global bounds
+  def bounds(self, host_addr):
+    return RATE_HOST_BOUNDS.get(host_addr, (RATE_MIN_DELAY, RATE_MAX_DELAY))
+
+
+  # primary routine: log a pull & get the delay to wait before the host's next pull
+  def record(self, host_addr, success, latency=0.0, http_code=None, retry_after=None):
+    hs = self.stats.get(host_addr)
+    if hs is None:
+      with self.lock:
+        hs = self.stats.setdefault(host_addr, hostStats())
+    hs.fetches += 1
+    hs.last_code = http_code
+
+    # latency spike relative to host's smoothed latency counts as congestion
+    spike = False
+    if success and latency > 0:
+      if hs.latency is None:
+        hs.latency = latency
+      else:
+        spike = latency > RATE_SLOW_FACTOR*hs.latency
+        hs.latency += RATE_EWMA_ALPHA*(latency - hs.latency)
+
+    # AIMD on the pull rate
+    backoff = not success or spike or http_code in (429, 503)
+    if not success:
+      hs.errors += 1
+    hs.err_rate += RATE_EWMA_ALPHA*((1.0 if backoff else 0.0) - hs.err_rate)
+    rate = 1.0/hs.delay
+    if backoff:
+      rate *= RATE_MD_FACTOR
+    else:
+      rate += RATE_AI_STEP
+    delay = 1.0/rate
+
+    # bound by latency floor & per-host min/max
+    min_delay, max_delay = self.bounds(host_addr)
+    if hs.latency is not None:
+      delay = max(delay, RATE_LATENCY_MULTI*hs.latency)
+    hs.delay = min(max(delay, min_delay), max_delay)
+
+    # honour Retry-After on top of the controlled delay (not folded into the rate)
+    delay = hs.delay*(1.0 + RATE_JITTER*(2*random.random() - 1))
+    ra = parse_retry_after(retry_after)
+    if ra is not None:
+      delay = max(delay, min(ra, RATE_MAX_RETRY_AFTER))
+    return delay
+
+
+  # current delay for a host without logging a pull, e.g. for skipped (doc-type) pages
+  def current(self, host_addr):
+    hs = self.stats.get(host_addr)
+    return hs.delay if hs is not None else RATE_INITIAL_DELAY
+
+
+  # persist host stats to disk
+  def save(self):
+    with self.lock:
+      dump = dict(self.stats)
+    with open(self.fpath + '.tmp', 'wb') as f:
+      pickle.dump(dump, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(self.fpath + '.tmp', self.fpath)
+
+
+  # load persisted host stats
+  def load(self):
+    try:
+      with open(self.fpath, 'rb') as f:
+        dump = pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError):
+      return False
+    with self.lock:
+      self.stats.update(dump)
+    return True
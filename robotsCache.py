@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import re
+import time
+import pickle
+import threading
+import pycurl
+import cStringIO
+from node_globals import *
+from node_locals import *
+
+
+# robots.txt policy cache shared by all threads of a url frontier
+#
+# Primary external routines:
+#
+# - For url admission (any thread):
+#   *  get_rules(scheme, netloc) --> robotsRules
+#   *  cached_rules(scheme, netloc) --> robotsRules, or None w/o blocking if a fetch is needed
+#   *  robotsRules.allowed(path), robotsRules.crawl_delay
+#
+# - For restart / shutdown:
+#   *  save(), load()
+#
+# robots.txt is fetched at most once per host at a time: the first thread asking for an
+# uncached host does the fetch, every other thread asking for the same host waits on it
+
+
+# compiled rule set for a single host
+#
+# rules are held longest-pattern first (allow before disallow on ties), so that the first
+# rule matching a path is the most specific one; plain rules are simple prefix checks, and
+# only rules using '*' or '$' are compiled to regexes
+class robotsRules:
+  def __init__(self, raw_rules=[], crawl_delay=0.0):
+    self.raw_rules = list(raw_rules)
+    self.crawl_delay = min(float(crawl_delay), ROBOTS_MAX_CRAWL_DELAY)
+
+    # compile to [ (pattern, rgx or None, allow) ], sorted for longest match
+    compiled = []
+    for pattern, allow in self.raw_rules:
+      if pattern == '':
+        continue
+      if '*' in pattern or pattern.endswith('$'):
+        rgx_string = '.*'.join([re.escape(p) for p in re.sub(r'\$$', '', pattern).split('*')])
+        if pattern.endswith('$'):
+          rgx_string += '$'
+        rgx = re.compile(rgx_string)
+      else:
+        rgx = None
+      compiled.append((len(pattern), not allow, pattern, rgx, allow))
+    compiled.sort(key=lambda r: (-r[0], r[1]))
+    self.rules = [(r[2], r[3], r[4]) for r in compiled]
+
+
+  # path should include query string if any, e.g. '/search?q=x'
+  def allowed(self, path):
+    for pattern, rgx, allow in self.rules:
+      if rgx is None:
+        if path.startswith(pattern):
+          return allow
+      elif rgx.match(path) is not None:
+        return allow
+    return True
+
+
+ALLOW_ALL = robotsRules()
+DISALLOW_ALL = robotsRules([('/', False)])
+
+
+# product token of a user-agent line value, e.g. 'rlcrawler' for 'RLCrawler/1.0 (+http://...)'
+def product_token(value):
+  return re.match(r'[A-Za-z_\-]*', value).group(0).lower()
+
+
+# parse robots.txt text into a robotsRules object for the given agent name
+# groups naming the agent (its product token, case-insensitively) take precedence over '*'
+# groups, per RFC 9309
+def parse_robots(txt, agent_name=ROBOTS_AGENT_NAME):
+  agent_name = agent_name.lower()
+  groups = []
+  group = None
+  for line in txt.splitlines():
+    line = line.split('#', 1)[0].strip()
+    if ':' not in line:
+      continue
+    field, value = [s.strip() for s in line.split(':', 1)]
+    field = field.lower()
+
+    # consecutive user-agent lines share one group; a user-agent after rules starts a new one
+    if field == 'user-agent':
+      if group is None or len(group[1]) > 0 or group[2] is not None:
+        group = [[], [], None]
+        groups.append(group)
+      group[0].append(value.lower())
+    elif group is None:
+      continue
+    elif field == 'allow':
+      group[1].append((value, True))
+    elif field == 'disallow':
+      group[1].append((value, False))
+    elif field == 'crawl-delay':
+      try:
+        group[2] = float(value)
+      except ValueError:
+        pass
+
+  # select the groups applying to this agent
+  matched = [g for g in groups if len([a for a in g[0] if a != '*' and product_token(a) == agent_name]) > 0]
+  if len(matched) == 0:
+    matched = [g for g in groups if '*' in g[0]]
+  raw_rules = []
+  crawl_delay = 0.0
+  for g in matched:
+    raw_rules += g[1]
+    if g[2] is not None:
+      crawl_delay = max(crawl_delay, g[2])
+  return robotsRules(raw_rules, crawl_delay)
+
+
+# default fetch function: returns (http_code or None on connection error, body)
+def fetch_robots(root_url):
+  buf = cStringIO.StringIO()
+  c = pycurl.Curl()
+  c.setopt(c.USERAGENT, USER_AGENT)
+  c.setopt(c.URL, root_url + '/robots.txt')
+  c.setopt(c.FOLLOWLOCATION, 1)
+  c.setopt(c.MAXREDIRS, 5)
+  c.setopt(c.TIMEOUT, ROBOTS_TIMEOUT)
+  c.setopt(c.WRITEFUNCTION, buf.write)
+  try:
+    c.perform()
+    code = int(c.getinfo(c.HTTP_CODE))
+  except pycurl.error:
+    code = None
+  c.close()
+  return code, buf.getvalue()[:ROBOTS_MAX_BYTES]
+
+
+class robotsCache:
+
+  def __init__(self, Q_logs=None, fetch_fn=fetch_robots, fpath=ROBOTS_CACHE_FILE):
+    self.Q_logs = Q_logs
+    self.fetch_fn = fetch_fn
+    self.fpath = fpath
+    self.lock = threading.Lock()
+    self.fetch_count = 0
+
+    # { root_url: (robotsRules, time_expires) }
+    self.cache = {}
+
+    # in-progress fetches, for sharing one fetch between threads
+    # { root_url: threading.Event }
+    self.pending = {}
+
+
+  # primary routine for getting the rules covering a url's host
+  def get_rules(self, scheme, netloc):
+    root_url = robots_root(scheme, netloc)
+
+    # return cached rules, or else claim the fetch / find the thread already fetching
+    with self.lock:
+      entry = self.cache.get(root_url)
+      if entry is not None and entry[1] > time.time():
+        return entry[0]
+      ev = self.pending.get(root_url)
+      fetching = ev is None
+      if fetching:
+        ev = threading.Event()
+        self.pending[root_url] = ev
+
+    # wait on another thread's fetch; if it never lands treat the host as unreachable, as the
+    # fetching thread would
+    if not fetching:
+      ev.wait(2*ROBOTS_TIMEOUT)
+      entry = self.cache.get(root_url)
+      return entry[0] if entry is not None else DISALLOW_ALL
+
+    try:
+      rules, ttl = self._fetch_rules(root_url)
+    except Exception as e:
+      rules, ttl = DISALLOW_ALL, ROBOTS_ERROR_TTL
+      if self.Q_logs is not None:
+        self.Q_logs.put('ROBOTS ERROR: %s: %s' % (root_url, e))
+    with self.lock:
+      self.cache[root_url] = (rules, time.time() + ttl)
+      del self.pending[root_url]
+    ev.set()
+    return rules
+
+
+  # the unexpired cached rules covering a url's host, or None
+  def cached_rules(self, scheme, netloc):
+    entry = self.cache.get(robots_root(scheme, netloc))
+    if entry is not None and entry[1] > time.time():
+      return entry[0]
+    return None
+
+
+  # subroutine for fetching & compiling; returns (rules, ttl)
+  def _fetch_rules(self, root_url):
+    self.fetch_count += 1
+    code, body = self.fetch_fn(root_url)
+
+    # 2xx --> parse; 4xx --> no restrictions; 5xx or unreachable --> full disallow for a while
+    if code is not None and 200 <= code < 300:
+      return parse_robots(body), ROBOTS_TTL
+    elif code is not None and 400 <= code < 500:
+      return ALLOW_ALL, ROBOTS_TTL
+    else:
+      if self.Q_logs is not None and DEBUG_MODE:
+        self.Q_logs.put('ROBOTS UNAVAILABLE (code %s): disallowing %s for now' % (code, root_url))
+      return DISALLOW_ALL, ROBOTS_ERROR_TTL
+
+
+  # persist unexpired rules to disk
+  def save(self):
+    now = time.time()
+    with self.lock:
+      dump = [(k, r.raw_rules, r.crawl_delay, t) for k, (r, t) in self.cache.iteritems() if t > now]
+    with open(self.fpath + '.tmp', 'wb') as f:
+      pickle.dump(dump, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(self.fpath + '.tmp', self.fpath)
+
+
+  # load persisted rules, dropping expired ones
+  def load(self):
+    try:
+      with open(self.fpath, 'rb') as f:
+        dump = pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError):
+      return False
+    now = time.time()
+    with self.lock:
+      for root_url, raw_rules, crawl_delay, t in dump:
+        if t > now:
+          self.cache[root_url] = (robotsRules(raw_rules, crawl_delay), t)
+    return True
+
+
+# cache key of a url's host, i.e. the root url its robots.txt is fetched under
+def robots_root(scheme, netloc):
+  return scheme.lower() + '://' + netloc.lower()
+
+
+# robots path of a urlsplit result, i.e. path plus any query string
+def robots_path(url_parts):
+  path = url_parts.path if url_parts.path != '' else '/'
+  if url_parts.query != '':
+    path += '?' + url_parts.query
+  return path
+
+
+# test against a local http stand-in serving robots.txt (or errors) on 127.0.0.1
+def full_test():
+  import BaseHTTPServer
+  import tempfile
+
+  ROBOTS_TXT = "\n".join([
+    "User-agent: *",
+    "Disallow: /private",
+    "Allow: /private/open",
+    "Disallow: /*.cgi$",
+    "Crawl-delay: 7",
+    "",
+    "User-agent: someotherbot",
+    "Disallow: /"])
+  hits = []
+
+  class StandIn(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+      hits.append(self.path)
+      time.sleep(0.2)
+      if self.headers.get('Host', '').startswith('localhost'):
+        self.send_response(500)
+        self.end_headers()
+        return
+      self.send_response(200)
+      self.end_headers()
+      self.wfile.write(ROBOTS_TXT)
+
+    def log_message(self, *args):
+      pass
+
+  server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StandIn)
+  port = server.server_address[1]
+  t = threading.Thread(target=server.serve_forever)
+  t.setDaemon(True)
+  t.start()
+
+  rc = robotsCache(None, fetch_robots, tempfile.mktemp())
+  netloc = '127.0.0.1:%s' % (port,)
+
+  # many threads asking at once should share a single fetch
+  results = []
+  threads = [threading.Thread(target=lambda: results.append(rc.get_rules('http', netloc))) for i in range(8)]
+  for th in threads:
+    th.start()
+  for th in threads:
+    th.join()
+  assert len(hits) == 1, hits
+  assert len(set([id(r) for r in results])) == 1
+  assert rc.cached_rules('http', netloc) is results[0]
+  assert rc.cached_rules('http', 'uncached.example.com') is None
+
+  rules = results[0]
+  assert rules.allowed('/index.html')
+  assert not rules.allowed('/private/x')
+  assert rules.allowed('/private/open/x')
+  assert not rules.allowed('/bin/run.cgi')
+  assert rules.allowed('/bin/run.cgi?x=1')
+  assert rules.crawl_delay == 7.0
+
+  # 5xx --> disallow all for the error ttl
+  assert not rc.get_rules('http', 'localhost:%s' % (port,)).allowed('/')
+
+  # persistence round trip
+  rc.save()
+  rc2 = robotsCache(None, fetch_robots, rc.fpath)
+  rc2.load()
+  assert not rc2.get_rules('http', netloc).allowed('/private')
+  assert len(hits) == 2
+  os.remove(rc.fpath)
+  server.shutdown()
+
+  # groups are matched on the exact product token, not on substrings of the agent name
+  txt = "User-agent: *\nDisallow: /\n\nUser-agent: crawl\nUser-agent: r\nAllow: /\n"
+  assert not parse_robots(txt).allowed('/page')
+  assert parse_robots(txt + "\nUser-agent: RLCrawler/1.0\nAllow: /page\n").allowed('/page')
+  print 'robotsCache: all tests passed'
+
+
+#
+# --> Command line functionality
+#
+if __name__ == '__main__':
+  if len(sys.argv) == 2 and sys.argv[1] == 'test':
+    full_test()
+  else:
+    print 'Usage: python robotsCache.py ...'
+    print '(1) test'
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+import re
+import gzip
+import time
+import urlparse
+from multiprocessing.pool import ThreadPool
+from pybloomfilter import BloomFilter
+from pageAnalyze import canonical_url
+from node_globals import *
+
+
+# streaming bulk seed loader, for seed lists of millions of urls
+#
+# Primary external routines:
+#
+# - For crawl node start / restart:
+#   *  seedLoader(uf, paths, shared).urls() --> generator of canonical seed urls, to be
+#      handed to uf.initialize
+#
+# Seed files (plain or gzip, one url per line, '#' comments) are read SEED_BATCH_SIZE lines at
+# a time & never held whole.  Each batch is:
+#
+# - canonicalized (pageAnalyze.canonical_url) & deduped against an in-memory bloom filter, so
+#   that a SEED_BF_ERROR_RATE fraction of seeds may be dropped as false positives
+# - resolved: the batch's hosts not yet in the frontier's DNS cache are looked up
+#   SEED_DNS_WORKERS at a time, & urls of hosts that fail are dropped here (rather than looked
+#   up again, one by one, by the frontier)
+# - partitioned: w/ shared=True, i.e. every node loading the same files, urls owned by other
+#   nodes are dropped, as their owners load them too; else they are passed on to the frontier,
+#   which messages them to their owners
+# - checked: robots.txt of the new hosts of urls kept for this node is fetched on the same
+#   pool, so that the frontier finds it cached (rather than fetching it, one by one)
+#
+# Progress is logged per batch as SEEDS & counted in seed_urls_total.
+
+
+OUTCOMES = ('queued', 'duplicate', 'invalid', 'dns_failed', 'other_node')
+
+
+# open a plain or gzip (by its magic number) seed file
+def open_seed_file(path):
+  with open(path, 'rb') as f:
+    magic = f.read(2)
+  if magic == '\x1f\x8b':
+    return gzip.open(path, 'rb')
+  return open(path, 'r')
+
+
+class seedLoader:
+  def __init__(self, uf, paths, shared=False, Q_logs=None):
+    self.uf = uf
+    self.paths = paths
+    self.shared = shared
+    self.Q_logs = Q_logs if Q_logs is not None else uf.Q_logs
+    self.counts = dict([(o, 0) for o in OUTCOMES])
+    self.n_read = 0
+    self.n_hosts = 0
+    self.n_robots = 0
+
+    # hostnames that failed to resolve
+    self.failed = set()
+
+    uf.metrics.counter('seed_urls_total', 'Seed file urls by outcome (queued, duplicate, invalid, dns_failed, other_node)')
+
+
+  # primary routine: canonical, deduped & resolved seed urls for this node, batch by batch
+  def urls(self):
+    if len(self.paths) == 0:
+      return
+    self.start = time.time()
+    self.seen = BloomFilter(SEED_BF_CAPACITY, SEED_BF_ERROR_RATE)
+    pool = ThreadPool(SEED_DNS_WORKERS)
+    try:
+      for path in self.paths:
+        f = open_seed_file(path)
+        try:
+          batch = []
+          for line in f:
+            batch.append(line)
+            if len(batch) >= SEED_BATCH_SIZE:
+              for url in self._load_batch(batch, pool):
+                yield url
+              batch = []
+          for url in self._load_batch(batch, pool):
+            yield url
+        finally:
+          f.close()
+    finally:
+      pool.close()
+      self._log('SEEDS: done; ')
+
+
+  def _count(self, outcome, n=1):
+    self.counts[outcome] += n
+    self.uf.metrics.inc('seed_urls_total', n, outcome=outcome)
+
+
+  # --> [url] of a batch of seed file lines
+  def _load_batch(self, lines, pool):
+
+    # canonicalize & dedupe
+    urls = []
+    for line in lines:
+      line = line.strip()
+      if len(line) == 0 or line.startswith('#'):
+        continue
+      self.n_read += 1
+      url = canonical_url(line)
+      if url is None:
+        self._count('invalid')
+        continue
+      url = re.sub(r'/$', '', url)
+      if self.seen.add(url):
+        self._count('duplicate')
+        continue
+      urls.append((url, urlparse.urlsplit(url).netloc))
+
+    # resolve the batch's new hosts in parallel
+    hosts = list(set([h for u, h in urls if not self.uf.DNScache.has_key(h) and h not in self.failed]))
+    self.n_hosts += len(hosts)
+    if len(hosts) > 0:
+      self.failed.update(self.uf.resolve_hosts(hosts, pool))
+
+    # partition by owning node
+    out = []
+    own = []
+    for url, host in urls:
+      if host in self.failed:
+        self._count('dns_failed')
+        continue
+      mine = self.uf.url_node(url, self.uf.politeness_key(host, self.uf.DNScache[host][0])) == self.uf.node_n
+      if self.shared and not mine:
+        self._count('other_node')
+      else:
+        self._count('queued')
+        out.append(url)
+        if mine:
+          own.append(url)
+
+    # fetch robots.txt of the new hosts of this node's urls in parallel
+    self.n_robots += self.uf.prefetch_robots(own, pool)
+    if len(lines) > 0:
+      self._log('SEEDS: ')
+    return out
+
+
+  def _log(self, prefix):
+    elapsed = time.time() - self.start
+    msg = prefix + '%s read (%.0f / sec), %s hosts resolved, %s robots.txt fetched, ' % (self.n_read, self.n_read/max(elapsed, 1e-6), self.n_hosts, self.n_robots)
+    msg += ', '.join(['%s %s' % (self.counts[o], o) for o in OUTCOMES])
+    if self.Q_logs is not None:
+      self.Q_logs.put(msg)
+    else:
+      print msg
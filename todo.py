@@ -1,16 +1,10 @@
 # NOTE NOTE --> OVERALL TO-DO LIST
-# - testing function that takes sample of all thread page crawls to form picture of time / 
-#   efficiency, without requiring every single one to print out
 # - make some sort of CHECKS system that checks that all pages expected to be crawled were
 # - some sort of function to handle transferring e.g. DNS cache data to disk when/if too large
 # - way to send extracted urls that do not belong to this node to other node in periodic packet
 #   to avoid index muddling/confusion
 # - find out what the server footprint of socket is...
-# - robots.txt reader / policy system (ask Matt about this...)
-# - handle logging/possible re-try of pages that failed to pull... ALSO: detecting whether
-#   entire server might be down, putting url back and putting a long wait time in backq_heap
 # - implement fingerprinting for deduplication?
-# - try using http://publicsuffix.org/list/?
 # - ***handle/DETECT other doc types e.g. pdfs
 # - DUAL LAYER PERCEPTRON THRESHOLD: have one serially-updating one on analyze node, have
 #   another simpler, low-thresh, less-frequently-updated one doing basic screen on crawl node
@@ -7,10 +7,21 @@ import heapq
 import hashlib
 import datetime
 import random
+import threading
+import itertools
+from multiprocessing.pool import ThreadPool
 from util import *
 import Queue
 import re
 from pybloomfilter import BloomFilter
+from robotsCache import robotsCache, robots_path, robots_root
+from rateControl import rateController, parse_retry_after
+from latencyStats import latencyRecorder
+from nodeMetrics import metricsRegistry
+from linkScorer import linkScorer
+from frontierRecord import urlRecord
+from publicSuffix import publicSuffixList
+from crawlBudget import crawlBudget
 from node_globals import *
 from node_locals import *
 
@@ -21,13 +32,27 @@ from node_locals import *
 #
 # - For CrawlThread:
 #   *  get_crawl_task()
-#   *  log_and_add_extracted(host_addr, success, time_taken, urls)
+#   *  log_and_add_extracted(host_addr, seed_dist, success, time_taken, urls, ...)
 #
 # - For MaintenanceThread:
-#   *  clean_and_fill()
+#   *  clean_and_fill_loop()
+#
+# - For the crawl scaler (crawlScaler):
+#   *  set_hq_target(n), ready_hosts()
 #
 # - For initialization (sole) thread:
 #   *  initialize(urls)
+#   *  resolve_hosts(hostnames, pool), prefetch_robots(urls, pool), politeness_key(netloc, addr),
+#      url_node(url, host_addr); for bulk seed loading
+#
+# - For CrawlThread, around each fetch:
+#   *  connect_addr(netloc, host_addr), acquire_ip(addr), release_ip(addr)
+#
+# NOTE: hqs, & all per host state (rates, crawl delays, host health & parking, latency) are
+# keyed by the POLITENESS_KEY of a url: its IP address ('ip', the default), its hostname
+# ('host') or its registrable domain ('domain'); this key is called host_addr throughout.
+# W/ 'host' / 'domain', hqs sharing an IP address are also limited to IP_MAX_CONNECTIONS
+# concurrent fetches.
 
 class urlFrontier:
   
@@ -40,13 +65,26 @@ class urlFrontier:
     # single variable for tracking whether node should be active or not
     self.active = True
     
+    # NOTE: urls are queued as compact records (frontierRecord.urlRecord), w/ the url, seed
+    # distance, ref_page_stats & parent url as rec.url, rec.seed_dist, rec.stats, rec.parent_url
+
     # crawl task Queue
-    # Priority Queue ~ [ (next_pull_time, host_addr, url, parent_page_stats, seed_dist, parent_url) ]
+    # Priority Queue ~ [ (next_pull_time, host_addr, rec) ]
     self.Q_crawl_tasks = Queue.PriorityQueue()
 
-    # host queue dict
-    # { host_addr: [(url, ref_page_stats, seed_dist, parent_url), ...] }
+    # host queue dict; each hq is a heap, best link score first (FIFO among equal scores)
+    # { host_addr: [(-score, seq, rec), ...] }
     self.hqs = {}
+
+    # number of hqs to keep active, resized at runtime by the crawl scaler; hq_adjust is the
+    # pending change not yet claimed by maintenance threads (< 0: emptied hqs not to replace)
+    self.hq_target = HQ_TO_THREAD_RATIO*NUMBER_OF_CTHREADS
+    self.hq_adjust = 0
+    self.hq_lock = threading.Lock()
+
+    # crawl-side link scoring model, refreshed from the analysis node's exports
+    self.scorer = linkScorer(Q_logs)
+    self.seq = itertools.count()
     
     # seen url check
     # Bloom Filter ~ [ url ]
@@ -60,12 +98,48 @@ class urlFrontier:
       self.seen = BloomFilter(BF_CAPACITY, BF_ERROR_RATE, BF_FILENAME)
 
     # DNS Cache
-    # { netloc: (host_addr, time_last_checked) }
+    # { netloc: (ip_addr, time_last_checked) }
     self.DNScache = {}
 
-    # overflow url Queue
-    # Queue ~ [ (host_addr, url, ref_page_stats, seen_dist, parent_url) ]
-    self.Q_overflow_urls = Queue.Queue()
+    # registrable domains, for POLITENESS_KEY = 'domain'
+    self.suffixes = publicSuffixList(PUBLIC_SUFFIX_FILE, Q_logs) if POLITENESS_KEY == 'domain' else None
+
+    # fetches in progress per IP address, at most IP_MAX_CONNECTIONS each
+    # { ip_addr: n_fetches }
+    self.ip_fetches = {}
+    self.ip_cv = threading.Condition()
+
+    # robots.txt policy cache, persisted along with the seen filter
+    self.robots = robotsCache(Q_logs)
+    if seen_persist:
+      self.robots.load()
+
+    # urls of hosts whose robots.txt is not yet cached, held (& counted as active) while one of
+    # ROBOTS_FETCH_THREADS fetches it, so that no thread adding urls ever waits on a fetch
+    # { root_url: [(url_parts, host_addr, rec)] }
+    self.robots_held = {}
+    self.robots_lock = threading.Lock()
+    self.robots_pool = ThreadPool(ROBOTS_FETCH_THREADS)
+
+    # robots.txt Crawl-delay floor per host_addr, max over the hostnames admitted to it
+    # { host_addr: crawl_delay }
+    self.crawl_delays = {}
+
+    # adaptive per-host politeness delays, persisted along with the seen filter
+    self.rates = rateController()
+    if seen_persist:
+      self.rates.load()
+
+    # overflow url Queue, best link score first, so that the next hq made is for the host
+    # w/ the best pending url
+    # Priority Queue ~ [ (-score, seq, host_addr, rec) ]
+    self.Q_overflow_urls = Queue.PriorityQueue()
+
+    # overflow urls passed over as their host already has an hq, held until that hq is deleted
+    # (so that they are not read again on every pass over overflow)
+    # { host_addr: [(-score, seq, host_addr, rec)] }
+    self.overflow_held = {}
+    self.overflow_lock = threading.Lock()
 
     # host queue cleanup Queue
     # Priority Queue ~ [ (time_to_delete, host_addr) ]
@@ -82,14 +156,151 @@ class urlFrontier:
     self.thread_active = {}
     
     # Queue of messages to be sent to other nodes
-    # Queue ~ [ (node_num_to, url, seed_dist, parent_page_stats) ]
+    # Queue ~ [ (node_num_to, rec) ]
     self.Q_to_other_nodes = Queue.Queue()
 
+    # retry schedule for failed pulls, also holds probes of parked hosts
+    # Priority Queue ~ [ (retry_time, host_addr, rec) ]
+    self.Q_retry = Queue.PriorityQueue()
+
+    # failed pull attempts so far of urls currently awaiting retry
+    # { url: attempts }
+    self.retry_attempts = {}
+
+    # consecutive host-down failures (connection errors / 5xx) per host
+    # { host_addr: n_failures }
+    self.host_failures = {}
+
+    # parked (presumed dead) hosts' queues, held until a probe of the host succeeds
+    # { host_addr: [rec, ...] }
+    self.parked = {}
+    self.park_lock = threading.Lock()
+
+    # the url serving as probe of each parked host
+    # { host_addr: url }
+    self.probes = {}
+
+    # fetch phase latency histograms, global & per host (recorded by crawl threads)
+    self.latency = latencyRecorder()
+
+    # live node metrics, served by the crawl node's metrics endpoint
+    self.metrics = metricsRegistry()
+    self._register_metrics()
+
+    # per host / path prefix / query parameter budgets & spider trap detection, persisted
+    # along with the seen filter
+    self.budget = crawlBudget(Q_logs, self.metrics)
+    if seen_persist:
+      self.budget.load()
+
+    # failure handling counters
+    self.retries = 0
+    self.give_ups = 0
+    self.hosts_parked = 0
+
+
+  # subroutine for declaring frontier metrics; queue sizes are read via (O(1)) qsize at scrape
+  # time, everything else is counted as it happens
+  def _register_metrics(self):
+    m = self.metrics
+    m.counter('crawl_fetches_total', 'Page pulls by result (success, http_error, conn_error, skipped)')
+    m.counter('parse_capped_total', 'Pages cut to PARSE_MAX_BYTES / PARSE_MAX_TAGS before parsing, by limit')
+    m.gauge('frontier_hq_urls', 'Urls queued in host queues')
+    m.gauge('frontier_hqs', 'Active host queues', lambda: len(self.hqs))
+    m.gauge('frontier_hq_target', 'Host queues to keep active', lambda: self.hq_target)
+    m.gauge('crawl_workers_waiting', 'Crawl threads waiting on a crawl task or a host\'s politeness delay')
+    m.gauge('frontier_crawl_tasks', 'Crawl tasks queued (one per active hq)', self.Q_crawl_tasks.qsize)
+    m.gauge('frontier_overflow_urls', 'Urls waiting in overflow for an hq', self.Q_overflow_urls.qsize)
+    m.gauge('frontier_overflow_held_urls', 'Overflow urls held until their host\'s hq is deleted')
+    m.gauge('frontier_hq_cleanup', 'Host queues waiting for cleanup', self.Q_hq_cleanup.qsize)
+    m.gauge('frontier_to_other_nodes', 'Urls waiting to be sent to other nodes', self.Q_to_other_nodes.qsize)
+    m.gauge('frontier_retry', 'Failed urls waiting for retry', self.Q_retry.qsize)
+    m.gauge('frontier_parked_hosts', 'Hosts currently parked as dead', lambda: len(self.parked))
+    m.gauge('frontier_robots_pending', 'Hosts w/ urls held on a robots.txt fetch', lambda: len(self.robots_held))
+    m.gauge('frontier_active_count', 'Urls active on this node (queued, in flight or unwritten)', self.Q_active_count.qsize)
+    m.counter('frontier_retries_total', 'Failed pulls scheduled for retry', lambda: self.retries)
+    m.counter('frontier_give_ups_total', 'Failed urls given up on', lambda: self.give_ups)
+    m.counter('frontier_hosts_parked_total', 'Times a host was parked', lambda: self.hosts_parked)
+    m.counter('frontier_urls_admitted_total', 'Extracted urls admitted to this node\'s frontier')
+    m.gauge('link_model_version', 'Version of the link scoring model in use (0 for none)', lambda: self.scorer.version)
+    m.counter('crawl_pages_scored_total', 'Fetched pages scored by the link model')
+    m.counter('crawl_pages_relevant_total', 'Fetched pages the link model scores above LINK_MODEL_RELEVANT_THRESH')
+    m.gauge('crawl_harvest_rate', 'Relevant pages per scored fetch', self._harvest_rate)
+    m.counter('dns_cache_lookups_total', 'DNS cache lookups by result (hit, refresh, miss)')
+    m.gauge('crawl_ips_fetching', 'IP addresses w/ fetches in progress', lambda: len(self.ip_fetches))
+    m.counter('crawl_ip_limit_waits_total', 'Fetches held back by their IP\'s IP_MAX_CONNECTIONS limit')
+    m.counter('messages_sent_total', 'Urls sent to & confirmed by other nodes')
+    m.counter('messages_received_total', 'Urls received from other nodes')
+    m.counter('message_confirm_timeouts_total', 'Url sends to other nodes w/o confirmation (re-queued)')
+    m.counter('payloads_dropped_total', 'Payloads written to the payload db')
+    m.counter('payload_write_errors_total', 'Payload db inserts that failed')
+    m.gauge('payload_writer_lag_seconds', 'Enqueue-to-insert time of the last payload written')
+    m.add_collector(self._latency_lines)
+
+
+  # subroutine rendering fetch phase latency quantiles as prometheus summaries
+  def _latency_lines(self):
+    lines = ['# TYPE crawl_phase_seconds summary']
+    with self.latency.lock:
+      phases = self.latency.phases.items()
+      for phase, h in phases:
+        for q in (0.5, 0.9, 0.99):
+          lines.append('crawl_phase_seconds{phase="%s",quantile="%s"} %s' % (phase, q, h.percentile(100*q)))
+        lines.append('crawl_phase_seconds_sum{phase="%s"} %s' % (phase, h.total))
+        lines.append('crawl_phase_seconds_count{phase="%s"} %s' % (phase, h.n))
+    return lines
+
+
+  def _harvest_rate(self):
+    n = self.metrics.value('crawl_pages_scored_total')
+    return self.metrics.value('crawl_pages_relevant_total')/float(n) if n > 0 else 0.0
+
+
+  # subroutines for adding to / taking from an hq, keeping the queued url gauge current;
+  # records are scored by the link model on the way in
+  def _hq_append(self, host_addr, r):
+    heapq.heappush(self.hqs[host_addr], (-self.scorer.score(r.stats), next(self.seq), r))
+    self.metrics.inc('frontier_hq_urls')
+
+
+  def _hq_pop(self, host_addr):
+    r = heapq.heappop(self.hqs[host_addr])[2]
+    self.metrics.dec('frontier_hq_urls')
+    return r
+
+
+  # subroutine for adding a record to overflow
+  def _overflow_put(self, host_addr, r):
+    self.Q_overflow_urls.put((-self.scorer.score(r.stats), next(self.seq), host_addr, r))
+
+
+  # subroutine for holding an overflow entry while its host has an hq; False if it has none
+  def _hold_for_hq(self, e):
+    with self.overflow_lock:
+      if self.hqs.has_key(e[2]):
+        self.overflow_held.setdefault(e[2], []).append(e)
+        self.metrics.inc('frontier_overflow_held_urls')
+        return True
+    return False
+
+
+  # subroutine for deleting an hq --> [rec] of the overflow urls held for it
+  def _hq_delete(self, host_addr):
+    with self.overflow_lock:
+      del self.hqs[host_addr]
+      held = self.overflow_held.pop(host_addr, [])
+    self.metrics.dec('frontier_overflow_held_urls', len(held))
+    return [e[3] for e in held]
+
 
   # primary routine for getting a crawl task from queue
   def get_crawl_task(self):
     if self.active:
-      return self.Q_crawl_tasks.get()
+      self.metrics.inc('crawl_workers_waiting')
+      try:
+        return self.Q_crawl_tasks.get()
+      finally:
+        self.metrics.dec('crawl_workers_waiting')
 
     # if url frontier shutdown, block indefinitely (until node shutdown)
     else:
@@ -98,29 +309,45 @@ class urlFrontier:
   
 
   # primary routine to log crawl task done & submit extracted urls
-  def log_and_add_extracted(self, host_addr, host_seed_dist, success, time_taken=0,url_pkgs=[]):
-
-    # handle failure of page pull
-    # NOTE: TO-DO!
-    if not success:
-      pass
+  # fetched=False marks a task that was not actually pulled (e.g. doc types), which is not
+  # counted in the host's rate stats
+  # failed_task = the record of a failed pull, which is then either retried or dropped from
+  # the active count here
+  def log_and_add_extracted(self, host_addr, host_seed_dist, success, time_taken=0, url_pkgs=[], http_code=None, retry_after=None, fetched=True, failed_task=None, curl_errno=None):
+
+    # handle failure of page pull: schedule retry or give up, & track host for parking
+    was_parked = False
+    if fetched:
+      host_down = not success and (curl_errno in RETRY_CURL_ERRORS or (http_code is not None and http_code >= 500))
+      was_parked = self._log_host_health(host_addr, host_down)
+      if not success and failed_task is not None:
+        self._retry_or_give_up(host_addr, failed_task, http_code, curl_errno, retry_after)
 
     # add urls to either hq of host_addr or else overflow queue
     for url_pkg in url_pkgs:
       self._add_extracted_url(host_addr, host_seed_dist, url_pkg)
 
-    # calculate time delay based on success
+    # calculate time delay via host's rate controller, with robots.txt Crawl-delay as floor
     now = datetime.datetime.now()
-    r = random.random()
-    td = 10*time_taken + r*BASE_PULL_DELAY if success else (0.5 + r)*BASE_PULL_DELAY
+    if fetched:
+      td = self.rates.record(host_addr, success, time_taken, http_code, retry_after)
+    else:
+      td = self.rates.current(host_addr)
+    td = max(td, self.crawl_delays.get(host_addr, 0.0))
     next_time = now + datetime.timedelta(0, td)
 
+    # if this was a probe of a parked host, or the pull that parked it, there is no hq to serve
+    # (an hq made for the host since it was un-parked is served by its own task)
+    if was_parked or not self.hqs.has_key(host_addr):
+      self.Q_crawl_tasks.task_done()
+      return
+
     # if the hq of host_addr is not empty, enter new task in crawl task queue
     if len(self.hqs[host_addr]) > 0:
 
       # add task to crawl task queue
-      r = self.hqs[host_addr].pop()
-      self.Q_crawl_tasks.put((next_time, host_addr) + r)
+      r = self._hq_pop(host_addr)
+      self.Q_crawl_tasks.put((next_time, host_addr, r))
 
     # else if empty, add task to cleanup queue
     else:
@@ -130,9 +357,117 @@ class urlFrontier:
     self.Q_crawl_tasks.task_done()
 
 
+  # subroutine for tracking consecutive host-down failures; parks a host's hq once it hits
+  # DEAD_HOST_FAILS, and un-parks it on any response from the host (e.g. a probe succeeding)
+  # --> True if the host was parked already, i.e. the pull was a probe
+  def _log_host_health(self, host_addr, host_down):
+    with self.park_lock:
+      was_parked = self.parked.has_key(host_addr)
+      if not host_down:
+        self.host_failures.pop(host_addr, None)
+
+        # un-park: send held urls back through overflow to get a new hq
+        if self.parked.has_key(host_addr):
+          self.probes.pop(host_addr, None)
+          for r in self.parked.pop(host_addr):
+            self._overflow_put(host_addr, r)
+          if self.Q_logs is not None:
+            self.Q_logs.put("HOST UN-PARKED: %s responded to probe" % (host_addr,))
+        return was_parked
+
+      n = self.host_failures.get(host_addr, 0) + 1
+      self.host_failures[host_addr] = n
+
+      # park: hold the hq's urls (& overflow urls held for it) & delete the hq (its only task
+      # being this pull), handing its slot to the maintenance threads to be re-used
+      if n >= DEAD_HOST_FAILS and not was_parked and self.hqs.has_key(host_addr):
+        recs = [e[2] for e in self.hqs[host_addr]]
+        self.metrics.dec('frontier_hq_urls', len(recs))
+        self.parked[host_addr] = recs + self._hq_delete(host_addr)
+        with self.hq_lock:
+          self.hq_adjust += 1
+        self.hosts_parked += 1
+        if self.Q_logs is not None:
+          self.Q_logs.put("HOST PARKED: %s after %s consecutive failures (%s urls held)" % (host_addr, n, len(self.parked[host_addr])))
+      return was_parked
+
+
+  # subroutine for putting a failed url on the retry schedule w/ exponential backoff, or
+  # else giving up on it; for a parked host the url is (re-)scheduled as the host's probe
+  def _retry_or_give_up(self, host_addr, failed_task, http_code, curl_errno, retry_after):
+    url = failed_task.url
+    now = datetime.datetime.now()
+    ra = parse_retry_after(retry_after)
+
+    # parked host --> probe again, backing off on consecutive failures
+    if self.parked.has_key(host_addr):
+      n = self.host_failures.get(host_addr, DEAD_HOST_FAILS) - DEAD_HOST_FAILS
+      delay = min(PARK_PROBE_DELAY*(2**n), PARK_MAX_PROBE_DELAY)
+      self.probes[host_addr] = url
+      self.Q_retry.put((now + datetime.timedelta(0, delay), host_addr, failed_task))
+      return
+
+    # transient failure w/ attempts left --> back off & retry
+    attempts = self.retry_attempts.get(url, 0) + 1
+    if (curl_errno in RETRY_CURL_ERRORS or http_code in RETRY_HTTP_CODES) and attempts <= RETRY_MAX_ATTEMPTS:
+      self.retry_attempts[url] = attempts
+      delay = min(RETRY_BASE_DELAY*(2**(attempts-1)), RETRY_MAX_DELAY)*(0.5 + random.random())
+      if ra is not None:
+        delay = max(delay, ra)
+      self.Q_retry.put((now + datetime.timedelta(0, delay), host_addr, failed_task))
+      self.retries += 1
+
+    # permanent failure or out of attempts --> give up, release from active count
+    else:
+      self.retry_attempts.pop(url, None)
+      self.give_ups += 1
+      task = self.Q_active_count.get()
+      self.Q_active_count.task_done()
+      if DEBUG_MODE:
+        self.Q_logs.put("GAVE UP ON %s after %s attempts (HTTP %s, curl %s)" % (url, attempts, http_code, curl_errno))
+
+
+  # subroutine for adding a url to a parked host's held queue; False if host not parked
+  def _hold_if_parked(self, host_addr, r):
+    with self.park_lock:
+      if self.parked.has_key(host_addr):
+        self.parked[host_addr].append(r)
+        return True
+    return False
+
+
+  # subroutine for maintenance threads: move due retries back into their hq if it exists,
+  # else to overflow; due probes of parked hosts go straight to the crawl task queue, while
+  # other retries for parked hosts join the parked queue
+  def _release_due_retries(self):
+    now = datetime.datetime.now()
+    while True:
+      try:
+        r = self.Q_retry.get(False)
+      except Queue.Empty:
+        break
+      self.Q_retry.task_done()
+      if r[0] > now:
+        self.Q_retry.put(r)
+        break
+      host_addr = r[1]
+      with self.park_lock:
+        if self.parked.has_key(host_addr):
+          if self.probes.get(host_addr) == r[2].url:
+            self.Q_crawl_tasks.put((now, host_addr, r[2]))
+          else:
+            self.parked[host_addr].append(r[2])
+          continue
+      try:
+        self._hq_append(host_addr, r[2])
+      except KeyError:
+        self._overflow_put(host_addr, r[2])
+
+
   # subroutine to add a url extracted from a host_addr
+  # url_pkg = (url, parentInfo or None, link_title_tokens), see frontierRecord
   def _add_extracted_url(self, ref_host_addr, ref_seed_dist, url_pkg, from_other_node=False):
-    url_in, ref_page_stats, parent_url = url_pkg
+    url_in, parent, link = url_pkg
 
     # basic cleaning operations on url
     # NOTE: it is the responsibility of the crawlNode.py extract_links fn to server proper url
@@ -163,6 +498,9 @@ class urlFrontier:
     if host_addr is None:
       return False
 
+    # from here on the url's hq is that of its politeness key (its IP address by default)
+    host_addr = self.politeness_key(url_parts.netloc, host_addr)
+
     # calculate url's seed distance
     if not from_other_node:
       seed_dist = ref_seed_dist if host_addr == ref_host_addr else ref_seed_dist + 1
@@ -173,27 +511,42 @@ class urlFrontier:
     if seed_dist > MAX_SEED_DIST and MAX_SEED_DIST > -1:
       return False
 
+    # if the page belongs to another node, pass to message sending service
+    # NOTE: robots.txt is checked by the owning node on receipt, not here
+    if not from_other_node:
+      url_node = self.url_node(url, host_addr)
+      if url_node != self.node_n:
+        self.Q_active_count.put(True)
+        self.Q_to_other_nodes.put((url_node, urlRecord(url, seed_dist, parent, link)))
+        return False
+
+    # apply robots.txt policy, so that disallowed urls never enter an hq; if the host's
+    # robots.txt is not cached the url is held for it & admitted (or not) once fetched
+    rules = self.robots.cached_rules(url_parts.scheme, url_parts.netloc)
+    if rules is None:
+      self._hold_for_robots(url_parts, host_addr, urlRecord(url, seed_dist, parent, link))
+      return False
+    if not self._robots_admit(url_parts, host_addr, rules):
+      return False
+
+    # apply crawl budgets & spider trap detection, so that no host / pattern can fill the
+    # frontier w/ endless unique urls
+    if not self.budget.admit(url_parts, host_addr):
+      return False
+
     # --> At this point, marker should be added to active count
     #     This will be removed when url is either:
     #       (A) sent to another node successfully
     #       (B) dropped to payload database
     self.Q_active_count.put(True)  
+    self.metrics.inc('frontier_urls_admitted_total')
     if DEBUG_MODE:
       self.Q_logs.put("Active count: %s" % self.Q_active_count.qsize())
 
-    # if the page belongs to another node, pass to message sending service
-    if not from_other_node:
-      if DISTR_ON_FULL_URL:
-        url_node = hash(url) % NUMBER_OF_NODES
-      else:
-        url_node = hash(host_addr) % NUMBER_OF_NODES
-      if url_node != self.node_n:
-        self.Q_to_other_nodes.put((url_node, url, ref_page_stats, seed_dist, parent_url))
-        return False
-
     # if this is an internal link, and not from other node, send directly to the serving hq
-    if seed_dist == ref_seed_dist and not from_other_node:
-      self.hqs[host_addr].append((url, ref_page_stats, seed_dist, parent_url))
+    # (unless there is none, i.e. when the serving task was a probe of a parked host)
+    if seed_dist == ref_seed_dist and not from_other_node and self.hqs.has_key(host_addr):
+      self._hq_append(host_addr, urlRecord(url, seed_dist, parent, link))
 
       # update total count
       self.total_crawled += 1
@@ -202,12 +555,106 @@ class urlFrontier:
     else:
       
       # add to overflow queue
-      self.Q_overflow_urls.put((host_addr, url, ref_page_stats, seed_dist, parent_url))
+      self._overflow_put(host_addr, urlRecord(url, seed_dist, parent, link))
 
       # add to active count
       self.total_crawled += 1
 
 
+  # subfunction for checking a url against its host's robots.txt rules & logging the host's
+  # Crawl-delay against host_addr
+  def _robots_admit(self, url_parts, host_addr, rules):
+    if not rules.allowed(robots_path(url_parts)):
+      if DEBUG_MODE:
+        self.Q_logs.put("*ROBOTS DISALLOWED: %s" % (urlparse.urlunsplit(url_parts),))
+      return False
+    if rules.crawl_delay > self.crawl_delays.get(host_addr, 0.0):
+      self.crawl_delays[host_addr] = rules.crawl_delay
+    return True
+
+
+  # subroutine for holding a url (counted as active) until its host's robots.txt is fetched,
+  # starting the fetch if the url is the host's first
+  def _hold_for_robots(self, url_parts, host_addr, rec):
+    self.Q_active_count.put(True)
+    root_url = robots_root(url_parts.scheme, url_parts.netloc)
+    with self.robots_lock:
+      held = self.robots_held.get(root_url)
+      if held is None:
+        held = self.robots_held[root_url] = []
+        self.robots_pool.apply_async(self._admit_held, (url_parts.scheme, url_parts.netloc, root_url))
+      held.append((url_parts, host_addr, rec))
+
+
+  # robots thread routine: fetch a host's robots.txt, then move the urls held for it to
+  # overflow, or drop them from the active count if disallowed / over budget
+  def _admit_held(self, scheme, netloc, root_url):
+    try:
+      rules = self.robots.get_rules(scheme, netloc)
+      with self.robots_lock:
+        held = self.robots_held.pop(root_url)
+      for url_parts, host_addr, rec in held:
+        if self._robots_admit(url_parts, host_addr, rules) and self.budget.admit(url_parts, host_addr):
+          self.metrics.inc('frontier_urls_admitted_total')
+          self.total_crawled += 1
+          self._overflow_put(host_addr, rec)
+        else:
+          task = self.Q_active_count.get()
+          self.Q_active_count.task_done()
+    except:
+      handle_thread_exception(threading.current_thread().getName(), 'robots-thread', self, self.Q_logs)
+
+
+  # the politeness key (see POLITENESS_KEY) of a netloc resolved to addr
+  def politeness_key(self, netloc, addr):
+    if POLITENESS_KEY == 'ip':
+      return addr
+    hostname = re.sub(r':\d*$', '', netloc[netloc.rfind('@')+1:]).lower()
+    if POLITENESS_KEY == 'domain':
+      return self.suffixes.registrable_domain(hostname)
+    return hostname
+
+
+  # the IP address to fetch a url of the given netloc & hq from, or None if it no longer
+  # resolves
+  def connect_addr(self, netloc, host_addr):
+    if POLITENESS_KEY == 'ip':
+      return host_addr
+    return self._get_and_log_addr(netloc)
+
+
+  # block until one of addr's IP_MAX_CONNECTIONS fetch slots is free, & take it --> True, or
+  # False if the frontier was shut down meanwhile (no slot taken)
+  def acquire_ip(self, addr):
+    with self.ip_cv:
+      if self.ip_fetches.get(addr, 0) >= IP_MAX_CONNECTIONS:
+        self.metrics.inc('crawl_ip_limit_waits_total')
+        while self.ip_fetches.get(addr, 0) >= IP_MAX_CONNECTIONS:
+          if not self.active:
+            return False
+          self.ip_cv.wait(RETRY_CHECK_P)
+      self.ip_fetches[addr] = self.ip_fetches.get(addr, 0) + 1
+    return True
+
+
+  def release_ip(self, addr):
+    with self.ip_cv:
+      n = self.ip_fetches.get(addr, 1) - 1
+      if n > 0:
+        self.ip_fetches[addr] = n
+      else:
+        self.ip_fetches.pop(addr, None)
+      self.ip_cv.notify_all()
+
+
+  # the node owning a url
+  def url_node(self, url, host_addr):
+    if DISTR_ON_FULL_URL:
+      return hash(url) % NUMBER_OF_NODES
+    else:
+      return hash(host_addr) % NUMBER_OF_NODES
+
+
   # subfunction for getting IP address either from DNS cache or web
   def _get_and_log_addr(self, hostname):
     
@@ -218,19 +665,49 @@ class urlFrontier:
       # check time for DNS refresh
       addr, created = self.DNScache[hostname]
       age = now - created
-      if age.seconds > DNS_REFRESH_TIME:
+      if age.seconds <= DNS_REFRESH_TIME:
+        self.metrics.inc('dns_cache_lookups_total', result='hit')
+      else:
+        self.metrics.inc('dns_cache_lookups_total', result='refresh')
         addr = self._get_addr(hostname)
         if addr is not None:
           self.DNScache[hostname] = (addr, now)
         else:
           del self.DNScache[hostname]
     else:
+      self.metrics.inc('dns_cache_lookups_total', result='miss')
       addr = self._get_addr(hostname)
       if addr is not None:
         self.DNScache[hostname] = (addr, now)
     return addr
   
 
+  # resolve (uncached) hostnames in parallel on the given thread pool, into the DNS cache
+  # --> [hostnames not resolved]
+  def resolve_hosts(self, hostnames, pool):
+    now = datetime.datetime.now()
+    failed = []
+    for hostname, addr in zip(hostnames, pool.map(self._get_addr, hostnames)):
+      self.metrics.inc('dns_cache_lookups_total', result='miss')
+      if addr is not None:
+        self.DNScache[hostname] = (addr, now)
+      else:
+        failed.append(hostname)
+    return failed
+
+
+  # fetch the (uncached) robots.txt of urls' hosts in parallel on the given thread pool, into
+  # the robots cache --> number of hosts fetched
+  def prefetch_robots(self, urls, pool):
+    roots = {}
+    for url in urls:
+      url_parts = urlparse.urlsplit(url)
+      if self.robots.cached_rules(url_parts.scheme, url_parts.netloc) is None:
+        roots[robots_root(url_parts.scheme, url_parts.netloc)] = (url_parts.scheme, url_parts.netloc)
+    pool.map(lambda root: self.robots.get_rules(*root), roots.values())
+    return len(roots)
+
+
   # sub-subfunction for getting IP address from socket
   def _get_addr(self, hostname):
     try:
@@ -252,36 +729,77 @@ class urlFrontier:
   # routine is looped so as not to get stuck in an impasse situation
   def clean_and_fill_loop(self):
     hqs_to_make = 0
+    stalled = False
     
     # primary loop- must loop so as not to get stuck in impasse situation
     while self.active:
 
-      # get queue to delete & time to delete at; if no hqs to make then block
-      get_block = (hqs_to_make == 0)
+      # take on any change of hq target
+      hqs_to_make += self._claim_hq_adjust(hqs_to_make)
+
+      # get queue to delete & time to delete at; if no hqs to make (or the last pass over
+      # overflow found no url to make one from) then block (for at most one retry check
+      # period, so that due retries are released & hq target changes taken on time)
+      get_block = (hqs_to_make == 0 or stalled)
       try:
-        time_to_delete, host_addr = self.Q_hq_cleanup.get(get_block)
+        time_to_delete, host_addr = self.Q_hq_cleanup.get(get_block, RETRY_CHECK_P)
 
-        # wait till safe to delete, then delete
-        wait_time = time_to_delete - datetime.datetime.now()
-        time.sleep(max(0, wait_time.total_seconds()))
-        del self.hqs[host_addr]
-        hqs_to_make += 1
+        # wait till safe to delete, then delete; if not due within a retry check period put
+        # back for now
+        wait_time = (time_to_delete - datetime.datetime.now()).total_seconds()
+        if wait_time > RETRY_CHECK_P:
+          self.Q_hq_cleanup.task_done()
+          self.Q_hq_cleanup.put((time_to_delete, host_addr))
+          if get_block:
+            time.sleep(RETRY_CHECK_P)
+        else:
+          time.sleep(max(0, wait_time))
+
+          # a retry released into the hq while it waited here puts it back into service
+          # (its politeness delay is up by now), else it is deleted; an hq already gone has
+          # no slot to give back
+          if not self.hqs.has_key(host_addr):
+            pass
+          elif len(self.hqs[host_addr]) > 0:
+            self.Q_crawl_tasks.put((time_to_delete, host_addr, self._hq_pop(host_addr)))
+          else:
+            for r in self._hq_delete(host_addr):
+              self._overflow_put(host_addr, r)
+            hqs_to_make += 1
+          self.Q_hq_cleanup.task_done()
 
       # if there are still hqs to make, then don't block on getting more cleanup tasks
       except Queue.Empty:
         pass
 
-      # try a bounded number of times to find a url in overflow that doesn't already have an hq
-      for i in range(min(OVERFLOW_TRY_MAX, self.Q_overflow_urls.qsize())):
+      # move due retries / parked host probes back into circulation
+      self._release_due_retries()
+      if hqs_to_make == 0:
+        continue
+
+      # try a bounded number of times to find a url in overflow that doesn't already have an hq,
+      # best scored first; urls of hosts w/ an hq are held for it (& not counted as tries, as
+      # they are not read again), others passed over are put back after, as the queue is in
+      # score order
+      recycled = []
+      stalled = True
+      tries = 0
+      n_left = self.Q_overflow_urls.qsize()
+      while tries < OVERFLOW_TRY_MAX and n_left > 0:
+        n_left -= 1
 
         # get an overflow url tuple
-        r = list(self.Q_overflow_urls.get())
-        host_addr = r[0]
+        e = self.Q_overflow_urls.get()
+        self.Q_overflow_urls.task_done()
+        host_addr, r = e[2], e[3]
 
-        # if hq already exists for this host_addr then recycle and continue
-        if self.hqs.has_key(host_addr):
-          self.Q_overflow_urls.task_done()
-          self.Q_overflow_urls.put(tuple(r))
+        # if hq already exists for this host_addr then hold for it and continue
+        if self._hold_for_hq(e):
+          continue
+
+        # if host is parked hold the url with the parked queue
+        elif self._hold_if_parked(host_addr, r):
+          tries += 1
           continue
 
         # else create a new hq
@@ -292,52 +810,74 @@ class urlFrontier:
           cn = 0
           while cn < OVERFLOW_MULTI_TRY_L:
             try:
-              s = list(self.Q_overflow_urls.get(False))
+              s = self.Q_overflow_urls.get(False)
             
             # don't block on attempt to fill additional urls from overflow here...
             except Queue.Empty:
               break
 
-            # check if the pulled url belongs in the hq, if not recycle
-            if s[0] == host_addr:
-              self.hqs[host_addr].append(tuple(s[1:]))
+            # check if the pulled url belongs in the hq, if not hold or recycle
+            if s[2] == host_addr:
+              self._hq_append(host_addr, s[3])
             else:
-              self.Q_overflow_urls.put(tuple(s))
+              if not self._hold_for_hq(s):
+                recycled.append(s)
               cn += 1
             self.Q_overflow_urls.task_done()
           
           # add the original url from overflow to crawl tasks
-          r.insert(0, datetime.datetime.now())
-          self.Q_crawl_tasks.put(tuple(r))
+          self.Q_crawl_tasks.put((datetime.datetime.now(), host_addr, r))
           hqs_to_make -= 1
-          self.Q_overflow_urls.task_done()
-          self.Q_hq_cleanup.task_done()
+          stalled = False
           break
+      for e in recycled:
+        self.Q_overflow_urls.put(e)
 
 
-  # primary routine for initialization of url frontier / hqs
-  # NOTE: !!! Assumed that this is sole thread running when executed, prior to crawl start
-  def initialize(self, urls=[]):
+  # subroutine for a maintenance thread to take on a share of the pending hq target change,
+  # given its own number of hqs to make --> change to its hqs to make
+  def _claim_hq_adjust(self, hqs_to_make):
+    with self.hq_lock:
+      if self.hq_adjust >= 0:
+        d = self.hq_adjust
+      else:
+        d = -min(-self.hq_adjust, hqs_to_make)
+      self.hq_adjust -= d
+    return d
+
+
+  # primary routine for the crawl scaler to resize the active hqs; growth is made from
+  # overflow by the maintenance threads, shrinkage by not replacing hqs as they empty
+  def set_hq_target(self, n):
+    with self.hq_lock:
+      self.hq_adjust += n - self.hq_target
+      self.hq_target = n
+
+
+  # number of crawl tasks already due, i.e. hosts ready to pull & waiting on a crawl thread
+  def ready_hosts(self):
     now = datetime.datetime.now()
-    
-    # initialize all hqs as either full & tasked or empty & to be deleted
-    i = 0
-    while len(self.hqs) < HQ_TO_THREAD_RATIO*NUMBER_OF_CTHREADS:
-      i += 1
-      
-      # expend all given urls
-      if len(urls) > 0:
-        self._init_add_url(urls.pop())
+    with self.Q_crawl_tasks.mutex:
+      return sum([1 for t in self.Q_crawl_tasks.queue if t[0] <= now])
 
-      # else add empty queues and mark to be cleared & replaced
-      else:
-        self.hqs[i] = []
-        self.Q_hq_cleanup.put((now, i))
 
-    # if there are urls left over, add to appropriate queues
+  # primary routine for initialization of url frontier / hqs, from a list or any iterable
+  # of urls (e.g. a seedLoader's stream)
+  # NOTE: !!! Assumed that this is sole thread running when executed, prior to crawl start
+  def initialize(self, urls=[]):
+
+    # expend all given urls, filling hqs up to the target & the rest into overflow
     for url in urls:
       self._init_add_url(url)
 
+    # initialize any remaining hqs as empty & to be deleted, i.e. cleared & replaced
+    now = datetime.datetime.now()
+    i = 0
+    while len(self.hqs) < self.hq_target:
+      i += 1
+      self.hqs[i] = []
+      self.Q_hq_cleanup.put((now, i))
+
   
   # subroutine for adding url to hq, assuming only one thread running (initialization)
   def _init_add_url(self, url_in):
@@ -366,13 +906,17 @@ class urlFrontier:
     if host_addr is None:
       return False
 
+    # from here on the url's hq is that of its politeness key (its IP address by default)
+    host_addr = self.politeness_key(url_parts.netloc, host_addr)
+
     # if the page belongs to another node, pass to message sending service
-    if DISTR_ON_FULL_URL:
-      url_node = hash(url) % NUMBER_OF_NODES
-    else:
-      url_node = hash(host_addr) % NUMBER_OF_NODES
+    url_node = self.url_node(url, host_addr)
     if url_node != self.node_n:
-      self.Q_to_other_nodes.put((url_node, url, None, 0, None))
+      self.Q_to_other_nodes.put((url_node, urlRecord(url)))
+      return False
+
+    # apply robots.txt policy
+    if not self._robots_admit(url_parts, host_addr, self.robots.get_rules(url_parts.scheme, url_parts.netloc)):
       return False
 
     # add to an existing hq, or create new one & log new crawl task, or add to overflow
@@ -381,12 +925,12 @@ class urlFrontier:
     if DEBUG_MODE:
       self.Q_logs.put("Active count: %s" % self.Q_active_count.qsize())
     if self.hqs.has_key(host_addr):
-      self.hqs[host_addr].append((url, None, 0, None))
-    elif len(self.hqs) < HQ_TO_THREAD_RATIO*NUMBER_OF_CTHREADS:
+      self._hq_append(host_addr, urlRecord(url))
+    elif len(self.hqs) < self.hq_target:
       self.hqs[host_addr] = []
-      self.Q_crawl_tasks.put((datetime.datetime.now(), host_addr, url, None, 0, None))
+      self.Q_crawl_tasks.put((datetime.datetime.now(), host_addr, urlRecord(url)))
     else:
-      self.Q_overflow_urls.put((host_addr, url, None, 0, None))
+      self._overflow_put(host_addr, urlRecord(url))
 
 
   # routine called on abort (by user interrupt or by MAX_CRAWLED count being reached) to
@@ -399,37 +943,62 @@ class urlFrontier:
     # get all urls in Q_crawl_tasks, hqs, or Q_overflow_urls
     # only get urls as these will be re-injected through the initialize method of uf
     with open(RESTART_DUMP, 'w') as f:
-      for thead_name, url in self.thread_active.iteritems():
+      for thead_name, url in self.thread_active.items():
         if url is not None:
           f.write(url + '\n')
 
       while not self.Q_crawl_tasks.empty():
         try:
           r = self.Q_crawl_tasks.get(True, 1)
-          f.write(r[2] + '\n')
+          f.write(r[2].url + '\n')
         except:
           continue
 
-      for host_addr, paths in self.hqs.iteritems():
-        for path in paths:
-          f.write(path[0] + '\n')
+      for host_addr, hq in self.hqs.items():
+        for e in hq:
+          f.write(e[2].url + '\n')
 
       while not self.Q_to_other_nodes.empty():
         try:
           r = self.Q_to_other_nodes.get(True, 1)
-          f.write(r[1] + '\n')
+          f.write(r[1].url + '\n')
         except:
           continue
 
       while not self.Q_overflow_urls.empty():
         try:
           r = self.Q_overflow_urls.get(True, 1)
-          f.write(r[1] + '\n')
+          f.write(r[3].url + '\n')
         except:
           continue
 
-    # ensure seen filter file is synced
+      for host_addr, held in self.overflow_held.items():
+        for e in held:
+          f.write(e[3].url + '\n')
+
+      while not self.Q_retry.empty():
+        try:
+          r = self.Q_retry.get(True, 1)
+          f.write(r[2].url + '\n')
+        except:
+          continue
+
+      for host_addr, recs in self.parked.items():
+        for r in recs:
+          f.write(r.url + '\n')
+
+      for root_url, held in self.robots_held.items():
+        for url_parts, host_addr, r in held:
+          f.write(r.url + '\n')
+
+    # ensure seen filter file is synced, & robots.txt cache, host rate stats, crawl budgets &
+    # latency histograms saved (w/ the trap report)
     self.seen.sync()
+    self.robots.save()
+    self.rates.save()
+    self.budget.save()
+    self.budget.write_report()
+    self.latency.dump()
 
 #
 # --> Command line functionality
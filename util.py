@@ -4,11 +4,13 @@ import sys
 import traceback
 import time
 import MySQLdb as mdb
+import MySQLdb.cursors
 import threading
 import Queue
 import os
 from node_globals import *
 from node_locals import *
+from frontierRecord import parent_of
 import re
 import pickle
 import urlparse
@@ -17,14 +19,15 @@ import datetime
 
 
 # timing using "with"
+# NOTE: wall-clock time- time.clock() is process CPU time on linux, which misses all I/O waits
 class Timer:
   def __enter__(self):
-    self.start = time.clock()
+    self.start = time.time()
     return self
 
   
   def __exit__(self, *args):
-    self.end = time.clock()
+    self.end = time.time()
     self.duration = self.end - self.start
 
 
@@ -55,7 +58,8 @@ def handle_thread_exception(thread_name, thread_type, uf, Q_logs=None, sys_exit=
   
   # log uf detailed state if possible
   if Q_logs is not None:
-    Q_logs.put("uf status: (pd: %s, ct: %s, hqs: %s, ou: %s, hqc: %s, ton: %s)" % (uf.payloads_dropped, uf.Q_crawl_tasks.qsize(), sum([len(v) for k,v in uf.hqs.iteritems()]), uf.Q_overflow_urls.qsize(), uf.Q_hq_cleanup.qsize(), uf.Q_to_other_nodes.qsize()))
+    Q_logs.put("uf status: (pd: %s, ct: %s, hqs: %s, ou: %s, hqc: %s, ton: %s)" % (uf.payloads_dropped, uf.Q_crawl_tasks.qsize(), uf.metrics.value('frontier_hq_urls'), uf.Q_overflow_urls.qsize(), uf.Q_hq_cleanup.qsize(), uf.Q_to_other_nodes.qsize()))
+    Q_logs.put("uf failures: (rq: %s, rt: %s, gu: %s, ph: %s/%s)" % (uf.Q_retry.qsize(), uf.retries, uf.give_ups, len(uf.parked), uf.hosts_parked))
 
   # dump for restart if possible
   uf.dump_for_restart()
@@ -115,8 +119,9 @@ class MsgReceiver(threading.Thread):
             self.Q_logs.put("Received %s from node at %s" % (data_tuple[0], addr))
           
           # pipe into uf via _add_extracted_url
-          url_pkg = (data_tuple[0], data_tuple[1], data_tuple[3])
+          url_pkg = (data_tuple[0],) + parent_of(data_tuple[1], data_tuple[3])
           self.uf._add_extracted_url(None, seed_dist, url_pkg, True)
+          self.uf.metrics.inc('messages_received_total')
 
           # once data has been processed into url frontier, send confirmation
           # NOTE: could be faster -> less cautious here...
@@ -172,16 +177,16 @@ class MsgSender(threading.Thread):
       while self.uf.active:
 
         # get a message to be sent from the queue
-        # of the form: (node_num_to, url, seed_dist, parent_page_stats)
+        # of the form: (node_num_to, rec), sent as (url, ref_page_stats, seed_dist, parent_url)
         data_tuple = self.uf.Q_to_other_nodes.get()
         node_num_to = int(data_tuple[0])
         host_to = NODE_ADDRESSES[node_num_to]
-        data = pickle.dumps(data_tuple[1:])
+        data = pickle.dumps(data_tuple[1].wire())
       
         # send message
         s.sendto(data, (host_to, DEFAULT_IN_PORT))
         if DEBUG_MODE and self.Q_logs is not None:
-          self.Q_logs.put("%s sent to node %s" % (data_tuple[1], node_num_to))
+          self.Q_logs.put("%s sent to node %s" % (data_tuple[1].url, node_num_to))
 
         # wait for confirmation; if no confirm, recycle, log error
         try:
@@ -190,10 +195,11 @@ class MsgSender(threading.Thread):
 
             # on success - update sent count, uf active count, log optionally
             self.Q_scount.put(True)
+            self.uf.metrics.inc('messages_sent_total')
             task = self.uf.Q_active_count.get()
             self.uf.Q_active_count.task_done()
             if self.Q_logs is not None and DEBUG_MODE:
-              self.Q_logs.put("Confirmation on %s received by %s" % (data_tuple[1], addr))
+              self.Q_logs.put("Confirmation on %s received by %s" % (data_tuple[1].url, addr))
           
           # handle improper confirm message (shouldn't occur...)
           else:
@@ -204,8 +210,9 @@ class MsgSender(threading.Thread):
         # handle confirmation receipt timeout- recycle message back to out queue
         except:
           self.uf.Q_to_other_nodes.put(data_tuple)
+          self.uf.metrics.inc('message_confirm_timeouts_total')
           if self.Q_logs is not None:
-            self.Q_logs.put("CONFIRMATION TIMEOUT FROM NODE %s on receipt of %s, placing back in out queue..." % (node_num_to, data_tuple[1]))
+            self.Q_logs.put("CONFIRMATION TIMEOUT FROM NODE %s on receipt of %s, placing back in out queue..." % (node_num_to, data_tuple[1].url))
 
     except:
       handle_thread_exception(self.getName(), 'send-thread', self.uf, self.Q_logs)
@@ -249,8 +256,8 @@ class PostmanThreadDB(threading.Thread):
       with DB_connection(self.db_vars) as handle:
         while True:
           
-          # get item from queue, item must be row_dict
-          mail_dict = self.Q_out.get()
+          # get item from queue, item must be (time_enqueued, row_dict)
+          time_enqueued, mail_dict = self.Q_out.get()
 
           # if max pages crawled has been reached, quit here; note Q_out will be drained
           if not self.uf.active:
@@ -262,11 +269,14 @@ class PostmanThreadDB(threading.Thread):
             # if success, then log if applicable
             self.count_mailed += 1
             self.uf.payloads_dropped += 1
+            self.uf.metrics.inc('payloads_dropped_total')
+            self.uf.metrics.set('payload_writer_lag_seconds', time.time() - time_enqueued)
             if self.Q_logs is not None and DEBUG_MODE:
               self.Q_logs.put("Postman: %s html and features payload dropped!\nTotal payloads dropped = %s" % (mail_dict['url'], self.count_mailed))
 
           # else log as error if applicable, then pass over
           else:
+            self.uf.metrics.inc('payload_write_errors_total')
             if self.Q_logs is not None:
               self.Q_logs.put("DB ERROR: PAYLOAD DROP FOR "+mail_dict['url']+" FAILED!")
 
@@ -312,8 +322,9 @@ class Q_out_to_db:
     t.setDaemon(True)
     t.start()
 
+  # row dicts are stamped with their enqueue time, for tracking writer lag
   def put(self, row_dict):
-    self.Q_out.put(row_dict)
+    self.Q_out.put((time.time(), row_dict))
 
 
 # FOR TRANSFER TO FILE --
@@ -432,12 +443,12 @@ def insert_row_dict(handle, table_name, row_dict):
 
 
 # pop a row
-def pop_row(handle, table_name, delete=True, row_id=None, blocking=True):
+def pop_row(handle, table_name, delete=True, row_id=None, blocking=True, columns='*'):
   row = None
 
   # if blocking is True, loop until row pulled
   while row is None:
-    q = "SELECT * FROM " + table_name
+    q = "SELECT " + columns + " FROM " + table_name
     
     # optional: pop specific row
     if row_id is not None:
@@ -461,6 +472,42 @@ def pop_row(handle, table_name, delete=True, row_id=None, blocking=True):
   return row
 
 
+# iterate over all rows of a table in id order through a server-side cursor, fetching
+# batch_size rows at a time, so ids need not be contiguous & the table never sits in memory
+# NOTE: the connection can run no other queries until the iteration is done
+def stream_rows(handle, table_name, batch_size=BATCH_FETCH_SIZE, columns='*'):
+  cur = handle[0].cursor(mdb.cursors.SSCursor)
+  try:
+    cur.execute("SELECT " + columns + " FROM " + table_name + " ORDER BY id")
+    while True:
+      rows = cur.fetchmany(batch_size)
+      if not rows:
+        break
+      for row in rows:
+        yield row
+  finally:
+    cur.close()
+
+
+# get the rows w/ the given ids w/o deleting
+def select_rows(handle, table_name, ids, columns='*'):
+  if len(ids) == 0:
+    return []
+  q = "SELECT " + columns + " FROM " + table_name + " WHERE id IN (" + ', '.join(["%d" % (int(i),) for i in ids]) + ")"
+  handle[1].execute(q)
+  return handle[1].fetchall()
+
+
+# get up to n rows w/o deleting, passing over the ids in exclude (e.g. rows out for review)
+def fetch_rows(handle, table_name, n, exclude=None, columns='*'):
+  q = "SELECT " + columns + " FROM " + table_name
+  if exclude:
+    q += " WHERE id NOT IN (" + ', '.join(["%d" % (int(i),) for i in exclude]) + ")"
+  q += " LIMIT %d" % (int(n),)
+  handle[1].execute(q)
+  return handle[1].fetchall()
+
+
 # insert or update row by id with dict
 def insert_or_update(handle, table_name, row_id, row_dict):
   q = "INSERT INTO " + table_name + " (id, " + ', '.join(row_dict.keys()) + ") VALUES (" + ', '.join(["%s" for i in range(len(row_dict) + 1)]) + ") ON DUPLICATE KEY UPDATE " + ', '.join(["%s = %s" % (k, v) for k,v in row_dict.iteritems()])
@@ -476,6 +523,20 @@ def insert_or_update(handle, table_name, row_id, row_dict):
     return False
 
 
+# insert or wholly replace row by id with dict; values are passed as query params, so any
+# text (e.g. json) is safe here, unlike insert_or_update
+def replace_row(handle, table_name, row_id, row_dict):
+  q = "REPLACE INTO " + table_name + " (id, " + ', '.join(row_dict.keys()) + ") VALUES (" + ', '.join(["%s" for i in range(len(row_dict) + 1)]) + ")"
+  try:
+    handle[1].execute(q, tuple([row_id] + row_dict.values()))
+    handle[0].commit()
+    return True
+  except mdb.Error, e:
+    print e
+    handle[0].rollback()
+    return False
+
+
 # get n (or ALL if n is None) rows
 def get_rows(handle, table_name, n=None):
   q = "SELECT * FROM " + table_name